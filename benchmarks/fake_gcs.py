@@ -0,0 +1,415 @@
+"""
+Minimal disk-backed stand-in for the GCS JSON API, enough for google-cloud-storage
+pointed at it through STORAGE_EMULATOR_HOST: object metadata, listing, multipart and
+resumable uploads, media downloads (with Range), compose, deletes and
+ifGenerationMatch preconditions. Byte counters are served on /_stats.
+
+Usage: python fake_gcs.py --root /tmp/gcs --port 9023
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import google_crc32c
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class ObjectStore:
+    """Objects live in <root>/<bucket>/<quoted name>; metadata is kept in memory."""
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.sessions = {}
+        self.stats = {"bytes_received": 0, "bytes_sent": 0, "requests": 0}
+
+    def count(self, key, amount):
+        with self.lock:
+            self.stats[key] += amount
+
+    def data_path(self, bucket, name):
+        directory = os.path.join(self.root, bucket)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, quote(name, safe=""))
+
+    def get(self, bucket, name):
+        with self.lock:
+            meta = self.objects.get((bucket, name))
+            return dict(meta) if meta else None
+
+    def list(self, bucket, prefix=""):
+        with self.lock:
+            return [dict(meta) for (b, name), meta in sorted(self.objects.items()) if b == bucket and name.startswith(prefix)]
+
+    def check_generation(self, bucket, name, if_generation_match):
+        if if_generation_match is None:
+            return True
+        meta = self.get(bucket, name)
+        current = int(meta["generation"]) if meta else 0
+        return current == int(if_generation_match)
+
+    def commit(self, bucket, name, tmp_path, resource, if_generation_match=None, md5=True):
+        """Moves a fully written temporary file into place as a new generation."""
+        crc = google_crc32c.Checksum()
+        digest = hashlib.md5() if md5 else None
+        size = 0
+        with open(tmp_path, "rb") as f:
+            while chunk := f.read(COPY_CHUNK_SIZE):
+                crc.update(chunk)
+                if digest:
+                    digest.update(chunk)
+                size += len(chunk)
+        with self.lock:
+            existing = self.objects.get((bucket, name))
+            current = int(existing["generation"]) if existing else 0
+            if if_generation_match is not None and current != int(if_generation_match):
+                os.remove(tmp_path)
+                return None
+            os.replace(tmp_path, self.data_path(bucket, name))
+            now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+            meta = {
+                "kind": "storage#object",
+                "bucket": bucket,
+                "name": name,
+                "id": f"{bucket}/{name}",
+                "generation": str(max(time.time_ns() // 1000, current + 1)),
+                "metageneration": "1",
+                "size": str(size),
+                "contentType": resource.get("contentType") or "application/octet-stream",
+                "crc32c": base64.b64encode(crc.digest()).decode(),
+                "timeCreated": now,
+                "updated": now,
+            }
+            if digest:
+                meta["md5Hash"] = base64.b64encode(digest.digest()).decode()
+            if resource.get("metadata"):
+                meta["metadata"] = resource["metadata"]
+            self.objects[(bucket, name)] = meta
+            return dict(meta)
+
+    def delete(self, bucket, name):
+        with self.lock:
+            meta = self.objects.pop((bucket, name), None)
+        if meta:
+            try:
+                os.remove(self.data_path(bucket, name))
+            except FileNotFoundError:
+                pass
+        return meta
+
+    def tmp_path(self):
+        directory = os.path.join(self.root, ".tmp")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, uuid.uuid4().hex)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- helpers -----------------------------------------------------------------
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def _error(self, status, message):
+        self._send_json(status, {"error": {"code": status, "message": message, "errors": [{"message": message}]}})
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length else b""
+        self.store.count("bytes_received", len(data))
+        return data
+
+    def _stream_body_to(self, f):
+        remaining = int(self.headers.get("Content-Length") or 0)
+        while remaining:
+            chunk = self.rfile.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            f.write(chunk)
+            remaining -= len(chunk)
+            self.store.count("bytes_received", len(chunk))
+
+    def _route(self):
+        parts = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        path = parts.path
+        for prefix in ("/download/storage/v1/b/", "/upload/storage/v1/b/", "/storage/v1/b/"):
+            if path.startswith(prefix):
+                rest = path[len(prefix):]
+                bucket, _, tail = rest.partition("/")
+                kind = prefix.split("/")[1]
+                if kind == "storage":
+                    kind = "json"
+                return kind, unquote(bucket), tail, query
+        return None, None, path, query
+
+    @staticmethod
+    def _object_name(tail):
+        """'o/<quoted name>[/compose]' -> (name, action)."""
+        if not tail.startswith("o/"):
+            return None, None
+        encoded = tail[2:]
+        if encoded.endswith("/compose"):
+            return unquote(encoded[:-len("/compose")]), "compose"
+        return unquote(encoded), None
+
+    # --- verbs -------------------------------------------------------------------
+
+    def do_GET(self):
+        self.store.count("requests", 1)
+        if self.path == "/_stats":
+            with self.store.lock:
+                return self._send_json(200, dict(self.store.stats))
+        kind, bucket, tail, query = self._route()
+        if kind is None:
+            return self._error(404, "Not found")
+        if tail in ("o", "o/"):
+            items = self.store.list(bucket, query.get("prefix", ""))
+            limit = int(query.get("maxResults", 0) or 0)
+            return self._send_json(200, {"kind": "storage#objects", "items": items[:limit] if limit else items})
+        name, _ = self._object_name(tail)
+        if name is None:
+            if not tail:
+                return self._send_json(200, {"kind": "storage#bucket", "name": bucket, "id": bucket})
+            return self._error(404, "Not found")
+        meta = self.store.get(bucket, name)
+        if meta is None:
+            return self._error(404, f"No such object: {bucket}/{name}")
+        if "ifGenerationMatch" in query and meta["generation"] != query["ifGenerationMatch"]:
+            return self._error(412, "Precondition Failed")
+        if kind == "download" or query.get("alt") == "media":
+            return self._send_media(bucket, name, meta)
+        return self._send_json(200, meta)
+
+    def _send_media(self, bucket, name, meta):
+        size = int(meta["size"])
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes=") and size:
+            first, _, last = range_header[len("bytes="):].partition("-")
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            else:
+                start = max(0, size - int(last))
+            status = 206
+        length = max(0, end - start + 1)
+        self.send_response(status)
+        self.send_header("Content-Type", meta["contentType"])
+        self.send_header("Content-Length", str(length))
+        self.send_header("X-Goog-Generation", meta["generation"])
+        hashes = [f"crc32c={meta['crc32c']}"] + ([f"md5={meta['md5Hash']}"] if "md5Hash" in meta else [])
+        if status == 200:
+            self.send_header("X-Goog-Hash", ",".join(hashes))
+        else:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        with open(self.store.data_path(bucket, name), "rb") as f:
+            f.seek(start)
+            remaining = length
+            while remaining:
+                chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+                self.store.count("bytes_sent", len(chunk))
+
+    def do_DELETE(self):
+        self.store.count("requests", 1)
+        kind, bucket, tail, query = self._route()
+        if kind == "upload" and "upload_id" in query:
+            with self.store.lock:
+                session = self.store.sessions.pop(query["upload_id"], None)
+            if session and os.path.exists(session["tmp"]):
+                os.remove(session["tmp"])
+            return self._send_empty(499)
+        name, _ = self._object_name(tail or "")
+        if kind != "json" or name is None:
+            return self._error(404, "Not found")
+        if not self.store.check_generation(bucket, name, query.get("ifGenerationMatch")):
+            return self._error(412, "Precondition Failed")
+        if self.store.delete(bucket, name) is None:
+            return self._error(404, f"No such object: {bucket}/{name}")
+        self._send_empty(204)
+
+    def do_PATCH(self):
+        self.store.count("requests", 1)
+        kind, bucket, tail, query = self._route()
+        name, _ = self._object_name(tail or "")
+        body = json.loads(self._read_body() or b"{}")
+        with self.store.lock:
+            meta = self.store.objects.get((bucket, name))
+            if meta is None:
+                return self._error(404, f"No such object: {bucket}/{name}")
+            if "metadata" in body:
+                meta["metadata"] = {**meta.get("metadata", {}), **(body["metadata"] or {})}
+            meta["metageneration"] = str(int(meta["metageneration"]) + 1)
+            result = dict(meta)
+        self._send_json(200, result)
+
+    def do_POST(self):
+        self.store.count("requests", 1)
+        kind, bucket, tail, query = self._route()
+        if kind == "upload":
+            upload_type = query.get("uploadType")
+            if upload_type == "multipart":
+                return self._multipart_upload(bucket, query)
+            if upload_type == "resumable":
+                return self._start_resumable(bucket, query)
+            return self._error(400, f"Unsupported uploadType: {upload_type}")
+        name, action = self._object_name(tail or "")
+        if kind == "json" and action == "compose":
+            return self._compose(bucket, name, query)
+        self._error(404, "Not found")
+
+    def do_PUT(self):
+        self.store.count("requests", 1)
+        _, _, _, query = self._route()
+        with self.store.lock:
+            session = self.store.sessions.get(query.get("upload_id"))
+        if session is None:
+            return self._error(404, "No such upload session")
+
+        content_range = self.headers.get("Content-Range", "")
+        spec, _, total = content_range.replace("bytes ", "").partition("/")
+        with open(session["tmp"], "ab") as f:
+            if spec != "*":
+                start = int(spec.split("-")[0])
+                if start != f.tell():
+                    self._read_body()
+                    return self._send_empty(308, self._range_header(f.tell()))
+            self._stream_body_to(f)
+            written = f.tell()
+
+        if total == "*" or int(total) != written:
+            return self._send_empty(308, self._range_header(written))
+
+        with self.store.lock:
+            self.store.sessions.pop(query["upload_id"], None)
+        meta = self.store.commit(
+            session["bucket"], session["name"], session["tmp"], session["resource"], session["if_generation_match"]
+        )
+        if meta is None:
+            return self._error(412, "Precondition Failed")
+        self._send_json(200, meta)
+
+    @staticmethod
+    def _range_header(written):
+        return {"Range": f"bytes=0-{written - 1}"} if written else {}
+
+    def _multipart_upload(self, bucket, query):
+        body = self._read_body()
+        content_type = self.headers.get("Content-Type", "")
+        boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+        sections = body.split(b"--" + boundary)
+        resource = json.loads(sections[1].split(b"\r\n\r\n", 1)[1].strip())
+        media = sections[2].split(b"\r\n\r\n", 1)[1]
+        if media.endswith(b"\r\n"):
+            media = media[:-2]
+        name = resource.get("name") or query.get("name")
+        tmp = self.store.tmp_path()
+        with open(tmp, "wb") as f:
+            f.write(media)
+        meta = self.store.commit(bucket, name, tmp, resource, query.get("ifGenerationMatch"))
+        if meta is None:
+            return self._error(412, "Precondition Failed")
+        self._send_json(200, meta)
+
+    def _start_resumable(self, bucket, query):
+        body = self._read_body()
+        resource = json.loads(body) if body else {}
+        name = resource.get("name") or query.get("name")
+        upload_id = uuid.uuid4().hex
+        tmp = self.store.tmp_path()
+        open(tmp, "wb").close()
+        with self.store.lock:
+            self.store.sessions[upload_id] = {
+                "bucket": bucket,
+                "name": name,
+                "resource": resource,
+                "tmp": tmp,
+                "if_generation_match": query.get("ifGenerationMatch"),
+            }
+        host = self.headers.get("Host")
+        location = f"http://{host}/upload/storage/v1/b/{quote(bucket, safe='')}/o?uploadType=resumable&upload_id={upload_id}"
+        self._send_empty(200, {"Location": location})
+
+    def _compose(self, bucket, name, query):
+        body = json.loads(self._read_body() or b"{}")
+        sources = [source["name"] for source in body.get("sourceObjects", [])]
+        tmp = self.store.tmp_path()
+        with open(tmp, "wb") as out:
+            for source in sources:
+                if self.store.get(bucket, source) is None:
+                    os.remove(tmp)
+                    return self._error(404, f"No such object: {bucket}/{source}")
+                with open(self.store.data_path(bucket, source), "rb") as f:
+                    shutil.copyfileobj(f, out, COPY_CHUNK_SIZE)
+        # Composite objects carry no MD5, as on real GCS.
+        meta = self.store.commit(bucket, name, tmp, body.get("destination") or {}, query.get("ifGenerationMatch"), md5=False)
+        if meta is None:
+            return self._error(412, "Precondition Failed")
+        meta["componentCount"] = len(sources)
+        self._send_json(200, meta)
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing a kept-alive or partially read connection is routine here.
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+
+def serve(root, host="127.0.0.1", port=0):
+    """Starts the server on a background thread and returns it; server.server_address has the port."""
+    os.makedirs(root, exist_ok=True)
+    handler = type("FakeGcsHandler", (Handler,), {"store": ObjectStore(root)})
+    server = QuietHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="fake-gcs", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", required=True, help="Directory holding the object data")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9023)
+    args = parser.parse_args()
+    server = serve(args.root, args.host, args.port)
+    print(f"Fake GCS listening on http://{args.host}:{server.server_address[1]}")
+    threading.Event().wait()
@@ -0,0 +1,191 @@
+"""
+Local stand-in for developers.google.com/android/ota: serves a synthetic OTA page
+with one row per device and the OTA zips behind it, with HTTP Range support so the
+segmented downloader takes its parallel path. The page carries an ETag and a
+Last-Modified date and answers conditional requests with 304. Byte and request
+counters are served on /_stats.
+
+Usage: python ota_server.py --ota frankel=/path/to/ota.zip --port 9024
+"""
+import argparse
+import hashlib
+import html
+import json
+import os
+import sys
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>Full OTA Images for Nexus and Pixel Devices</title></head>
+<body>
+<h2 id="{device}">"{device}" for Pixel</h2>
+<table>
+<tr><th>Version</th><th>Download</th><th>SHA-256 Checksum</th></tr>
+{rows}
+</table>
+</body></html>
+"""
+
+ROW_TEMPLATE = (
+    '<tr id="{device}{build}"><td>{version}</td>'
+    '<td><a href="{url}">Link</a></td><td>{sha256}</td></tr>'
+)
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(COPY_CHUNK_SIZE):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class OtaSite:
+    """Maps device codenames to (zip path, sha256) and renders the OTA table."""
+
+    def __init__(self, otas):
+        self.files = {}
+        self.rows = []
+        self.lock = threading.Lock()
+        self.stats = {"bytes_sent": 0, "requests": 0, "page_requests": 0, "page_not_modified": 0}
+        self.last_modified = formatdate(usegmt=True)
+        for device, path in otas.items():
+            name = os.path.basename(path)
+            self.files[f"/ota/{name}"] = path
+            self.rows.append((device, name, file_sha256(path)))
+
+    def count(self, key, amount):
+        with self.lock:
+            self.stats[key] += amount
+
+    def page(self, base_url):
+        rows = []
+        for index, (device, name, sha256) in enumerate(self.rows):
+            version = os.path.splitext(name)[0]
+            rows.append(ROW_TEMPLATE.format(
+                device=html.escape(device), build=index, version=html.escape(version),
+                url=html.escape(f"{base_url}/ota/{name}"), sha256=sha256,
+            ))
+        devices = ", ".join(device for device, _, _ in self.rows)
+        return PAGE_TEMPLATE.format(device=html.escape(devices), rows="\n".join(rows)).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    site = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_bytes(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.site.count("requests", 1)
+        path = self.path.split("?", 1)[0]
+        if path == "/_stats":
+            with self.site.lock:
+                return self._send_bytes(200, json.dumps(self.site.stats).encode(), "application/json")
+        if path in ("/", "/android/ota"):
+            self.site.count("page_requests", 1)
+            return self._send_page()
+        file_path = self.site.files.get(path)
+        if not file_path:
+            return self._send_bytes(404, b"Not found", "text/plain")
+        self._send_file(file_path)
+
+    def _send_page(self):
+        page = self.site.page(f"http://{self.headers.get('Host')}")
+        etag = f'"{hashlib.sha256(page).hexdigest()[:32]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.site.count("page_not_modified", 1)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.site.count("bytes_sent", len(page))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.site.last_modified)
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def _send_file(self, path):
+        size = os.path.getsize(path)
+        start, end, status = 0, size - 1, 200
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[len("bytes="):].split(",")[0].partition("-")
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            else:
+                start = max(0, size - int(last))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        length = end - start + 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(length))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = length
+            try:
+                while remaining:
+                    chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+                    self.site.count("bytes_sent", len(chunk))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing a kept-alive or partially read connection is routine here.
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+
+def serve(otas, host="127.0.0.1", port=0):
+    """Starts the server on a background thread and returns it; the page is at http://host:port/android/ota."""
+    handler = type("OtaHandler", (Handler,), {"site": OtaSite(otas)})
+    server = QuietHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="ota-server", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ota", action="append", required=True, metavar="DEVICE=ZIP",
+                        help="Serve ZIP as the latest OTA of DEVICE (repeatable)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9024)
+    args = parser.parse_args()
+    server = serve(dict(item.split("=", 1) for item in args.ota), args.host, args.port)
+    print(f"OTA page at http://{args.host}:{server.server_address[1]}/android/ota")
+    threading.Event().wait()
@@ -0,0 +1,102 @@
+"""
+Size against time of the --minimal package at each deflate level, to pick
+PACKAGE_COMPRESSION_LEVEL. Packs a directory of partition images with
+avb_patcher.package_minimal, the same call the pipeline makes.
+
+Pass --images with the images `avbroot ota extract` wrote for a real build; without
+it, stand-ins shaped like Pixel boot images are generated: an uncompressed kernel
+(code-like data, here the ELF files of this Python install) and LZ4-style ramdisks
+(incompressible data), each zero-padded to its partition size.
+
+Usage:
+    python benchmarks/package_levels.py --images /app/output/ksu_patched_<ota> --levels 0,1,6,9
+    python benchmarks/package_levels.py --output package_levels.json
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+
+import avb_patcher  # noqa: E402
+
+MIB = 1024 * 1024
+# name: (partition size, kernel-like bytes, ramdisk-like bytes)
+STAND_INS = {
+    "boot.img": (64 * MIB, 40 * MIB, 0),
+    "init_boot.img": (8 * MIB, 0, 3 * MIB),
+    "vendor_boot.img": (64 * MIB, 0, 24 * MIB),
+    "vbmeta.img": (64 * 1024, 0, 8 * 1024),
+}
+
+
+def _code_like(nbytes):
+    """Bytes from shared libraries and executables, as a stand-in for an uncompressed kernel."""
+    out = bytearray()
+    candidates = sorted(glob.glob(os.path.join(sys.prefix, "lib", "**", "*.so*"), recursive=True))
+    candidates += [sys.executable]
+    for path in candidates:
+        if len(out) >= nbytes:
+            break
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                out += f.read(nbytes - len(out))
+    while len(out) < nbytes:
+        out += out[:nbytes - len(out)]
+    return bytes(out)
+
+
+def write_stand_ins(directory):
+    os.makedirs(directory, exist_ok=True)
+    for name, (size, code, ramdisk) in STAND_INS.items():
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(_code_like(code))
+            f.write(os.urandom(ramdisk))
+            f.write(bytes(size - code - ramdisk))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="Directory of partition images (default: generated stand-ins)")
+    parser.add_argument("--levels", default="0,1,6,9", help="Comma-separated deflate levels")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per level; the median is reported")
+    parser.add_argument("--output", help="Results JSON path")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="pixel-levels-")
+    try:
+        images = args.images
+        if not images:
+            images = os.path.join(root, "images")
+            write_stand_ins(images)
+        results = []
+        for level in (int(x) for x in args.levels.split(",")):
+            runs = [avb_patcher.package_minimal(os.path.join(root, "minimal.zip"), images, "bench", "bench-ota.zip", level)
+                    for _ in range(args.repeat)]
+            results.append({
+                "level": level,
+                "input_bytes": runs[0]["input_bytes"],
+                "output_bytes": runs[0]["output_bytes"],
+                "seconds": statistics.median(run["seconds"] for run in runs),
+            })
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f"\n{'level':>6} {'input MiB':>10} {'output MiB':>11} {'ratio':>6} {'seconds':>8}")
+    for r in results:
+        print(f"{r['level']:>6} {r['input_bytes'] / MIB:>10.1f} {r['output_bytes'] / MIB:>11.1f} "
+              f"{r['output_bytes'] / r['input_bytes']:>6.2f} {r['seconds']:>8.2f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"images": args.images or "stand-ins", "results": results}, f, indent=4)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
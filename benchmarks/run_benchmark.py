@@ -0,0 +1,389 @@
+"""
+End-to-end benchmark of pixel_automator against local stand-ins: a synthetic OTA page
+and zip served over HTTP with Range support (ota_server.py), a disk-backed fake GCS
+(fake_gcs.py) and stub avbroot / custota-tool / avbtool.py binaries (stubs/) with a
+configurable runtime. Every run starts from an empty output directory and bucket.
+
+Per run it records wall time, peak RSS (largest process in the tree), per-stage
+timings from build_status.json and the bytes moved through each server, and writes
+everything to a JSON file that --compare can diff against a later run.
+
+Usage:
+    python benchmarks/run_benchmark.py --sizes 256M,1G,4G --avbroot-seconds 5 --output results.json
+    python benchmarks/run_benchmark.py --sizes 256M --output new.json --compare results.json
+"""
+import argparse
+import hashlib
+import json
+import lzma
+import os
+import platform
+import shlex
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import zipfile
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+SRC_DIR = os.path.join(REPO_DIR, "src")
+STUBS_DIR = os.path.join(BENCH_DIR, "stubs")
+sys.path.insert(0, BENCH_DIR)
+
+import fake_gcs  # noqa: E402
+import ota_server  # noqa: E402
+
+GENERATE_CHUNK_SIZE = 4 * 1024 * 1024
+PAYLOAD_BLOCK_SIZE = 4096
+PAYLOAD_OP_BLOCKS = 512  # 2 MiB per install operation, like update_engine's full payloads
+PAYLOAD_OP_REPLACE, PAYLOAD_OP_ZERO, PAYLOAD_OP_REPLACE_XZ = 0, 6, 8
+PAYLOAD_SMALL_PARTITIONS = [("init_boot", 8 * 1024**2), ("vbmeta", 64 * 1024), ("vendor_boot", 16 * 1024**2)]
+SIZE_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3}
+BUCKET_NAME = "bench-releases"
+CACHE_BUCKET_NAME = "bench-cache"
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def _pb_varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _pb_field(number, value):
+    """One protobuf field: ints as varints, bytes as length-delimited."""
+    if isinstance(value, int):
+        return _pb_varint(number << 3) + _pb_varint(value)
+    return _pb_varint(number << 3 | 2) + _pb_varint(len(value)) + value
+
+
+def _write_partition(name, size, blobs, compressible):
+    """Writes the blobs of one partition and returns its PartitionUpdate message."""
+    partition_sha = hashlib.sha256()
+    ops = []
+    for start_block in range(0, size // PAYLOAD_BLOCK_SIZE, PAYLOAD_OP_BLOCKS):
+        blocks = min(PAYLOAD_OP_BLOCKS, size // PAYLOAD_BLOCK_SIZE - start_block)
+        length = blocks * PAYLOAD_BLOCK_SIZE
+        extent = _pb_field(6, _pb_field(1, start_block) + _pb_field(2, blocks))
+        if compressible and start_block % (4 * PAYLOAD_OP_BLOCKS) == 0:
+            # Real images mix incompressible data with runs of zeros and compressible data.
+            partition_sha.update(bytes(length))
+            ops.append(_pb_field(1, PAYLOAD_OP_ZERO) + extent)
+            continue
+        data = (os.urandom(64) * (length // 64)) if compressible else os.urandom(length)
+        partition_sha.update(data)
+        op_type, blob = PAYLOAD_OP_REPLACE, data
+        if compressible:
+            op_type, blob = PAYLOAD_OP_REPLACE_XZ, lzma.compress(data, preset=0)
+        ops.append(_pb_field(1, op_type) + _pb_field(2, blobs.tell()) + _pb_field(3, len(blob))
+                   + extent + _pb_field(8, hashlib.sha256(blob).digest()))
+        blobs.write(blob)
+    info = _pb_field(1, size) + _pb_field(2, partition_sha.digest())
+    return _pb_field(1, name.encode()) + _pb_field(7, info) + b"".join(_pb_field(8, op) for op in ops)
+
+
+def generate_ota(path, size):
+    """
+    Writes an OTA-shaped zip whose stored payload.bin brings the file to about `size` bytes.
+    The payload is a valid full payload (manifest, per-operation hashes, partition hashes):
+    small compressible partitions and a random "system" partition holding the rest.
+    """
+    if os.path.exists(path):
+        return path
+    tmp = f"{path}.tmp"
+    partitions = [(name, part_size, True) for name, part_size in PAYLOAD_SMALL_PARTITIONS]
+    # The small partitions compress to almost nothing, so "system" alone sets the file size.
+    partitions.append(("system", max(size // PAYLOAD_BLOCK_SIZE, 1) * PAYLOAD_BLOCK_SIZE, False))
+    with tempfile.TemporaryFile(dir=os.path.dirname(path)) as blobs:
+        messages = [_write_partition(name, part_size, blobs, compressible)
+                    for name, part_size, compressible in partitions]
+        manifest = _pb_field(3, PAYLOAD_BLOCK_SIZE) + b"".join(_pb_field(13, m) for m in messages)
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED) as z:
+            z.writestr("META-INF/com/android/metadata", "ota-type=AB\npre-device=bench\n")
+            z.writestr("payload_properties.txt", f"FILE_SIZE={size}\n")
+            with z.open("payload.bin", "w", force_zip64=True) as payload:
+                payload.write(struct.pack(">4sQQL", b"CrAU", 2, len(manifest), 0) + manifest)
+                blobs.seek(0)
+                shutil.copyfileobj(blobs, payload, GENERATE_CHUNK_SIZE)
+    os.replace(tmp, path)
+    return path
+
+
+def generate_magisk(path):
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("assets/util_functions.sh", "# benchmark placeholder\n")
+    return path
+
+
+def generate_key(path):
+    subprocess.run(["openssl", "genrsa", "-out", path, "2048"], check=True, capture_output=True)
+    return path
+
+
+def fetch_stats(server):
+    host, port = server.server_address[:2]
+    with urllib.request.urlopen(f"http://{host}:{port}/_stats", timeout=10) as response:
+        return json.load(response)
+
+
+def run_automator(argv, env, cwd, log_path):
+    """Runs pixel_automator.py to completion; returns (exit code, wall seconds, peak RSS in MiB)."""
+    with open(log_path, "wb") as log_file:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(SRC_DIR, "pixel_automator.py"), *argv],
+            cwd=cwd, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+        )
+        # wait4 reports the child's rusage; ru_maxrss already folds in its reaped children (avbroot etc.).
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, wall, round(usage.ru_maxrss / 1024, 1)
+
+
+def read_build_status(output_dir):
+    path = os.path.join(output_dir, "build_status.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get("build_meta", {})
+
+
+def bench_run(args, root, label, ota_path, key_path, magisk_path, repeat):
+    run_dir = os.path.join(root, f"run-{label}-{repeat}")
+    work_dir = os.path.join(run_dir, "work")
+    output_dir = os.path.join(run_dir, "output")
+    os.makedirs(work_dir)
+    os.makedirs(output_dir)
+
+    ota = ota_server.serve({args.device: ota_path})
+    gcs = None if args.no_gcs or args.local_bucket else fake_gcs.serve(os.path.join(run_dir, "gcs"))
+    try:
+        env = dict(os.environ)
+        for name in ("BUCKET_NAME", "_BUCKET_NAME", "CACHE_BUCKET_NAME", "GOOGLE_CLOUD_PROJECT"):
+            env.pop(name, None)
+        env.update({
+            "PATH": f"{STUBS_DIR}{os.pathsep}{env.get('PATH', '')}",
+            "OTA_PAGE_URL": f"http://127.0.0.1:{ota.server_address[1]}/android/ota",
+            "OUTPUT_DIR": output_dir,
+            "BATCH_WORK_DIR": os.path.join(run_dir, "batch"),
+            "MAGISK_PATH": magisk_path,
+            "AVBTOOL_PATH": os.path.join(STUBS_DIR, "avbtool.py"),
+            "_DEVICE_CODENAME": args.device,
+            "AVBROOT_STUB_SECONDS": str(args.avbroot_seconds),
+            "AVBROOT_STUB_EXTRACT_SECONDS": str(args.extract_seconds),
+            "CUSTOTA_STUB_SECONDS": str(args.custota_seconds),
+            "METRICS_EXPORTER": "file",
+            "METRICS_FILE": os.path.join(run_dir, "metrics.jsonl"),
+            "PYTHONUNBUFFERED": "1",
+        })
+        if gcs:
+            env["STORAGE_EMULATOR_HOST"] = f"http://127.0.0.1:{gcs.server_address[1]}"
+            env["BUCKET_NAME"] = BUCKET_NAME
+            if args.cache_bucket:
+                env["CACHE_BUCKET_NAME"] = CACHE_BUCKET_NAME
+        elif args.local_bucket:
+            env["BUCKET_NAME"] = f"file://{os.path.join(run_dir, 'bucket')}"
+            if args.cache_bucket:
+                env["CACHE_BUCKET_NAME"] = f"file://{os.path.join(run_dir, 'cache')}"
+
+        argv = ["--local-key", key_path, *shlex.split(args.automator_args)]
+        log_path = os.path.join(run_dir, "pixel_automator.log")
+        exit_code, wall, peak_rss = run_automator(argv, env, work_dir, log_path)
+
+        build_meta = read_build_status(output_dir)
+        ota_stats = fetch_stats(ota)
+        gcs_stats = fetch_stats(gcs) if gcs else {}
+        noop = bench_noop_runs(args, argv, env, work_dir, run_dir, ota, gcs) if args.noop_runs else None
+    finally:
+        ota.shutdown()
+        if gcs:
+            gcs.shutdown()
+
+    result = {
+        "size": label,
+        "input_bytes": os.path.getsize(ota_path),
+        "repeat": repeat,
+        "exit_code": exit_code,
+        "wall_seconds": round(wall, 3),
+        "peak_rss_mb": peak_rss,
+        "stages": build_meta.get("stages", {}),
+        "disk_budget": build_meta.get("disk_budget"),
+        "bytes": {
+            "ota_served": ota_stats.get("bytes_sent", 0),
+            "gcs_uploaded": gcs_stats.get("bytes_received", 0),
+            "gcs_downloaded": gcs_stats.get("bytes_sent", 0),
+            "gcs_requests": gcs_stats.get("requests", 0),
+        },
+        "noop": noop,
+        "log": log_path if args.keep else None,
+    }
+    if not args.keep:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return result
+
+
+def bench_noop_runs(args, argv, env, work_dir, run_dir, ota, gcs):
+    """
+    Reruns the pipeline against the bucket and output of the cold run with nothing new
+    on the OTA page, recording wall time and the OTA page and GCS requests of each run.
+    """
+    runs = []
+    for index in range(args.noop_runs):
+        ota_before = fetch_stats(ota)
+        gcs_before = fetch_stats(gcs) if gcs else {}
+        log_path = os.path.join(run_dir, f"pixel_automator-noop{index}.log")
+        exit_code, wall, _ = run_automator(argv, env, work_dir, log_path)
+        ota_after = fetch_stats(ota)
+        gcs_after = fetch_stats(gcs) if gcs else {}
+        runs.append({
+            "exit_code": exit_code,
+            "wall_seconds": round(wall, 3),
+            "page_fetches": ota_after["page_requests"] - ota_before["page_requests"],
+            "page_not_modified": ota_after["page_not_modified"] - ota_before["page_not_modified"],
+            "gcs_requests": gcs_after.get("requests", 0) - gcs_before.get("requests", 0),
+        })
+    return {
+        "wall_p50": round(statistics.median(run["wall_seconds"] for run in runs), 3),
+        "page_fetches_p50": statistics.median(run["page_fetches"] for run in runs),
+        "runs": runs,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "-C", REPO_DIR, "rev-parse", "--short", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(results):
+    print(f"\n{'size':>8} {'exit':>4} {'wall s':>8} {'rss MiB':>8} {'served MiB':>10} {'uploaded MiB':>12}  slowest stages")
+    for run in results["runs"]:
+        slowest = sorted(run["stages"].items(), key=lambda item: item[1]["seconds"], reverse=True)[:3]
+        stages = ", ".join(f"{name} {entry['seconds']:.1f}s" for name, entry in slowest)
+        print(f"{run['size']:>8} {run['exit_code']:>4} {run['wall_seconds']:>8.2f} {run['peak_rss_mb']:>8.1f} "
+              f"{run['bytes']['ota_served'] / 1024**2:>10.1f} {run['bytes']['gcs_uploaded'] / 1024**2:>12.1f}  {stages}")
+        if run.get("noop"):
+            noop = run["noop"]
+            exits = sorted({entry["exit_code"] for entry in noop["runs"]})
+            print(f"{'':>8} no-op x{len(noop['runs'])}: p50 {noop['wall_p50']:.2f}s, "
+                  f"{noop['page_fetches_p50']:g} page fetch(es) per run, exit {exits}")
+
+
+def _best_by_size(results):
+    best = {}
+    for run in results["runs"]:
+        if run["exit_code"] == 0 and (run["size"] not in best or run["wall_seconds"] < best[run["size"]]["wall_seconds"]):
+            best[run["size"]] = run
+    return best
+
+
+def print_comparison(results, baseline):
+    """Wall time and per-stage deltas of the fastest successful run per size."""
+    current, previous = _best_by_size(results), _best_by_size(baseline)
+    print(f"\nComparison against {baseline.get('git_commit') or 'baseline'} ({baseline.get('timestamp')}):")
+    for size, run in current.items():
+        old = previous.get(size)
+        if not old:
+            print(f"  {size}: no baseline run")
+            continue
+        delta = run["wall_seconds"] - old["wall_seconds"]
+        print(f"  {size}: wall {old['wall_seconds']:.2f}s -> {run['wall_seconds']:.2f}s ({delta:+.2f}s), "
+              f"rss {old['peak_rss_mb']:.0f} -> {run['peak_rss_mb']:.0f} MiB")
+        if run.get("noop") and old.get("noop"):
+            print(f"      no-op p50: {old['noop']['wall_p50']:.2f}s -> {run['noop']['wall_p50']:.2f}s, "
+                  f"page fetches {old['noop']['page_fetches_p50']:g} -> {run['noop']['page_fetches_p50']:g}")
+        for stage in sorted(set(run["stages"]) | set(old["stages"])):
+            new_seconds = run["stages"].get(stage, {}).get("seconds")
+            old_seconds = old["stages"].get(stage, {}).get("seconds")
+            if new_seconds is None or old_seconds is None:
+                print(f"      {stage}: {old_seconds} -> {new_seconds}")
+            elif abs(new_seconds - old_seconds) >= 0.05:
+                print(f"      {stage}: {old_seconds:.2f}s -> {new_seconds:.2f}s ({new_seconds - old_seconds:+.2f}s)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of pixel_automator.")
+    parser.add_argument("--sizes", default="256M,1G", help="Comma-separated input OTA sizes (K/M/G suffixes)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per size")
+    parser.add_argument("--device", default="frankel")
+    parser.add_argument("--avbroot-seconds", type=float, default=0, help="Simulated `avbroot ota patch` runtime")
+    parser.add_argument("--extract-seconds", type=float, default=0, help="Simulated `avbroot ota extract` runtime")
+    parser.add_argument("--custota-seconds", type=float, default=0, help="Simulated `custota-tool gen-csig` runtime")
+    parser.add_argument("--automator-args", default="", help="Extra pixel_automator.py arguments, e.g. \"--minimal --fast\"")
+    parser.add_argument("--no-gcs", action="store_true", help="Run without a bucket (local output only)")
+    parser.add_argument("--local-bucket", action="store_true", help="Use file:// buckets instead of the fake GCS")
+    parser.add_argument("--cache-bucket", action="store_true", help="Also stream the download into a cache bucket")
+    parser.add_argument("--work-dir", help="Where runs and generated inputs live (default: a temporary directory)")
+    parser.add_argument("--inputs-dir", help="Reuse generated OTA zips from this directory across invocations")
+    parser.add_argument("--noop-runs", type=int, default=0,
+                        help="After each cold run, rerun N times with no new release and report the p50")
+    parser.add_argument("--keep", action="store_true", help="Keep run directories and logs")
+    parser.add_argument("--output", default="benchmark_results.json", help="Results JSON path")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    root = tempfile.mkdtemp(prefix="pixel-bench-", dir=args.work_dir)
+    inputs_dir = args.inputs_dir or os.path.join(root, "inputs")
+    os.makedirs(inputs_dir, exist_ok=True)
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "runs": [],
+    }
+    try:
+        key_path = generate_key(os.path.join(root, "bench_key.pem"))
+        magisk_path = generate_magisk(os.path.join(root, "magisk.zip"))
+        for label in [size.strip() for size in args.sizes.split(",") if size.strip()]:
+            size = parse_size(label)
+            ota_path = os.path.join(inputs_dir, f"{args.device}-ota-bench{label.lower()}-{size:x}.zip")
+            print(f"Generating {label} OTA: {ota_path}", flush=True)
+            generate_ota(ota_path, size)
+            for repeat in range(args.repeat):
+                print(f"Running {label} #{repeat + 1}...", flush=True)
+                run = bench_run(args, root, label, ota_path, key_path, magisk_path, repeat)
+                results["runs"].append(run)
+                print(f"  exit {run['exit_code']}, {run['wall_seconds']:.2f}s, peak RSS {run['peak_rss_mb']} MiB", flush=True)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print_summary(results)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+    return 0 if all(run["exit_code"] == 0 for run in results["runs"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
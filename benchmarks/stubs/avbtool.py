@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""Benchmark stand-in for avbtool.py extract_public_key: writes a placeholder AVB public key blob."""
+import argparse
+import hashlib
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="avbtool.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+    extract = commands.add_parser("extract_public_key")
+    extract.add_argument("--key", required=True)
+    extract.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    with open(args.key, "rb") as f:
+        digest = hashlib.sha256(f.read()).digest()
+    with open(args.output, "wb") as f:
+        f.write(b"\x00\x00\x10\x00" + digest * 16)
+
+
+if __name__ == "__main__":
+    main()
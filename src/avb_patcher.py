@@ -1,15 +1,21 @@
 import os
+import shutil
 import subprocess
 import sys
+import threading
+import json
+import time
 import zipfile
 from ui_utils import print_status, Color, log_error, log
 
-EXTRACTED_CACHE_DIR = "/app/output/extracted_cache"
+MAGISK_PATH = os.environ.get('MAGISK_PATH', "/usr/local/share/magisk.zip")
+# Batch builds share one signing key, so only one worker may generate its certificate.
+_CERT_LOCK = threading.Lock()
 
 def run_avbroot_patch(filename, output_filename, key_path, avb_passphrase=None):
     log("Passing to avbroot for patching and signing...")
     
-    magisk_path = "/usr/local/share/magisk.zip"
+    magisk_path = MAGISK_PATH
     if not os.path.exists(magisk_path):
         log_error(f"CRITICAL: Pre-bundled Magisk not found at {magisk_path}")
         sys.exit(1)
@@ -19,19 +25,20 @@ def run_avbroot_patch(filename, output_filename, key_path, avb_passphrase=None):
         cert_filename += ".crt"
     cert_path = os.path.join("/tmp", cert_filename)
     
-    if not os.path.exists(cert_path):
-        log(f"Generating OTA certificate from key: {cert_path}")
-        try:
-            subprocess.check_call([
-                "openssl", "req", "-new", "-x509", 
-                "-key", key_path, 
-                "-out", cert_path, 
-                "-days", "10000", 
-                "-subj", "/CN=PixelRootOTA"
-            ])
-        except Exception as e:
-            log_error(f"Failed to generate certificate: {e}")
-            sys.exit(1)
+    with _CERT_LOCK:
+        if not os.path.exists(cert_path):
+            log(f"Generating OTA certificate from key: {cert_path}")
+            try:
+                subprocess.check_call([
+                    "openssl", "req", "-new", "-x509", 
+                    "-key", key_path, 
+                    "-out", cert_path, 
+                    "-days", "10000", 
+                    "-subj", "/CN=PixelRootOTA"
+                ])
+            except Exception as e:
+                log_error(f"Failed to generate certificate: {e}")
+                sys.exit(1)
 
     try:
         with zipfile.ZipFile(magisk_path, 'r') as z:
@@ -117,3 +124,77 @@ def extract_patched_boot_images(zip_path, output_dir):
         print_status("EXTRACT", "SUCCESS", "Boot images extracted", Color.GREEN)
     except Exception as e:
         log_error(f"Failed to extract images: {e}")
+
+def patch_init_boot_only(filename, output_image, key_path, work_dir):
+    """
+    Produces only the patched, AVB-signed init_boot.img. avbroot only applies Magisk
+    and re-signs the vbmeta chain inside `ota patch`, so the OTA is still patched
+    locally; it is discarded right after init_boot.img is extracted from it: no csig,
+    no other partitions and no multi-GB upload.
+    """
+    patched_ota = os.path.join(work_dir, f"raw_{os.path.basename(filename)}")
+    extract_dir = os.path.join(work_dir, "raw_extract")
+    try:
+        run_avbroot_patch(filename, patched_ota, key_path)
+        subprocess.check_call([
+            "avbroot", "ota", "extract",
+            "--input", patched_ota,
+            "--directory", extract_dir,
+            "--partition", "init_boot"
+        ])
+        image = os.path.join(extract_dir, "init_boot.img")
+        if not os.path.exists(image):
+            raise FileNotFoundError(f"init_boot.img not found in {os.path.basename(filename)}")
+        os.replace(image, output_image)
+        print_status("RAW", "SUCCESS", f"Patched init_boot: {output_image}", Color.GREEN)
+    finally:
+        if os.path.exists(patched_ota):
+            os.remove(patched_ota)
+        shutil.rmtree(extract_dir, ignore_errors=True)
+
+def package_minimal(output_zip, image_dir, device, source_filename, compression_level=6):
+    """
+    Packs only the partitions avbroot changed into a factory-style ZIP: a nested
+    image-<device>-*.zip with the .img files (what the web flasher looks for)
+    plus a small metadata file. Level 0 stores the images uncompressed.
+    Returns packaging stats for the build report.
+    """
+    start = time.monotonic()
+    compression = zipfile.ZIP_DEFLATED if compression_level else zipfile.ZIP_STORED
+    stem = os.path.splitext(os.path.basename(output_zip))[0]
+    inner_name = f"image-{device}-{stem}.zip"
+    inner_path = os.path.join(os.path.dirname(output_zip) or ".", inner_name)
+    images = sorted(name for name in os.listdir(image_dir) if name.endswith(".img"))
+    if not images:
+        raise FileNotFoundError(f"No partition images found in {image_dir}")
+
+    input_bytes = 0
+    try:
+        with zipfile.ZipFile(inner_path, "w", compression, compresslevel=compression_level or None) as z:
+            for name in images:
+                path = os.path.join(image_dir, name)
+                input_bytes += os.path.getsize(path)
+                z.write(path, name)
+
+        metadata = {
+            "device": device,
+            "source": os.path.basename(source_filename),
+            "partitions": [os.path.splitext(name)[0] for name in images],
+        }
+        # The nested ZIP is already compressed (or deliberately stored); don't deflate it twice.
+        with zipfile.ZipFile(output_zip, "w", zipfile.ZIP_STORED) as z:
+            z.write(inner_path, inner_name)
+            z.writestr("minimal_info.json", json.dumps(metadata, indent=4))
+    finally:
+        if os.path.exists(inner_path):
+            os.remove(inner_path)
+
+    stats = {
+        "compression_level": compression_level,
+        "input_bytes": input_bytes,
+        "output_bytes": os.path.getsize(output_zip),
+        "seconds": round(time.monotonic() - start, 3),
+    }
+    print_status("MINIMAL", "SUCCESS", f"{len(images)} partition(s), {stats['output_bytes'] / 1024**2:.1f} MiB "
+                 f"from {input_bytes / 1024**2:.1f} MiB in {stats['seconds']}s (level {compression_level})", Color.GREEN)
+    return stats
@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+from ui_utils import log
+from storage_backend import NotFound, PreconditionFailed
+
+# A build is identified by everything that changes its output: the input OTA, the signing
+# key, the tool versions and the patch options. Entries live at cache/builds/<key>.json in
+# the release bucket, or in OUTPUT_DIR/build_cache/ when there is no bucket.
+BUILD_CACHE_PREFIX = "cache/builds/"
+LOCAL_BUILD_CACHE_DIR = "build_cache"
+
+def tool_versions():
+    return {
+        "magisk": os.environ.get("MAGISK_VERSION", "unknown"),
+        "avbroot": os.environ.get("AVBROOT_VERSION", "unknown"),
+    }
+
+def cache_key(input_sha256, key_hash, options):
+    material = {
+        "input_sha256": input_sha256.lower(),
+        "key_hash": key_hash,
+        "tools": tool_versions(),
+        "options": options,
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+def make_entry(device, output_filename, output_sha256, url, blob_name=None):
+    return {
+        "device": device,
+        "tools": tool_versions(),
+        "output": {
+            "filename": os.path.basename(output_filename),
+            "sha256": output_sha256,
+            "url": url,
+            "blob": blob_name,
+        },
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+def lookup(backend, key):
+    """Returns the cached build entry if both the entry and the output object still exist."""
+    try:
+        entry = json.loads(backend.get_bytes(f"{BUILD_CACHE_PREFIX}{key}.json"))
+    except NotFound:
+        return None
+    output_blob = entry.get("output", {}).get("blob")
+    if not output_blob or not backend.exists(output_blob):
+        log(f"⚠️  Build cache entry {key[:12]} points at a missing object, ignoring it.")
+        return None
+    return entry
+
+def store(backend, key, entry):
+    """
+    The first worker to finish a build owns the entry and later ones keep it, unless
+    its output object is gone: a stale entry is replaced, guarded by its generation.
+    """
+    blob_name = f"{BUILD_CACHE_PREFIX}{key}.json"
+    info = backend.stat(blob_name)
+    generation = 0
+    if info is not None:
+        try:
+            current = json.loads(backend.get_bytes(blob_name, if_generation_match=info["generation"]))
+            output_blob = current.get("output", {}).get("blob")
+        except (NotFound, PreconditionFailed, ValueError):
+            output_blob = None
+        if output_blob and backend.exists(output_blob):
+            log(f"Build cache entry {key[:12]} already exists.")
+            return
+        generation = info["generation"]
+    try:
+        backend.put_bytes(blob_name, json.dumps(entry, indent=4), content_type="application/json",
+                          if_generation_match=generation)
+    except PreconditionFailed:
+        log(f"Build cache entry {key[:12]} was written concurrently, keeping it.")
+
+def lookup_local(output_dir, key):
+    path = os.path.join(output_dir, LOCAL_BUILD_CACHE_DIR, f"{key}.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            entry = json.load(f)
+    except ValueError:
+        return None
+    if not os.path.exists(os.path.join(output_dir, entry["output"]["filename"])):
+        return None
+    return entry
+
+def store_local(output_dir, key, entry):
+    cache_dir = os.path.join(output_dir, LOCAL_BUILD_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(entry, f, indent=4)
+    os.replace(tmp_path, path)
@@ -0,0 +1,174 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+from ui_utils import log
+from storage_backend import NotFound, PreconditionFailed
+
+# Bucket layout:
+#   index/builds/<output filename>.json   one object per build, O(1) lookup by filename
+#   index/devices/<device>.json           newest INDEX_MAX_BUILDS_PER_DEVICE entries of one device
+#   index/latest.json                     newest entry of every device
+#   index/markers/<digest>                empty object per (upstream file, SHA256, signing key)
+#   index/ota_page.json                   fingerprint of the OTA page and the rows last confirmed built
+#   builds_index.json                     bounded roll-up of all device shards, read by the web UI
+BUILD_ENTRY_PREFIX = "index/builds/"
+DEVICE_SHARD_PREFIX = "index/devices/"
+LATEST_SUMMARY_BLOB = "index/latest.json"
+ROLLUP_BLOB = "builds_index.json"
+MARKER_PREFIX = "index/markers/"
+PAGE_STATE_BLOB = "index/ota_page.json"
+INDEX_MAX_BUILDS_PER_DEVICE = int(os.environ.get('INDEX_MAX_BUILDS_PER_DEVICE', 20))
+INDEX_WRITE_RETRIES = 5
+
+def make_entry(device, filename, output_filename, url):
+    parts = os.path.basename(filename).split('-')
+    now = datetime.now(timezone.utc)
+    return {
+        "device": device,
+        "android_version": parts[2] if len(parts) > 2 else "unknown",
+        "build_date": now.strftime('%Y%m%d'),
+        "filename": os.path.basename(output_filename),
+        "url": url,
+        "timestamp": now.isoformat(),
+    }
+
+def merge_entry(entries, entry, max_per_device=INDEX_MAX_BUILDS_PER_DEVICE):
+    """Replaces any entry with the same filename, sorts newest first and keeps max_per_device per device."""
+    merged = [x for x in entries if x.get("filename") != entry["filename"]]
+    merged.append(entry)
+    merged.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+    kept, per_device = [], {}
+    for x in merged:
+        count = per_device.get(x.get("device"), 0)
+        if count < max_per_device:
+            kept.append(x)
+            per_device[x.get("device")] = count + 1
+    return kept
+
+def entry_blob_name(output_filename):
+    return f"{BUILD_ENTRY_PREFIX}{os.path.basename(output_filename)}.json"
+
+def _read_entry(backend, output_filename):
+    try:
+        return json.loads(backend.get_bytes(entry_blob_name(output_filename)))
+    except NotFound:
+        return None
+
+def lookup(backend, output_filename, device=None):
+    """
+    Returns the index entry of a build, or None. Costs one small object read; a miss
+    for `device` also checks that its shard exists, migrating the device once if not.
+    """
+    entry = _read_entry(backend, output_filename)
+    if entry is None and device and migrate_device(backend, device):
+        entry = _read_entry(backend, output_filename)
+    return entry
+
+def _read_json(backend, blob_name, default):
+    """Returns (data, generation); generation 0 means the object does not exist yet."""
+    info = backend.stat(blob_name)
+    if info is None:
+        return default, 0
+    try:
+        return json.loads(backend.get_bytes(blob_name, if_generation_match=info["generation"])), info["generation"]
+    except ValueError:
+        log(f"⚠️  {blob_name} is not valid JSON, rewriting it.")
+        return default, info["generation"]
+
+def _conditional_update(backend, blob_name, mutate, default):
+    """Read-modify-write guarded by the object generation, retried when another writer got there first."""
+    for attempt in range(INDEX_WRITE_RETRIES):
+        try:
+            data, generation = _read_json(backend, blob_name, default)
+            updated = mutate(data)
+            backend.put_bytes(
+                blob_name,
+                json.dumps(updated, indent=4),
+                content_type="application/json",
+                if_generation_match=generation,
+            )
+            return updated
+        except (PreconditionFailed, NotFound):
+            log(f"⚠️  {blob_name} changed concurrently, retrying ({attempt + 1}/{INDEX_WRITE_RETRIES})...")
+    raise RuntimeError(f"Could not update {blob_name} after {INDEX_WRITE_RETRIES} attempts")
+
+def migrate_device(backend, device):
+    """
+    Moves a device's builds from the pre-sharded roll-up into its shard and build
+    entries. Runs once per device: returns False without reading the roll-up when the
+    shard already exists.
+    """
+    shard_blob = f"{DEVICE_SHARD_PREFIX}{device}.json"
+    if backend.stat(shard_blob) is not None:
+        return False
+
+    def seed(entries):
+        if entries is not None:
+            return entries
+        carried = [x for x in _read_json(backend, ROLLUP_BLOB, [])[0] if x.get("device") == device]
+        # Entries first, so an existing shard always means its builds can be looked up.
+        for x in carried:
+            backend.put_bytes(entry_blob_name(x["filename"]), json.dumps(x, indent=4), content_type="application/json")
+        log(f"Migrated {len(carried)} {device} build(s) from {ROLLUP_BLOB} to the sharded index.")
+        return carried
+    _conditional_update(backend, shard_blob, seed, None)
+    return True
+
+def publish(backend, entry):
+    """Writes the build entry, its device shard, the latest summary and the web roll-up."""
+    device = entry["device"]
+    backend.put_bytes(entry_blob_name(entry["filename"]), json.dumps(entry, indent=4), content_type="application/json")
+
+    # Without this, replace_device below would drop the device's builds that only the roll-up holds.
+    migrate_device(backend, device)
+    shard = _conditional_update(backend, f"{DEVICE_SHARD_PREFIX}{device}.json",
+                                lambda entries: merge_entry(entries, entry), [])
+
+    def set_latest(summary):
+        current = summary.get(device)
+        if not current or current.get("timestamp", "") <= entry["timestamp"]:
+            summary[device] = entry
+        return summary
+    _conditional_update(backend, LATEST_SUMMARY_BLOB, set_latest, {})
+
+    def replace_device(entries):
+        others = [x for x in entries if x.get("device") != device]
+        return sorted(others + shard, key=lambda x: x.get("timestamp", ""), reverse=True)
+    _conditional_update(backend, ROLLUP_BLOB, replace_device, [])
+
+def marker_blob_name(upstream_filename, upstream_sha256, key_hash):
+    """Deterministic name of the "already built" marker; changes whenever the input or the signing key does."""
+    material = f"{os.path.basename(upstream_filename)}\n{upstream_sha256.lower()}\n{key_hash}"
+    return f"{MARKER_PREFIX}{hashlib.sha256(material.encode()).hexdigest()}"
+
+def find_marker(backend, marker_name):
+    """Returns the marker metadata, or None. A single metadata read, no download."""
+    info = backend.stat(marker_name)
+    if info is None:
+        return None
+    return info["metadata"]
+
+def write_marker(backend, marker_name, entry):
+    metadata = {"filename": entry["filename"], "url": entry["url"], "timestamp": entry["timestamp"]}
+    backend.put_bytes(marker_name, b"", content_type="application/octet-stream", metadata=metadata)
+
+def read_page_state(backend):
+    """The OTA page fingerprint written by record_page_rows, or an empty state."""
+    return _read_json(backend, PAGE_STATE_BLOB, {})[0]
+
+def record_page_rows(backend, page, rows):
+    """
+    Records `page` (ETag, Last-Modified, SHA256 of the body) as the latest page seen
+    and `rows` ({device: row with its marker}) as built at that page. Devices not in
+    `rows` keep the page they were recorded at, so a later run cannot take their old
+    rows for current ones.
+    """
+    def mutate(state):
+        state["page"] = page
+        devices = state.setdefault("devices", {})
+        for device, row in rows.items():
+            devices[device] = {**row, "page_sha256": page["sha256"],
+                               "confirmed": datetime.now(timezone.utc).isoformat()}
+        return state
+    return _conditional_update(backend, PAGE_STATE_BLOB, mutate, {})
@@ -1,28 +1,165 @@
 import os
-import requests
+import re
+import json
+import time
+import hashlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from ui_utils import ProgressBar, log_error, log
+import verifier
 
-TARGET_URL = "https://developers.google.com/android/ota"
+# requests, BeautifulSoup and Playwright are imported inside the functions that use them,
+# so that --local-file runs never pay for the network stack.
+TARGET_URL = os.environ.get('OTA_PAGE_URL', "https://developers.google.com/android/ota")
 
-# Note: The comprehensive scraping logic was removed in a previous turn due to a bad merge.
-# We need to restore it. Since I don't have the original handy in this context without
-# scrolling way back or hallucinating, I will implement a robust but simpler version
-# or try to restore the Playwright logic if requirements allow.
-# However, the previous error showed a fragment "url_el = target_row.locator..."
-# which suggests the Playwright implementation was intended.
+DOWNLOAD_SEGMENTS = int(os.environ.get('DOWNLOAD_SEGMENTS', 8))
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 1024 * 1024))
+DOWNLOAD_RETRIES = int(os.environ.get('DOWNLOAD_RETRIES', 5))
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+DOWNLOAD_STATE_FLUSH_INTERVAL = 2.0
+HASH_READ_SIZE = 8 * 1024 * 1024
 
-# I will assume the user wanted the Playwright implementation from the previous "clean code" attempt.
-# I will rewrite it cleanly.
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+# Cookie set by the devsite "Acknowledge" button on the OTA terms wall.
+LICENSE_ACK_COOKIES = {"devsite_wall_acks": "nexus-ota-tos"}
+CARRIER_VARIANTS = ("verizon", "japan", "softbank")
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
 
-from playwright.sync_api import sync_playwright
+def _is_carrier_variant(row_text):
+    text = row_text.lower()
+    return any(carrier in text for carrier in CARRIER_VARIANTS)
 
-def get_latest_factory_image_data_headless(device):
-    log(f"Starting headless browser for: {device}...")
+def get_latest_factory_image_data(device):
+    """Plain HTTP scrape first; the headless browser is only started when that fails."""
+    return get_latest_factory_images([device])[device]
+
+def get_latest_factory_images(devices):
+    """Scrapes the OTA page once and returns {device: (url, filename, sha256)}."""
+    from bs4 import BeautifulSoup
+
+    results = {}
+    html = _fetch_ota_page()
+    if html:
+        soup = BeautifulSoup(html, "html.parser")
+        for device in devices:
+            results[device] = _parse_device_row(soup, device)
+
+    missing = [device for device in devices if not results.get(device, (None,))[0]]
+    if missing:
+        log(f"⚠️  HTTP fast path could not read the OTA table for: {', '.join(missing)}. Falling back to headless browser...")
+        results.update(get_latest_factory_images_headless(missing))
+    return results
+
+def _fetch_ota_page():
+    response = _request_ota_page()
+    return response.text if response is not None else None
+
+def _request_ota_page(extra_headers=None):
+    import requests
+
+    log(f"Fetching OTA page over HTTP: {TARGET_URL}")
+    try:
+        response = requests.get(
+            TARGET_URL,
+            headers={'User-Agent': USER_AGENT, 'Accept-Language': 'en-US,en;q=0.9', **(extra_headers or {})},
+            cookies=LICENSE_ACK_COOKIES,
+            timeout=DOWNLOAD_TIMEOUT
+        )
+        response.raise_for_status()
+        return response
+    except Exception as e:
+        log(f"⚠️  HTTP fetch failed: {e}")
+        return None
+
+def poll_ota_page(devices, state):
+    """
+    Reads the OTA page against the fingerprint `state` of a previous run (see
+    build_index.read_page_state). When every device was recorded at the current page,
+    the request is conditional (ETag / Last-Modified), and a 304 or an identical body
+    returns the recorded rows without parsing. Returns {"page": validators, "rows":
+    {device: row}, "unchanged": bool}, rows holding only the devices found, or None
+    when the page could not be fetched.
+    """
+    page = state.get("page") or {}
+    recorded = state.get("devices", {})
+    known = bool(page.get("sha256")) and all(
+        recorded.get(device, {}).get("page_sha256") == page["sha256"] for device in devices
+    )
+    headers = {}
+    if known and page.get("etag"):
+        headers["If-None-Match"] = page["etag"]
+    if known and page.get("last_modified"):
+        headers["If-Modified-Since"] = page["last_modified"]
+
+    response = _request_ota_page(headers)
+    if response is None:
+        return None
+    if known and response.status_code == 304:
+        log("⚡ OTA page not modified since the last run.")
+        return {"page": page, "rows": {device: recorded[device] for device in devices}, "unchanged": True}
+
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": hashlib.sha256(response.content).hexdigest(),
+    }
+    if known and validators["sha256"] == page["sha256"]:
+        log("⚡ OTA page content unchanged since the last run.")
+        return {"page": validators, "rows": {device: recorded[device] for device in devices}, "unchanged": True}
+
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(response.text, "html.parser")
+    rows = {}
+    for device in devices:
+        row_id, url, filename, sha256 = _read_device_row(soup, device)
+        if url:
+            rows[device] = {"row_id": row_id, "url": url, "filename": filename, "sha256": sha256}
+    return {"page": validators, "rows": rows, "unchanged": False}
+
+def _parse_device_row(soup, device):
+    return _read_device_row(soup, device)[1:]
+
+def _read_device_row(soup, device):
+    """(row id, url, filename, sha256) of the newest non-carrier row of the device, or Nones."""
+    try:
+        rows = soup.select(f"tr[id^='{device}']")
+        if not rows:
+            log(f"⚠️  No rows for device '{device}' in page HTML.")
+            return None, None, None, None
+
+        target_row = next((row for row in reversed(rows) if not _is_carrier_variant(row.get_text())), rows[-1])
+        log(f"Selecting row: {target_row.get('id')}")
+
+        link = target_row.select_one("td a[href]")
+        cells = target_row.find_all("td")
+        if not link or not cells:
+            return None, None, None, None
+
+        latest_url = link["href"]
+        expected_sha = cells[-1].get_text(strip=True).lower()
+        if not SHA256_PATTERN.match(expected_sha):
+            log(f"⚠️  Unexpected checksum cell in row {target_row.get('id')}: {expected_sha[:80]}")
+            return None, None, None, None
+
+        filename = latest_url.split('/')[-1]
+        return target_row.get("id"), latest_url, filename, expected_sha
+    except Exception as e:
+        log(f"⚠️  Parsing OTA table failed: {e}")
+        return None, None, None, None
+
+def get_latest_factory_images_headless(devices):
+    from playwright.sync_api import sync_playwright
+
+    results = {device: (None, None, None) for device in devices}
+    log(f"Starting headless browser for: {', '.join(devices)}...")
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True, args=['--disable-blink-features=AutomationControlled'])
         context = browser.new_context(
             viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+            user_agent=USER_AGENT
         )
         page = context.new_page()
 
@@ -31,7 +168,7 @@ def get_latest_factory_image_data_headless(device):
             page.goto(TARGET_URL, timeout=60000, wait_until="domcontentloaded")
         except Exception as e:
             log_error(f"Failed to load page: {e}")
-            return None, None, None
+            return results
 
         # Helper to click things
         def click_visible(selector, force=True):
@@ -55,67 +192,371 @@ def get_latest_factory_image_data_headless(device):
                 if ack_btn.is_visible(): ack_btn.click(force=True)
         except: pass
 
-        log(f"Searching links for {device}...")
-        try:
-            page.wait_for_selector(f"tr[id^='{device}']", timeout=30000)
-        except:
-            log("⚠️  Timeout waiting for specific device table rows.")
+        for device in devices:
+            results[device] = _read_device_row_headless(page, device)
+        browser.close()
+    return results
+
+def _read_device_row_headless(page, device):
+    log(f"Searching links for {device}...")
+    try:
+        page.wait_for_selector(f"tr[id^='{device}']", timeout=30000)
+    except:
+        log("⚠️  Timeout waiting for specific device table rows.")
+
+    try:
+        rows = page.locator(f"tr[id^='{device}']")
+        count = rows.count()
 
+        if count == 0:
+            log_error(f"No rows found for device '{device}'")
+            return None, None, None
+
+        log(f"Found {count} candidate rows for {device}.")
+
+        target_row = None
+        for i in range(count - 1, -1, -1):
+            row = rows.nth(i)
+            if _is_carrier_variant(row.inner_text()): continue
+            target_row = row
+            break
+
+        if not target_row:
+            target_row = rows.last
+
+        log(f"Selecting row: {target_row.get_attribute('id')}")
+
+        url_el = target_row.locator("td a")
+        latest_url = url_el.get_attribute("href")
+
+        sha_el = target_row.locator("td").last
+        expected_sha = sha_el.inner_text().strip()
+
+        filename = latest_url.split('/')[-1]
+        return latest_url, filename, expected_sha
+
+    except Exception as e:
+        log_error(f"Scraping failed: {e}")
+        return None, None, None
+
+def _create_session(pool_size):
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def _probe_download(session, url):
+    """Returns (total_size, supports_ranges) using a one-byte ranged GET."""
+    with session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        content_range = response.headers.get("content-range", "")
+        if response.status_code == 206 and "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            if total.isdigit():
+                return int(total), True
+        return int(response.headers.get("content-length", 0)), False
+
+def get_remote_size(url):
+    """Size of the remote file in bytes, or None when the server does not report it."""
+    import requests
+
+    try:
+        with _create_session(1) as session:
+            total_size, _ = _probe_download(session, url)
+        return total_size or None
+    except requests.RequestException:
+        return None
+
+def _split_segments(total_size, segments):
+    segments = max(1, min(segments, total_size // DOWNLOAD_MIN_SEGMENT_SIZE or 1))
+    step = -(-total_size // segments)
+    return [[start, min(start + step, total_size), start] for start in range(0, total_size, step)]
+
+class _DownloadState:
+    """Segment progress of a `.part` file, persisted to a JSON sidecar for resume."""
+
+    def __init__(self, state_path, url, total_size, segments):
+        self.state_path = state_path
+        self.url = url
+        self.total_size = total_size
+        self.segments = segments
+        self.lock = threading.Lock()
+        self.last_flush = 0.0
+
+    @classmethod
+    def load_or_create(cls, state_path, part_path, url, total_size, segment_count):
+        if os.path.exists(state_path) and os.path.exists(part_path):
+            try:
+                with open(state_path, 'r') as f:
+                    data = json.load(f)
+                if data.get("url") == url and data.get("size") == total_size:
+                    log(f"♻️  Resuming partial download ({os.path.basename(part_path)})")
+                    return cls(state_path, url, total_size, data["segments"])
+            except Exception as e:
+                log(f"⚠️  Ignoring unreadable download state: {e}")
+        return cls(state_path, url, total_size, _split_segments(total_size, segment_count))
+
+    def completed_bytes(self):
+        return sum(pos - start for start, _, pos in self.segments)
+
+    def advance(self, index, amount):
+        with self.lock:
+            self.segments[index][2] += amount
+            if time.monotonic() - self.last_flush >= DOWNLOAD_STATE_FLUSH_INTERVAL:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"url": self.url, "size": self.total_size, "segments": self.segments}, f)
+        os.replace(tmp_path, self.state_path)
+        self.last_flush = time.monotonic()
+
+class _LockedProgressBar(ProgressBar):
+    """ProgressBar shared by segment workers."""
+
+    def __init__(self, description, total=100):
+        self._lock = threading.Lock()
+        super().__init__(description, total)
+
+    def update(self, amount=1):
+        with self._lock:
+            super().update(amount)
+
+def _write_to_sinks(sinks, chunk):
+    for sink in list(sinks):
         try:
-            rows = page.locator(f"tr[id^='{device}']")
-            count = rows.count()
+            sink.write(chunk)
+        except Exception as e:
+            log_error(f"Streaming copy failed, disabling it: {e}")
+            sink.abort()
+            sinks.remove(sink)
 
-            if count == 0:
-                log_error(f"No rows found for device '{device}'")
-                browser.close()
-                return None, None, None
+def _abort_sinks(sinks, reason):
+    for sink in list(sinks):
+        log(f"⚠️  Aborting streaming copy: {reason}")
+        sink.abort()
+        sinks.remove(sink)
 
-            log(f"Found {count} candidate rows for {device}.")
+class _SequentialHasher:
+    """
+    Computes the SHA256 of a file whose segments arrive out of order.
+    Chunks landing at the hash cursor are hashed straight from memory; chunks
+    ahead of it are only recorded and read back from the (hot) .part file once
+    the cursor reaches them, so the digest is ready when the last byte lands.
+    The same in-order byte stream is forwarded to any `sinks`.
+    """
 
-            target_row = None
-            for i in range(count - 1, -1, -1):
-                row = rows.nth(i)
-                text = row.inner_text().lower()
-                if "verizon" in text or "japan" in text or "softbank" in text: continue
-                target_row = row
-                break
+    def __init__(self, fd, total_size, written_ranges=(), sinks=None):
+        self.fd = fd
+        self.sinks = sinks if sinks is not None else []
+        self.total_size = total_size
+        self.sha = hashlib.sha256()
+        self.offset = 0
+        self.ready = {start: end for start, end in written_ranges if end > start}
+        self.queue = queue.Queue(maxsize=64)
+        self.stopped = False
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="sha256-hasher", daemon=True)
+        self.thread.start()
 
-            if not target_row:
-                target_row = rows.last
+    def feed(self, pos, chunk):
+        while not self.stopped:
+            try:
+                self.queue.put((pos, chunk), timeout=1)
+                return
+            except queue.Full:
+                continue
 
-            log(f"Selecting row: {target_row.get_attribute('id')}")
+    def abort(self):
+        self.stopped = True
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self.thread.join()
 
-            url_el = target_row.locator("td a")
-            latest_url = url_el.get_attribute("href")
+    def hexdigest(self):
+        self.thread.join()
+        if self.error:
+            raise self.error
+        return self.sha.hexdigest()
 
-            sha_el = target_row.locator("td").last
-            expected_sha = sha_el.inner_text().strip()
+    def _consume(self, chunk):
+        self.sha.update(chunk)
+        _write_to_sinks(self.sinks, chunk)
+        self.offset += len(chunk)
 
-            filename = latest_url.split('/')[-1]
-            return latest_url, filename, expected_sha
+    def _catch_up(self):
+        while self.offset in self.ready:
+            end = self.ready.pop(self.offset)
+            while self.offset < end:
+                chunk = os.pread(self.fd, min(HASH_READ_SIZE, end - self.offset), self.offset)
+                if not chunk:
+                    raise IOError(f"Unexpected end of data at byte {self.offset}")
+                self._consume(chunk)
 
+    def _run(self):
+        try:
+            self._catch_up()
+            while self.offset < self.total_size and not self.stopped:
+                item = self.queue.get()
+                if item is None:
+                    return
+                pos, chunk = item
+                if pos == self.offset:
+                    self._consume(chunk)
+                else:
+                    self.ready[pos] = pos + len(chunk)
+                self._catch_up()
         except Exception as e:
-            log_error(f"Scraping failed: {e}")
-            return None, None, None
+            self.error = e
+        finally:
+            self.stopped = True
+
+def _fetch_segment(session, url, fd, state, index, bar, chunk_size, hasher):
+    import requests
+
+    attempt = 0
+    while True:
+        _, end, pos = state.segments[index]
+        if pos >= end:
+            return
+        try:
+            headers = {"Range": f"bytes={pos}-{end - 1}"}
+            with session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                if response.status_code != 206:
+                    raise IOError(f"Expected 206 Partial Content, got {response.status_code}")
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if not chunk:
+                        continue
+                    chunk = chunk[:end - pos]
+                    os.pwrite(fd, chunk, pos)
+                    pos += len(chunk)
+                    hasher.feed(pos - len(chunk), chunk)
+                    state.advance(index, len(chunk))
+                    bar.update(len(chunk))
+                    if pos >= end:
+                        break
+            if pos < end:
+                raise IOError(f"Connection closed at byte {pos} of segment ending at {end}")
+        except (requests.RequestException, IOError) as e:
+            attempt += 1
+            if attempt > DOWNLOAD_RETRIES:
+                raise
+            log(f"⚠️  Segment {index} interrupted ({e}). Retry {attempt}/{DOWNLOAD_RETRIES}...")
+            time.sleep(min(2 ** attempt, 30))
+
+def _download_single_stream(session, url, part_path, bar, chunk_size, sinks):
+    import requests
+
+    attempt = 0
+    while True:
+        try:
+            if attempt and sinks:
+                _abort_sinks(sinks, "stream restarted, already forwarded bytes cannot be rewound")
+            sha256_hash = hashlib.sha256()
+            with session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                response.raise_for_status()
+                with open(part_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if chunk:
+                            f.write(chunk)
+                            sha256_hash.update(chunk)
+                            _write_to_sinks(sinks, chunk)
+                            bar.update(len(chunk))
+            return sha256_hash.hexdigest()
+        except (requests.RequestException, IOError) as e:
+            attempt += 1
+            if attempt > DOWNLOAD_RETRIES:
+                raise
+            log(f"⚠️  Download interrupted ({e}). Restarting, attempt {attempt}/{DOWNLOAD_RETRIES}...")
+            bar.current = 0
+            time.sleep(min(2 ** attempt, 30))
+
+def _replay_existing_file(filename, sinks):
+    sha256_hash = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_READ_SIZE), b""):
+            sha256_hash.update(chunk)
+            _write_to_sinks(sinks, chunk)
+    return sha256_hash.hexdigest()
+
+def download_file(url, filename, segments=None, chunk_size=None, sinks=None):
+    """
+    Downloads `url` to `filename` and returns the SHA256 computed on the fly.
+    Every object in `sinks` (write/abort) receives the file's bytes in order while
+    the download runs; a sink that fails is aborted and dropped from the list.
+    """
+    sinks = sinks if sinks is not None else []
+    if os.path.exists(filename):
+        if sinks:
+            sha256 = _replay_existing_file(filename, sinks)
+            verifier.record_file_sha256(filename, sha256)
+            return sha256
+        return verifier.calculate_sha256(filename)
 
-def download_file(url, filename):
-    if os.path.exists(filename): return
+    segments = segments or DOWNLOAD_SEGMENTS
+    chunk_size = chunk_size or DOWNLOAD_CHUNK_SIZE
+    part_path = f"{filename}.part"
+    state_path = f"{part_path}.json"
 
     log(f"Starting download: {filename}")
+    session = _create_session(segments)
     try:
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
+        total_size, supports_ranges = _probe_download(session, url)
     except Exception as e:
         log_error(f"Connection error: {e}")
         raise e
 
-    total_size = int(response.headers.get('content-length', 0))
-    bar = ProgressBar(f"Downloading {filename}", total=total_size)
-    
-    with open(filename, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
-                bar.update(len(chunk))
-    bar.finish()
+    try:
+        if not supports_ranges or total_size == 0 or segments == 1:
+            log("Using a single download stream (ranged requests unavailable or disabled).")
+            bar = ProgressBar(f"Downloading {filename}", total=total_size)
+            sha256 = _download_single_stream(session, url, part_path, bar, chunk_size, sinks)
+        else:
+            state = _DownloadState.load_or_create(state_path, part_path, url, total_size, segments)
+            log(f"Fetching {total_size / 1024**2:.0f} MiB in {len(state.segments)} segments...")
+            bar = _LockedProgressBar(f"Downloading {filename}", total=total_size)
+            bar.update(state.completed_bytes())
+
+            fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, total_size)
+                hasher = _SequentialHasher(fd, total_size, [(start, pos) for start, _, pos in state.segments], sinks)
+                with ThreadPoolExecutor(max_workers=len(state.segments)) as pool:
+                    futures = [
+                        pool.submit(_fetch_segment, session, url, fd, state, i, bar, chunk_size, hasher)
+                        for i in range(len(state.segments))
+                    ]
+                    try:
+                        for future in as_completed(futures):
+                            future.result()
+                    except Exception:
+                        hasher.abort()
+                        raise
+                    finally:
+                        state.flush()
+                sha256 = hasher.hexdigest()
+            finally:
+                os.close(fd)
+        bar.finish()
+    except Exception as e:
+        log_error(f"Download failed (partial data kept for resume): {e}")
+        raise e
+    finally:
+        session.close()
+
+    os.replace(part_path, filename)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    verifier.record_file_sha256(filename, sha256)
     log("Download completed.")
+    return sha256
@@ -0,0 +1,248 @@
+import os
+import json
+import math
+import time
+import atexit
+import threading
+from ui_utils import log, log_error
+import startup_profile
+
+METRIC_PREFIX = "custom.googleapis.com/pixel_automator"
+METRICS_FLUSH_TIMEOUT = float(os.environ.get('METRICS_FLUSH_TIMEOUT', 30))
+
+# Exponential bucket layouts for distributions: upper bound of bucket i is scale * growth_factor ** i.
+DURATION_BUCKETS = {"scale": 0.1, "growth_factor": 2.0, "num_finite_buckets": 15}     # 0.1s .. ~55 min
+THROUGHPUT_BUCKETS = {"scale": 1.0, "growth_factor": 2.0, "num_finite_buckets": 15}   # 1 MB/s .. ~32 GB/s
+
+def _bucket_index(value, scale, growth_factor, num_finite_buckets):
+    if value < scale:
+        return 0
+    return min(int(math.log(value / scale, growth_factor)) + 1, num_finite_buckets + 1)
+
+class MetricsRegistry:
+    """In-memory counters, gauges and distributions, exported in one batch by flush()."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.distributions = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)[:255]) for k, v in (labels or {}).items()))
+
+    def increment(self, name, labels=None, value=1):
+        with self.lock:
+            key = self._key(name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, labels=None):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = float(value)
+
+    def observe(self, name, value, labels=None, buckets=DURATION_BUCKETS):
+        with self.lock:
+            key = self._key(name, labels)
+            entry = self.distributions.setdefault(key, {"values": [], "buckets": buckets})
+            entry["values"].append(float(value))
+
+    def drain(self):
+        """Returns all samples and resets the registry."""
+        with self.lock:
+            samples = []
+            for (name, labels), value in self.counters.items():
+                samples.append({"name": name, "kind": "counter", "labels": dict(labels), "value": value})
+            for (name, labels), value in self.gauges.items():
+                samples.append({"name": name, "kind": "gauge", "labels": dict(labels), "value": value})
+            for (name, labels), entry in self.distributions.items():
+                samples.append({
+                    "name": name, "kind": "distribution", "labels": dict(labels),
+                    "values": entry["values"], "buckets": entry["buckets"],
+                })
+            self.counters, self.gauges, self.distributions = {}, {}, {}
+            return samples
+
+class NullExporter:
+    def export(self, samples):
+        pass
+
+class FileExporter:
+    """Appends one JSON line per sample; used for offline runs and tests."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, samples):
+        timestamp = time.time()
+        with open(self.path, "a") as f:
+            for sample in samples:
+                f.write(json.dumps(dict(sample, timestamp=timestamp)) + "\n")
+        log(f"📈 Wrote {len(samples)} metric sample(s) to {self.path}")
+
+class PrometheusTextExporter:
+    """Writes the Prometheus text exposition format (e.g. for a node_exporter textfile collector)."""
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def _escape(value):
+        # Label values may hold backslashes, quotes or newlines (e.g. an error message).
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    @staticmethod
+    def _labels(labels, extra=None):
+        merged = dict(labels, **(extra or {}))
+        if not merged:
+            return ""
+        body = ",".join(f'{k}="{PrometheusTextExporter._escape(v)}"' for k, v in sorted(merged.items()))
+        return "{" + body + "}"
+
+    def export(self, samples):
+        lines = []
+        for sample in samples:
+            name = f"pixel_automator_{sample['name']}"
+            labels = sample["labels"]
+            if sample["kind"] == "counter":
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}_total{self._labels(labels)} {sample['value']}")
+            elif sample["kind"] == "gauge":
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name}{self._labels(labels)} {sample['value']}")
+            else:
+                buckets = sample["buckets"]
+                lines.append(f"# TYPE {name} histogram")
+                for i in range(buckets["num_finite_buckets"] + 1):
+                    bound = buckets["scale"] * buckets["growth_factor"] ** i
+                    count = sum(1 for v in sample["values"] if v <= bound)
+                    lines.append(f"{name}_bucket{self._labels(labels, {'le': f'{bound:g}'})} {count}")
+                lines.append(f"{name}_bucket{self._labels(labels, {'le': '+Inf'})} {len(sample['values'])}")
+                lines.append(f"{name}_sum{self._labels(labels)} {sum(sample['values'])}")
+                lines.append(f"{name}_count{self._labels(labels)} {len(sample['values'])}")
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+        log(f"📈 Wrote {len(samples)} metric sample(s) to {self.path}")
+
+class CloudMonitoringExporter:
+    """Sends all samples to Cloud Monitoring with a single create_time_series call per 200 series."""
+
+    def __init__(self, project_id):
+        self.project_id = project_id
+
+    def _series(self, monitoring_v3, sample, interval):
+        from google.api import distribution_pb2
+
+        series = monitoring_v3.TimeSeries()
+        series.metric.type = f"{METRIC_PREFIX}/{sample['name']}"
+        series.resource.type = "global"
+        for key, value in sample["labels"].items():
+            series.metric.labels[key] = value
+
+        if sample["kind"] == "counter":
+            value = {"int64_value": int(sample["value"])}
+        elif sample["kind"] == "gauge":
+            value = {"double_value": sample["value"]}
+        else:
+            values, buckets = sample["values"], sample["buckets"]
+            counts = [0] * (buckets["num_finite_buckets"] + 2)
+            for v in values:
+                counts[_bucket_index(v, **buckets)] += 1
+            mean = sum(values) / len(values)
+            distribution = distribution_pb2.Distribution(
+                count=len(values),
+                mean=mean,
+                sum_of_squared_deviation=sum((v - mean) ** 2 for v in values),
+                bucket_options=distribution_pb2.Distribution.BucketOptions(
+                    exponential_buckets=distribution_pb2.Distribution.BucketOptions.Exponential(**buckets)
+                ),
+                bucket_counts=counts,
+            )
+            value = {"distribution_value": distribution}
+        series.points = [monitoring_v3.Point({"interval": interval, "value": value})]
+        return series
+
+    def export(self, samples):
+        from google.cloud import monitoring_v3
+
+        now = time.time()
+        interval = monitoring_v3.TimeInterval(
+            {"end_time": {"seconds": int(now), "nanos": int((now - int(now)) * 10**9)}}
+        )
+        series_list = [self._series(monitoring_v3, sample, interval) for sample in samples]
+        client = monitoring_v3.MetricServiceClient()
+        for i in range(0, len(series_list), 200):
+            client.create_time_series(name=f"projects/{self.project_id}", time_series=series_list[i:i + 200])
+        log(f"📈 Reported {len(series_list)} metric series to Cloud Monitoring.")
+
+def exporter_from_env():
+    """
+    METRICS_EXPORTER selects the backend: cloud (default when GOOGLE_CLOUD_PROJECT is set),
+    file (JSON lines), prometheus (text format) or none. METRICS_FILE sets the output path.
+    """
+    project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
+    kind = os.environ.get("METRICS_EXPORTER", "cloud" if project_id else "none").lower()
+    if kind == "file":
+        return FileExporter(os.environ.get("METRICS_FILE", "metrics.jsonl"))
+    if kind == "prometheus":
+        return PrometheusTextExporter(os.environ.get("METRICS_FILE", "metrics.prom"))
+    if kind == "cloud":
+        if not project_id:
+            log("⚠️  Metrics skipped: GOOGLE_CLOUD_PROJECT environment variable not set.")
+            return NullExporter()
+        try:
+            from google.cloud import monitoring_v3  # noqa: F401
+        except ImportError:
+            log("⚠️  Metrics skipped: google.cloud.monitoring_v3 not available.")
+            return NullExporter()
+        return CloudMonitoringExporter(project_id)
+    return NullExporter()
+
+REGISTRY = MetricsRegistry()
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def configure(exporter):
+    global _exporter
+    with _exporter_lock:
+        _exporter = exporter
+
+def _get_exporter():
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            with startup_profile.span("metrics_exporter"):
+                _exporter = exporter_from_env()
+        return _exporter
+
+def increment(name, labels=None, value=1):
+    REGISTRY.increment(name, labels, value)
+
+def set_gauge(name, value, labels=None):
+    REGISTRY.set_gauge(name, value, labels)
+
+def observe(name, value, labels=None, buckets=DURATION_BUCKETS):
+    REGISTRY.observe(name, value, labels, buckets)
+
+def flush(timeout=None):
+    """Exports everything collected so far on a background thread, waiting at most `timeout` seconds."""
+    samples = REGISTRY.drain()
+    if not samples:
+        return
+    exporter = _get_exporter()
+
+    def export():
+        try:
+            exporter.export(samples)
+        except Exception as e:
+            log_error(f"Failed to export metrics: {e}")
+
+    worker = threading.Thread(target=export, name="metrics-flush", daemon=True)
+    worker.start()
+    worker.join(METRICS_FLUSH_TIMEOUT if timeout is None else timeout)
+    if worker.is_alive():
+        log_error("Metrics export timed out; samples dropped.")
+
+atexit.register(flush)
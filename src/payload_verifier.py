@@ -0,0 +1,371 @@
+import os
+import bz2
+import lzma
+import mmap
+import time
+import struct
+import hashlib
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ui_utils import print_status, Color, log, log_error
+from verifier import zip_data_offset
+
+# Checks the payload.bin of an A/B OTA against its own update manifest without writing
+# any partition to disk: the data hash of every install operation and, in the opt-in
+# "full" mode, the final hash of every partition rebuilt in memory from its operations.
+PAYLOAD_VERIFY_WORKERS = int(os.environ.get('PAYLOAD_VERIFY_WORKERS', os.cpu_count() or 4))
+# Operations per partition being decoded ahead of the one being hashed.
+PAYLOAD_VERIFY_WINDOW = 8
+HASH_BATCH_BYTES = 64 * 1024 * 1024
+ZERO_CHUNK = bytes(1024 * 1024)
+
+PAYLOAD_MAGIC = b"CrAU"
+# magic, file format version, manifest size, metadata signature size (version 2+)
+_PAYLOAD_HEADER = struct.Struct(">4sQQL")
+
+# InstallOperation.Type values of update_metadata.proto that a full OTA uses.
+OP_REPLACE, OP_REPLACE_BZ, OP_ZERO, OP_DISCARD, OP_REPLACE_XZ = 0, 1, 6, 7, 8
+_DECOMPRESSORS = {OP_REPLACE_BZ: bz2.decompress, OP_REPLACE_XZ: lzma.decompress}
+_FULL_OPS = {OP_REPLACE, OP_REPLACE_BZ, OP_ZERO, OP_DISCARD, OP_REPLACE_XZ}
+
+class PayloadError(Exception):
+    pass
+
+# --- Minimal protobuf reader, enough for DeltaArchiveManifest ---
+
+def _varint(buf, pos):
+    result = shift = 0
+    while True:
+        if pos >= len(buf):
+            raise PayloadError("truncated varint in manifest")
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise PayloadError("varint too long in manifest")
+
+def _fields(buf):
+    """Yields (field number, value) of a serialized message; length-delimited values are bytes."""
+    pos, end = 0, len(buf)
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = _varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _varint(buf, pos)
+            if pos + length > end:
+                raise PayloadError(f"field {number} runs past the end of its message")
+            value, pos = buf[pos:pos + length], pos + length
+        elif wire_type == 1:
+            value, pos = int.from_bytes(buf[pos:pos + 8], "little"), pos + 8
+        elif wire_type == 5:
+            value, pos = int.from_bytes(buf[pos:pos + 4], "little"), pos + 4
+        else:
+            raise PayloadError(f"unsupported wire type {wire_type} in manifest")
+        yield number, value
+    if pos != end:
+        raise PayloadError("truncated field in manifest")
+
+def _parse_extent(buf):
+    start = count = 0
+    for number, value in _fields(buf):
+        if number == 1:
+            start = value
+        elif number == 2:
+            count = value
+    return start, count
+
+def _parse_operation(buf):
+    op = {"type": 0, "data_offset": 0, "data_length": 0, "dst_extents": [], "data_sha256": None}
+    for number, value in _fields(buf):
+        if number == 1:
+            op["type"] = value
+        elif number == 2:
+            op["data_offset"] = value
+        elif number == 3:
+            op["data_length"] = value
+        elif number == 6:
+            op["dst_extents"].append(_parse_extent(value))
+        elif number == 8:
+            op["data_sha256"] = value
+    return op
+
+def _parse_partition(buf):
+    partition = {"name": None, "size": None, "sha256": None, "operations": [],
+                 "hash_tree_extent": None, "fec_extent": None}
+    for number, value in _fields(buf):
+        if number == 1:
+            partition["name"] = value.decode()
+        elif number == 7:
+            for info_number, info_value in _fields(value):
+                if info_number == 1:
+                    partition["size"] = info_value
+                elif info_number == 2:
+                    partition["sha256"] = info_value
+        elif number == 8:
+            partition["operations"].append(_parse_operation(value))
+        elif number == 11:
+            partition["hash_tree_extent"] = _parse_extent(value)
+        elif number == 15:
+            partition["fec_extent"] = _parse_extent(value)
+    return partition
+
+def parse_manifest(buf):
+    """The parts of a DeltaArchiveManifest needed to verify a payload, as plain dicts."""
+    manifest = {"block_size": 4096, "signatures_offset": None, "signatures_size": None, "partitions": []}
+    for number, value in _fields(buf):
+        if number == 3:
+            manifest["block_size"] = value
+        elif number == 4:
+            manifest["signatures_offset"] = value
+        elif number == 5:
+            manifest["signatures_size"] = value
+        elif number == 13:
+            manifest["partitions"].append(_parse_partition(value))
+        elif number in (1, 2):
+            raise PayloadError("payload uses the pre-A/B manifest layout")
+    return manifest
+
+# --- Payload layout ---
+
+def _payload_span(mapped, zf):
+    """(offset, size) of payload.bin inside the mapped zip; it must be stored to be read in place."""
+    try:
+        info = zf.getinfo("payload.bin")
+    except KeyError:
+        raise PayloadError("payload.bin not found in the OTA")
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise PayloadError("payload.bin is compressed inside the OTA")
+    return zip_data_offset(mapped, info), info.file_size
+
+def _read_payload_header(mapped, offset, size):
+    """(manifest bytes, absolute offset of the data blobs, data size)."""
+    if size < _PAYLOAD_HEADER.size:
+        raise PayloadError("payload.bin is too small")
+    magic, version, manifest_size, signature_size = _PAYLOAD_HEADER.unpack_from(mapped, offset)
+    if magic != PAYLOAD_MAGIC:
+        raise PayloadError(f"bad payload magic {magic!r}")
+    if version != 2:
+        raise PayloadError(f"unsupported payload version {version}")
+    manifest_start = offset + _PAYLOAD_HEADER.size
+    data_start = manifest_start + manifest_size + signature_size
+    if data_start > offset + size:
+        raise PayloadError("payload manifest runs past the end of payload.bin")
+    return mapped[manifest_start:manifest_start + manifest_size], data_start, offset + size - data_start
+
+def _check_layout(manifest, data_size):
+    """Every blob, and the payload signature, must lie inside the data area of payload.bin."""
+    block_size = manifest["block_size"]
+    if not block_size:
+        raise PayloadError("manifest has a zero block size")
+    for partition in manifest["partitions"]:
+        if partition["size"] is None or partition["sha256"] is None:
+            raise PayloadError(f"{partition['name']}: manifest has no new partition info")
+        blocks = -(-partition["size"] // block_size)
+        for op in partition["operations"]:
+            if op["data_offset"] + op["data_length"] > data_size:
+                raise PayloadError(f"{partition['name']}: operation data is past the end of payload.bin")
+            for start, count in op["dst_extents"]:
+                if start + count > blocks:
+                    raise PayloadError(f"{partition['name']}: operation writes past the end of the partition")
+    if manifest["signatures_offset"] is not None:
+        if manifest["signatures_offset"] + (manifest["signatures_size"] or 0) > data_size:
+            raise PayloadError("payload signature is past the end of payload.bin")
+
+# --- Verification ---
+
+def _blob_matches(view, start, op):
+    """Whether the operation's blob matches its data_sha256_hash (ops without a hash count as matching)."""
+    if op["data_sha256"] is None or not op["data_length"]:
+        return True
+    # hashlib releases the GIL on large buffers, so pool threads hash in parallel.
+    with view[start + op["data_offset"]:start + op["data_offset"] + op["data_length"]] as blob:
+        return hashlib.sha256(blob).digest() == op["data_sha256"]
+
+def _check_blobs(view, start, ops):
+    return [index for index, op in ops if not _blob_matches(view, start, op)]
+
+def _decode(view, start, op, block_size):
+    """
+    Checks an operation's blob and returns what it writes: decompressed bytes, None
+    for REPLACE (the blob itself, hashed in place) or the length of a run of zeros.
+    """
+    if not _blob_matches(view, start, op):
+        raise PayloadError("operation data hash mismatch")
+    length = sum(count for _, count in op["dst_extents"]) * block_size
+    if op["type"] in (OP_ZERO, OP_DISCARD):
+        return length
+    if op["type"] == OP_REPLACE:
+        if op["data_length"] != length:
+            raise PayloadError(f"REPLACE of {op['data_length']} bytes into {length} bytes of extents")
+        return None
+    with view[start + op["data_offset"]:start + op["data_offset"] + op["data_length"]] as blob:
+        try:
+            data = _DECOMPRESSORS[op["type"]](blob)
+        except (OSError, ValueError, lzma.LZMAError) as e:
+            raise PayloadError(f"operation data does not decompress: {e}")
+    if len(data) != length:
+        raise PayloadError(f"operation decompresses to {len(data)} bytes, extents hold {length}")
+    return data
+
+def _in_write_order(partition):
+    """The operations in the order they write the partition, or None if they do not tile it front to back."""
+    ops = sorted((op for op in partition["operations"] if op["dst_extents"]), key=lambda op: op["dst_extents"][0][0])
+    position = 0
+    for op in ops:
+        for start, count in op["dst_extents"]:
+            if start != position:
+                return None
+            position += count
+    return ops
+
+def _rebuild_hash(pool, view, start, partition, block_size):
+    """
+    SHA256 of a partition rebuilt from its operations. Pool threads check and decompress
+    operations a few steps ahead while this thread hashes them in write order.
+    """
+    ops = _in_write_order(partition)
+    if ops is None:
+        raise PayloadError("operations do not write the partition front to back")
+    sha = hashlib.sha256()
+    remaining = partition["size"]
+    pending = deque()
+    queued = iter(ops)
+    for op in queued:
+        pending.append((op, pool.submit(_decode, view, start, op, block_size)))
+        if len(pending) >= PAYLOAD_VERIFY_WINDOW:
+            break
+    try:
+        while pending:
+            op, future = pending.popleft()
+            data = future.result()
+            following = next(queued, None)
+            if following is not None:
+                pending.append((following, pool.submit(_decode, view, start, following, block_size)))
+            if data is None:
+                length = min(op["data_length"], remaining)
+                with view[start + op["data_offset"]:start + op["data_offset"] + length] as blob:
+                    sha.update(blob)
+                remaining -= length
+            elif isinstance(data, int):
+                for offset in range(0, min(data, remaining), len(ZERO_CHUNK)):
+                    sha.update(ZERO_CHUNK[:min(len(ZERO_CHUNK), data - offset, remaining - offset)])
+                remaining -= min(data, remaining)
+            else:
+                sha.update(data[:remaining])
+                remaining -= min(len(data), remaining)
+    finally:
+        for _, future in pending:
+            future.cancel()
+    if remaining:
+        raise PayloadError(f"operations leave {remaining} bytes of the partition unwritten")
+    return sha.digest()
+
+def _verify_partition(pool, view, start, partition, block_size, mode):
+    began = time.monotonic()
+    ops = partition["operations"]
+    entry = {
+        "size": partition["size"],
+        "operations": len(ops),
+        "data_bytes": sum(op["data_length"] for op in ops),
+        "unhashed_operations": sum(1 for op in ops if op["data_length"] and op["data_sha256"] is None),
+        "status": "ok",
+    }
+    unsupported = sorted({op["type"] for op in ops if op["type"] not in _FULL_OPS})
+    if unsupported:
+        # Diff operations need the source partition, which a build worker does not have.
+        not_rebuildable = f"final hash needs source data (operation types {unsupported})"
+    elif any(extent and extent[1] for extent in (partition["hash_tree_extent"], partition["fec_extent"])):
+        # The final hash covers the verity hash tree and FEC, which the updater computes on the device.
+        not_rebuildable = "final hash covers verity data the updater writes"
+    else:
+        not_rebuildable = None
+    try:
+        if mode == "full" and not not_rebuildable:
+            digest = _rebuild_hash(pool, view, start, partition, block_size)
+            entry["sha256"] = digest.hex()
+            if digest != partition["sha256"]:
+                entry["status"] = "hash_mismatch"
+                entry["error"] = f"rebuilt partition hashes to {digest.hex()}, manifest says {partition['sha256'].hex()}"
+        else:
+            # Blobs are hashed in batches of roughly HASH_BATCH_BYTES so the pool stays busy.
+            batches, batch, batch_bytes = [], [], 0
+            for index, op in enumerate(ops):
+                batch.append((index, op))
+                batch_bytes += op["data_length"]
+                if batch_bytes >= HASH_BATCH_BYTES:
+                    batches.append(batch)
+                    batch, batch_bytes = [], 0
+            if batch:
+                batches.append(batch)
+            bad = [index for future in [pool.submit(_check_blobs, view, start, b) for b in batches]
+                   for index in future.result()]
+            if bad:
+                entry["status"] = "corrupt"
+                entry["error"] = f"{len(bad)} operation(s) fail their data hash, first is #{bad[0]}"
+            elif not_rebuildable and mode == "full":
+                entry["status"] = "unchecked"
+                entry["error"] = not_rebuildable
+    except PayloadError as e:
+        entry["status"] = "corrupt"
+        entry["error"] = str(e)
+    entry["seconds"] = round(time.monotonic() - began, 3)
+    return entry
+
+def verify_payload(filepath, mode="operations", workers=None):
+    """
+    Verifies the payload.bin of an OTA zip in place through an mmap. "operations" checks
+    the manifest layout and the SHA256 of every install operation's stored data; "full"
+    also decompresses and rebuilds each partition in memory and compares its hash with
+    the manifest, which is far slower. Partitions are verified side by side.
+    Returns a report with the status of each partition; "status" is "ok" or "failed".
+    """
+    log(f"Verifying payload.bin ({mode}): {os.path.basename(filepath)}")
+    began = time.monotonic()
+    report = {"mode": mode, "status": "failed", "partitions": {}}
+    workers = workers or PAYLOAD_VERIFY_WORKERS
+    try:
+        with open(filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with zipfile.ZipFile(f) as zf:
+                payload_offset, payload_size = _payload_span(mapped, zf)
+            manifest_bytes, data_start, data_size = _read_payload_header(mapped, payload_offset, payload_size)
+            manifest = parse_manifest(manifest_bytes)
+            _check_layout(manifest, data_size)
+            report.update(payload_bytes=payload_size, block_size=manifest["block_size"],
+                          operations=sum(len(p["operations"]) for p in manifest["partitions"]))
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_WILLNEED)
+
+            partitions = manifest["partitions"]
+            with memoryview(mapped) as view, \
+                    ThreadPoolExecutor(max_workers=workers, thread_name_prefix="payload") as pool, \
+                    ThreadPoolExecutor(max_workers=max(1, min(workers, len(partitions))),
+                                       thread_name_prefix="partition") as partition_pool:
+                futures = [partition_pool.submit(_verify_partition, pool, view, data_start, partition,
+                                                 manifest["block_size"], mode) for partition in partitions]
+                for partition, future in zip(partitions, futures):
+                    report["partitions"][partition["name"]] = future.result()
+    except (PayloadError, zipfile.BadZipFile, OSError, ValueError) as e:
+        log_error(f"Payload verification error: {e}")
+        report["error"] = str(e)
+        report["seconds"] = round(time.monotonic() - began, 3)
+        return report
+
+    report["seconds"] = round(time.monotonic() - began, 3)
+    failed = {name: entry for name, entry in report["partitions"].items() if entry["status"] not in ("ok", "unchecked")}
+    for name, entry in failed.items():
+        log_error(f"{name}: {entry['status']}: {entry['error']}")
+    if failed:
+        return report
+    report["status"] = "ok"
+    unchecked = [name for name, entry in report["partitions"].items() if entry["status"] == "unchecked"]
+    if unchecked:
+        log(f"⚠️  Final hash not checked for: {', '.join(unchecked)}")
+    print_status("PAYLOAD", "SUCCESS",
+                 f"{len(report['partitions'])} partition(s), {report['operations']} operation(s) verified ({mode})", Color.GREEN)
+    return report
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ui_utils import log, log_error
+
+class Stage:
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+def run_stage_graph(stages, max_workers=4):
+    """
+    Runs every stage as soon as all of its dependencies have finished.
+    Each stage function receives the results of the stages completed so far.
+    After the first failure no new stage is started; the running ones are
+    awaited and the failure (including SystemExit) is re-raised.
+    """
+    pending = {stage.name: stage for stage in stages}
+    for stage in stages:
+        unknown = [dep for dep in stage.deps if dep not in pending]
+        if unknown:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stage(s): {', '.join(unknown)}")
+
+    results = {}
+    running = {}
+    failure = None
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage") as pool:
+        while pending or running:
+            if failure is None:
+                for name, stage in list(pending.items()):
+                    if all(dep in results for dep in stage.deps):
+                        log(f"▶️  Stage started: {name}")
+                        running[pool.submit(stage.func, dict(results))] = name
+                        del pending[name]
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except BaseException as e:
+                    if failure is None:
+                        log_error(f"Stage '{name}' failed: {e}")
+                        failure = e
+
+    if failure is not None:
+        raise failure
+    if pending:
+        raise ValueError(f"Stage graph has a dependency cycle: {', '.join(pending)}")
+    return results
+
+class _StageFailure(Exception):
+    """Carries a stage's exception (SystemExit included) through the TaskGroup."""
+
+    def __init__(self, name, error):
+        super().__init__(name)
+        self.name = name
+        self.error = error
+
+def _check_graph(stages):
+    deps = {stage.name: set(stage.deps) for stage in stages}
+    for stage in stages:
+        unknown = [dep for dep in stage.deps if dep not in deps]
+        if unknown:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stage(s): {', '.join(unknown)}")
+    done = set()
+    while len(done) < len(deps):
+        ready = [name for name, needs in deps.items() if name not in done and needs <= done]
+        if not ready:
+            raise ValueError(f"Stage graph has a dependency cycle: {', '.join(set(deps) - done)}")
+        done.update(ready)
+
+def _run_in_daemon_thread(name, func, results):
+    """
+    Blocking stages run on daemon threads: a cancelled stage cannot be interrupted
+    (a GCS call or subprocess runs to completion), but it is abandoned instead of
+    holding up interpreter exit the way executor threads would.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(result=None, error=None):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(_StageFailure(name, error))
+        else:
+            future.set_result(result)
+
+    def target():
+        try:
+            result, error = func(results), None
+        except BaseException as e:
+            result, error = None, e
+        try:
+            loop.call_soon_threadsafe(settle, result, error)
+        except RuntimeError:
+            pass  # The graph already failed and its loop is closed; nobody waits for this stage.
+
+    threading.Thread(target=target, name=f"stage-{name}", daemon=True).start()
+    return future
+
+async def _run_stage_graph_async(stages):
+    results = {}
+    finished = {stage.name: asyncio.Event() for stage in stages}
+
+    async def run(stage):
+        for dep in stage.deps:
+            await finished[dep].wait()
+        log(f"▶️  Stage started: {stage.name}")
+        results[stage.name] = await _run_in_daemon_thread(stage.name, stage.func, dict(results))
+        finished[stage.name].set()
+
+    failure = None
+    try:
+        async with asyncio.TaskGroup() as group:
+            for stage in stages:
+                group.create_task(run(stage))
+    except ExceptionGroup as errors:
+        failure = errors.exceptions[0]
+    if failure is not None:
+        if isinstance(failure, _StageFailure):
+            log_error(f"Stage '{failure.name}' failed: {failure.error}")
+            raise failure.error
+        raise failure
+    return results
+
+def run_async_stage_graph(stages):
+    """
+    Runs independent I/O-bound stages concurrently on an asyncio TaskGroup.
+    Same contract as run_stage_graph, except that the first failure cancels
+    every stage still waiting or running instead of letting them finish.
+    """
+    _check_graph(stages)
+    return asyncio.run(_run_stage_graph_async(stages))
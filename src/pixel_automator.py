@@ -1,81 +1,105 @@
 import os
 import sys
+
+# Must run before the imports below so that they are measured too.
+import startup_profile
+if "--profile-startup" in sys.argv[1:]:
+    startup_profile.install()
+
 import json
 import argparse
 import shutil
 from datetime import datetime, timezone
 import time
 import subprocess
-
-try:
-    from google.cloud import storage
-    from google.cloud import monitoring_v3
-except ImportError:
-    storage = None
-    monitoring_v3 = None
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from ui_utils import print_header, print_status, log, log_error, Color, get_visual_hash
 import downloader
 import verifier
 import avb_patcher
+import pipeline
+import timing
+import metrics
+import build_index
+import build_cache
+import publisher
+import storage_backend
+import payload_verifier
 
 DEVICE_CODENAME = os.environ.get('_DEVICE_CODENAME', 'frankel')
 OUTPUT_JSON = "build_status.json"
+LATEST_DEVICE_PREFIX = "latest/"
 DEFAULT_KEY_NAME = "cyber_rsa4096_private.pem"
 KEY_SEARCH_PATHS = [
     "/app/secrets/cyber_rsa4096_private.pem",
     f"/app/{DEFAULT_KEY_NAME}",
     DEFAULT_KEY_NAME,
 ]
-OUTPUT_DIR = "/app/output"
+OUTPUT_DIR = os.environ.get('OUTPUT_DIR', "/app/output")
+AVBTOOL_PATH = os.environ.get('AVBTOOL_PATH', "/usr/local/bin/avbtool.py")
+BATCH_WORK_DIR = os.environ.get('BATCH_WORK_DIR', "/app/work")
+BATCH_CPUS_PER_BUILD = int(os.environ.get('BATCH_CPUS_PER_BUILD', 2))
+# Cloud Run's filesystem is memory-backed, so the memory estimate includes the on-disk zips.
+BATCH_BUILD_MEMORY_GB = float(os.environ.get('BATCH_BUILD_MEMORY_GB', 8))
+BATCH_BUILD_DISK_GB = float(os.environ.get('BATCH_BUILD_DISK_GB', 8))
+CACHE_TEE_CHUNK_SIZE = 32 * 1024 * 1024  # Must be a multiple of 256 KiB
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 8))
+UPLOAD_RETRIES = int(os.environ.get('UPLOAD_RETRIES', 3))
+# Files at least this large are uploaded as parallel parts composed server-side.
+COMPOSITE_UPLOAD_THRESHOLD = int(os.environ.get('COMPOSITE_UPLOAD_THRESHOLD', 256 * 1024 * 1024))
+COMPOSITE_MIN_PART_SIZE = 64 * 1024 * 1024
+COMPOSITE_MAX_PARTS = 32  # GCS compose limit per request
+# Deflate level for the ZIPs we build ourselves (--minimal); --fast forces 0 (stored).
+# Level 1 is within a few percent of 6 and 9 at under half the time (benchmarks/package_levels.py).
+PACKAGE_COMPRESSION_LEVEL = int(os.environ.get('PACKAGE_COMPRESSION_LEVEL', 1))
+POST_PATCH_WORKERS = int(os.environ.get('POST_PATCH_WORKERS', 4))
+# Upper bound for intermediate files held at once; 0 means the free space of the work filesystem.
+BUILD_DISK_BUDGET_GB = float(os.environ.get('BUILD_DISK_BUDGET_GB', 0))
+EXTRACT_ESTIMATE_BYTES = 512 * 1024 * 1024
+# ZIP integrity check of the patched output: full (every CRC), structural (central directory only) or off.
+ZIP_VERIFY = os.environ.get('ZIP_VERIFY', 'full').lower()
+# payload.bin check of the patched OTA: operations (manifest and operation data hashes),
+# full (also rebuilds and hashes every partition) or off.
+PAYLOAD_VERIFY = os.environ.get('PAYLOAD_VERIFY', 'operations').lower()
+# Poll the OTA page against the fingerprint in the bucket and stop early when nothing changed.
+OTA_PAGE_POLL = os.environ.get('OTA_PAGE_POLL', '1') != '0'
+PAGE_ROW_FIELDS = ("row_id", "url", "filename", "sha256")
 
-def report_failure_metric(error_reason="unknown"):
-    _report_metric("build_failures", labels={"reason": error_reason})
+# Serialises read-modify-write updates of the build indices across batch workers.
+_INDEX_LOCK = threading.Lock()
 
-def report_success_metric():
-    _report_metric("build_success")
+def report_failure_metric(error_reason="unknown", device=None):
+    _report_metric("build_failures", labels={"reason": error_reason}, device=device)
 
-def _create_time_series_point():
-    """Creates a Point object for the current time."""
-    now = time.time()
-    seconds = int(now)
-    nanos = int((now - seconds) * 10**9)
-    interval = monitoring_v3.TimeInterval(
-        {"end_time": {"seconds": seconds, "nanos": nanos}}
-    )
-    return monitoring_v3.Point({"interval": interval, "value": {"int64_value": 1}})
+def report_success_metric(device=None):
+    _report_metric("build_success", device=device)
 
-def _report_metric(metric_name, labels=None):
-    if not monitoring_v3:
-        log(f"⚠️  Metric '{metric_name}' skipped: google.cloud.monitoring_v3 not available.")
-        return
+def _report_metric(metric_name, labels=None, device=None):
+    """Buffers a counter increment; metrics.flush() exports everything in one batch at exit."""
+    metric_labels = {"device": device or DEVICE_CODENAME}
+    metric_labels.update(labels or {})
+    metrics.increment(metric_name, metric_labels)
 
-    project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    if not project_id:
-        log(
-            f"⚠️  Metric '{metric_name}' skipped: GOOGLE_CLOUD_PROJECT environment variable not set."
-        )
-        return
+def report_stage_metrics(timer, device=None):
+    """
+    Records the stage timings of one device as distribution samples next to the build
+    counters. Stages inherited from the run's prepare timer are left to report_run_stage_metrics.
+    """
+    _observe_stages(timer.summary(include_inherited=False), {"device": device or DEVICE_CODENAME})
 
-    log(f"📈 Reporting {metric_name} metric to Stackdriver...")
-    try:
-        client = monitoring_v3.MetricServiceClient()
-        project_name = f"projects/{project_id}"
+def report_run_stage_metrics(timer):
+    """Records the prepare stages once per run, without a device label: every device of a batch shares them."""
+    _observe_stages(timer.summary(), {})
 
-        series = monitoring_v3.TimeSeries()
-        series.metric.type = f"custom.googleapis.com/pixel_automator/{metric_name}"
-        series.resource.type = "global"
-        series.metric.labels["device"] = DEVICE_CODENAME
-
-        if labels:
-            for key, value in labels.items():
-                series.metric.labels[key] = str(value)[:255]  # Limit label value size
-
-        series.points = [_create_time_series_point()]
-
-        client.create_time_series(name=project_name, time_series=[series])
-    except Exception as e:
-        log_error(f"Failed to push {metric_name} metric: {e}")
+def _observe_stages(stages, labels):
+    for stage, entry in stages.items():
+        stage_labels = {**labels, "stage": stage}
+        metrics.observe("stage_duration_seconds", entry["seconds"], stage_labels, metrics.DURATION_BUCKETS)
+        if entry["mb_per_s"]:
+            metrics.observe("stage_throughput_mbps", entry["mb_per_s"], stage_labels, metrics.THROUGHPUT_BUCKETS)
 
 def debug_paths():
     log("🔍 Debugging Key Paths:")
@@ -88,70 +112,164 @@ def debug_paths():
         files = os.listdir("/app")
         log(f"   /app contents (partial): {files[:10]}")
 
-def download_gcs_file(bucket_name, blob_name, destination):
-    log(f"☁️  Downloading from GCS: gs://{bucket_name}/{blob_name}")
+def get_backend(bucket_env):
+    """Storage backend of a bucket spec (gs://name, name, file:///dir or a path); None without a usable bucket."""
+    return storage_backend.get_backend(bucket_env)
+
+def download_object(bucket_env, blob_name, destination):
+    backend = get_backend(bucket_env)
+    log(f"☁️  Downloading from storage: {backend}/{blob_name}")
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        blob.download_to_filename(destination)
+        backend.get_file(blob_name, destination)
         log("✅ Download success")
         return True
     except Exception as e:
-        log_error(f"GCS Download Failed: {e}")
+        log_error(f"Storage Download Failed: {e}")
         return False
 
-def upload_gcs_file(bucket_name, source_file, destination_blob_name):
-    log(f"☁️  Uploading to GCS: {source_file} -> gs://{bucket_name}/{destination_blob_name}")
+def upload_object(bucket_env, source_file, destination_blob_name, retries=1, sha256=None):
+    backend = get_backend(bucket_env)
+    if backend.composite_uploads and os.path.getsize(source_file) >= COMPOSITE_UPLOAD_THRESHOLD:
+        return upload_object_composite(backend, source_file, destination_blob_name, sha256)
+
+    log(f"☁️  Uploading: {source_file} -> {backend}/{destination_blob_name}")
+    metadata = {"sha256": sha256} if sha256 else None
+    for attempt in range(1, retries + 1):
+        try:
+            backend.put_file(destination_blob_name, source_file, metadata=metadata)
+            log(f"✅ Upload success: {destination_blob_name}")
+            return True
+        except Exception as e:
+            if attempt < retries:
+                log(f"⚠️  Upload of {destination_blob_name} failed ({e}). Retry {attempt}/{retries - 1}...")
+                time.sleep(2 ** attempt)
+            else:
+                log_error(f"Storage Upload Failed: {e}")
+    return False
+
+def _upload_part(backend, source_file, part_name, offset, length):
+    for attempt in range(1, UPLOAD_RETRIES + 1):
+        try:
+            # put_range verifies every part against the CRC32C of the bytes it read.
+            return backend.put_range(part_name, source_file, offset, length)
+        except Exception as e:
+            if attempt == UPLOAD_RETRIES:
+                raise
+            log(f"⚠️  Part {part_name} failed ({e}). Retry {attempt}/{UPLOAD_RETRIES - 1}...")
+            time.sleep(2 ** attempt)
+
+def upload_object_composite(backend, source_file, destination_blob_name, sha256=None):
+    """
+    Uploads a large file as parallel parts and composes them into the final object.
+    GCS cannot hash objects with SHA256, so the composed object's CRC32C is checked
+    against the combined (client-verified) part CRCs and `sha256` is stored as metadata.
+    """
+    total_size = os.path.getsize(source_file)
+    part_count = max(2, min(COMPOSITE_MAX_PARTS, math.ceil(total_size / COMPOSITE_MIN_PART_SIZE)))
+    part_size = math.ceil(total_size / part_count)
+    ranges = [(offset, min(part_size, total_size - offset)) for offset in range(0, total_size, part_size)]
+    part_prefix = f"{destination_blob_name}.parts"
+    log(f"☁️  Composite upload: {source_file} -> {backend}/{destination_blob_name} "
+        f"({len(ranges)} parts x {part_size / 1024**2:.0f} MiB)")
+
+    parts = [None] * len(ranges)
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(destination_blob_name)
-        blob.upload_from_filename(source_file)
-        log("✅ Upload success")
+        with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(ranges)), thread_name_prefix="part") as pool:
+            futures = {
+                pool.submit(_upload_part, backend, source_file, f"{part_prefix}/{i:04d}", offset, length): i
+                for i, (offset, length) in enumerate(ranges)
+            }
+            errors = []
+            for future in as_completed(futures):
+                try:
+                    parts[futures[future]] = future.result()
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+
+        destination = backend.compose(
+            destination_blob_name, [part["name"] for part in parts], metadata={"sha256": sha256} if sha256 else None
+        )
+
+        expected_crc = parts[0]["crc32c"]
+        for part, (_, length) in zip(parts[1:], ranges[1:]):
+            expected_crc = verifier.crc_combine(expected_crc, part["crc32c"], length)
+        if destination["size"] != total_size or destination["crc32c"] != expected_crc:
+            log_error(f"Composite object verification failed (size {destination['size']}/{total_size}, CRC32C mismatch?)")
+            backend.delete(destination_blob_name)
+            return False
+        if sha256 and destination["metadata"].get("sha256") != sha256:
+            log_error("Composite object is missing its SHA256 metadata.")
+            backend.delete(destination_blob_name)
+            return False
+
+        log(f"✅ Upload success: {destination_blob_name} (CRC32C verified)")
         return True
     except Exception as e:
-        log_error(f"GCS Upload Failed: {e}")
+        log_error(f"Composite Upload Failed: {e}")
         return False
+    finally:
+        _delete_objects_quietly(backend, [part["name"] for part in parts if part is not None])
 
-def verify_bucket_access(bucket_name):
-    if not bucket_name or not storage:
+def _delete_objects_quietly(backend, names):
+    def delete(name):
+        try:
+            backend.delete(name)
+        except Exception:
+            pass
+    if names:
+        with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(names))) as pool:
+            list(pool.map(delete, names))
+
+def upload_files_parallel(bucket_env, uploads, max_workers=None):
+    """Uploads [(local_path, blob_name), ...] concurrently with per-file retry. Returns the failed blob names."""
+    if not uploads:
+        return []
+    workers = min(max_workers or UPLOAD_WORKERS, len(uploads))
+    log(f"☁️  Uploading {len(uploads)} file(s) to {get_backend(bucket_env)} with {workers} worker(s)...")
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload") as pool:
+        futures = {
+            pool.submit(upload_object, bucket_env, local_path, blob_name, UPLOAD_RETRIES): blob_name
+            for local_path, blob_name in uploads
+        }
+        for future in as_completed(futures):
+            if not future.result():
+                failed.append(futures[future])
+    return failed
+
+def verify_bucket_access(bucket_env):
+    backend = get_backend(bucket_env)
+    if not backend:
         return
 
-    log(f"🔍 Checking access to GCS Bucket: {bucket_name}")
+    log(f"🔍 Checking access to bucket: {backend}")
     try:
-        client = storage.Client()
-        client.bucket(bucket_name)
         # Check Read/List
-        blobs = client.list_blobs(bucket_name, max_results=1)
-        for _ in blobs: pass
+        backend.list(max_results=1)
 
         # Check Write
-        bucket = client.bucket(bucket_name)
         test_blob_name = f"access_check_{int(time.time())}.tmp"
-        blob = bucket.blob(test_blob_name)
-        blob.upload_from_string("write_test")
-        blob.delete()
+        backend.put_bytes(test_blob_name, b"write_test")
+        backend.delete(test_blob_name)
 
-        log(f"✅ Bucket '{bucket_name}' verified.")
+        log(f"✅ Bucket '{backend}' verified.")
     except Exception as e:
-        log_error(f"❌ CRITICAL failure accessing bucket '{bucket_name}': {e}")
+        log_error(f"❌ CRITICAL failure accessing bucket '{backend}': {e}")
         report_failure_metric("bucket_access_failed")
         sys.exit(1)
 
-def extract_and_upload_public_key(bucket_name, private_key_path):
-    if not bucket_name or not storage:
+def extract_and_upload_public_key(bucket_env, private_key_path):
+    backend = get_backend(bucket_env)
+    if not backend:
         return
 
     public_key_blob = "keys/avb_pkmd.bin"
     log(f"🔑 Checking if Public Key exists in bucket: {public_key_blob}")
 
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(public_key_blob)
-
-        if blob.exists():
+        if backend.exists(public_key_blob):
             log("   Public Key already exists in cloud. Skipping generation.")
             return
 
@@ -159,7 +277,7 @@ def extract_and_upload_public_key(bucket_name, private_key_path):
         output_path = "/tmp/avb_pkmd.bin"
 
         cmd = [
-            "/usr/local/bin/avbtool.py", "extract_public_key",
+            AVBTOOL_PATH, "extract_public_key",
             "--key", private_key_path,
             "--output", output_path
         ]
@@ -168,7 +286,7 @@ def extract_and_upload_public_key(bucket_name, private_key_path):
 
         if os.path.exists(output_path):
             log(f"   Uploading generated Public Key to {public_key_blob}...")
-            upload_gcs_file(bucket_name, output_path, public_key_blob)
+            upload_object(bucket_env, output_path, public_key_blob)
             log("✅ Public Key published successfully.")
         else:
             log_error("Failed to generate Public Key (file not found after command).")
@@ -179,45 +297,138 @@ def extract_and_upload_public_key(bucket_name, private_key_path):
 def get_bucket_env():
     return os.environ.get('BUCKET_NAME') or os.environ.get('_BUCKET_NAME')
 
-def check_cloud_index(bucket_env, filename):
-    if not bucket_env or not storage:
+def expected_output_name(upstream_filename, args):
+    """Filename the active mode publishes to the builds index, or None for raw builds (not indexed)."""
+    if args.raw_output:
+        return None
+    if args.minimal:
+        return f"ksu_patched_{os.path.splitext(os.path.basename(upstream_filename))[0]}_minimal.zip"
+    return f"ksu_patched_{os.path.basename(upstream_filename)}"
+
+def check_cloud_index(bucket_env, expected_output, device, marker_name=None):
+    """`marker_name` is only passed for full OTA builds, the only ones that write markers."""
+    backend = get_backend(bucket_env)
+    if not backend or not expected_output:
         return False
         
     log("🔎 Checking Cloud Index for existing build...")
     try:
-        index_filename = "builds_index.json"
-        if download_gcs_file(bucket_env, index_filename, index_filename):
-            with open(index_filename, 'r') as f:
-                indices = json.load(f)
-            
-            expected_output = f"ksu_patched_{filename}"
-            for entry in indices:
-                if entry.get("filename") == expected_output:
-                    log(f"✅ Build already exists in Cloud Index: {expected_output}")
-                    return True
+        if marker_name:
+            marker = build_index.find_marker(backend, marker_name)
+            if marker is not None:
+                log(f"✅ Build marker found: {marker.get('filename', expected_output)}")
+                return True
+
+        # Builds published before the sharded index are migrated from the roll-up on the device's first miss.
+        if build_index.lookup(backend, expected_output, device):
+            log(f"✅ Build already exists in Cloud Index: {expected_output}")
+            return True
     except Exception as e:
         log(f"⚠️  Index check failed (ignoring): {e}")
     return False
 
-def manage_cache_download(cache_bucket_env, filename, scraped_sha256):
-    if not cache_bucket_env:
+def rows_up_to_date(poll, devices, key_hash):
+    """
+    True when the page poll found every device at the row recorded as built in the
+    page state, and that build used the current signing key (same marker).
+    """
+    if not poll:
         return False
+    recorded = poll["state"].get("devices", {})
+    for device in devices:
+        row, entry = poll["rows"].get(device), recorded.get(device)
+        if not row or not entry:
+            return False
+        if any(row[field] != entry.get(field) for field in PAGE_ROW_FIELDS):
+            return False
+        if entry.get("marker") != build_index.marker_blob_name(row["filename"], row["sha256"], key_hash):
+            return False
+    return True
+
+def record_page_row(run, device, marker_name):
+    """Remembers the device's polled row as built, so later runs on an unchanged page stop after the poll."""
+    poll = run.get("page_poll")
+    if not poll or not marker_name or device not in poll["rows"]:
+        return
+    row = {field: poll["rows"][device][field] for field in PAGE_ROW_FIELDS}
+    try:
+        with _INDEX_LOCK:
+            build_index.record_page_rows(get_backend(run["bucket_env"]), poll["page"], {device: {**row, "marker": marker_name}})
+    except Exception as e:
+        log(f"⚠️  Could not record the OTA page fingerprint: {e}")
+
+def manage_cache_download(cache_bucket_env, blob_name, filename):
+    """Returns the SHA256 of the cached file (hashed while downloading), or None on a miss."""
+    backend = get_backend(cache_bucket_env)
+    if not backend:
+        return None
         
-    log(f"🕵️  Checking Cloud Cache for: {filename}")
+    log(f"🕵️  Checking Cloud Cache for: {blob_name}")
     try:
-        client = storage.Client()
-        c_bucket = client.bucket(cache_bucket_env)
-        blob = c_bucket.blob(filename)
-        if blob.exists():
-            log(f"⚡ CLOUD CACHE HIT! Downloading from GCS...")
-            blob.download_to_filename(filename)
+        if backend.exists(blob_name):
+            log(f"⚡ CLOUD CACHE HIT! Downloading from {backend}...")
+            with open(filename, 'wb') as f:
+                writer = verifier.HashingWriter(f)
+                backend.read_into(blob_name, writer)
+            verifier.record_file_sha256(filename, writer.hexdigest())
             log("✅ Download from Cache complete.")
-            return True
+            return writer.hexdigest()
     except Exception as e:
         log(f"⚠️  Cache lookup failed: {e}")
-    return False
+        if os.path.exists(filename):
+            os.remove(filename)
+    return None
+
+class CacheUploadTee:
+    """
+    Streams downloaded bytes into an upload of the cache object.
+    The object only becomes visible on commit(); abort() cancels the upload
+    so a file that failed verification is never published to the cache.
+    """
+
+    def __init__(self, backend, blob_name):
+        self.backend = backend
+        self.blob_name = blob_name
+        self.writer = backend.open_writer(blob_name, chunk_size=CACHE_TEE_CHUNK_SIZE)
+        self.aborted = False
+
+    def write(self, data):
+        self.writer.write(data)
+
+    def abort(self):
+        if self.aborted:
+            return
+        self.aborted = True
+        try:
+            self.writer.abort()
+        except Exception as e:
+            log(f"⚠️  Could not cancel cache upload session (it will expire): {e}")
+        log(f"🗑️  Cache upload of {self.backend}/{self.blob_name} discarded.")
+
+    def commit(self):
+        if self.aborted:
+            return False
+        try:
+            self.writer.close()
+            log(f"✅ Cloud Cache populated: {self.backend}/{self.blob_name}")
+            return True
+        except Exception as e:
+            log_error(f"Failed to finalize cache upload: {e}")
+            self.abort()
+            return False
+
+def open_cache_upload_tee(cache_bucket_env, filename):
+    backend = get_backend(cache_bucket_env)
+    if not backend:
+        return None
+    try:
+        log(f"📦 Streaming download into Cloud Cache: {backend}/{filename}")
+        return CacheUploadTee(backend, filename)
+    except Exception as e:
+        log(f"⚠️  Could not open cache upload stream: {e}")
+        return None
 
-def resolve_key_path(local_key):
+def resolve_key_path(local_key, bucket_env=None):
     if local_key:
         if os.path.exists(local_key): 
             return os.path.abspath(local_key)
@@ -229,16 +440,15 @@ def resolve_key_path(local_key):
             log(f"🔑 Found key at: {path}")
             return path
             
-    # Fallback to GCS fetch
-    bucket_env = get_bucket_env()
-    if bucket_env and storage:
+    # Fallback to bucket fetch
+    if get_backend(bucket_env):
         log(f"Key not found locally. Attempting fetch from bucket: {bucket_env}")
         key_blob = f"keys/{DEFAULT_KEY_NAME}"
         fetched_key_path = os.path.join("/app", DEFAULT_KEY_NAME)
-        if download_gcs_file(bucket_env, key_blob, fetched_key_path):
+        if download_object(bucket_env, key_blob, fetched_key_path):
             return fetched_key_path
         else:
-            log_error(f"Could not fetch key from GCS.")
+            log_error(f"Could not fetch key from bucket.")
             report_failure_metric("key_fetch_failed")
             sys.exit(1)
             
@@ -246,39 +456,24 @@ def resolve_key_path(local_key):
     report_failure_metric("key_not_found_local")
     sys.exit(1)
 
-def update_central_index(bucket_env, output_filename, zip_blob_path, filename):
-    index_filename = "builds_index.json"
-    log("update_build_index: Downloading existing index...")
-    
-    current_index = []
-    if download_gcs_file(bucket_env, index_filename, index_filename):
-        try:
-            with open(index_filename, "r") as f:
-                current_index = json.load(f)
-        except:
-            current_index = []
-    
-    new_entry = {
-        "device": DEVICE_CODENAME,
-        "android_version": os.path.basename(filename).split('-')[2] if len(os.path.basename(filename).split('-')) > 2 else "unknown",
-        "build_date": datetime.now(timezone.utc).strftime('%Y%m%d'),
-        "filename": os.path.basename(output_filename),
-        "url": f"https://storage.googleapis.com/{bucket_env}/{zip_blob_path}",
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
-    
-    current_index = [x for x in current_index if x.get("filename") != new_entry["filename"]]
-    current_index.append(new_entry)
-    current_index.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-    
-    with open(index_filename, "w") as f:
-        json.dump(current_index, f, indent=4)
-        
-    upload_gcs_file(bucket_env, index_filename, index_filename)
+def update_central_index(bucket_env, output_filename, zip_blob_path, filename, device=None, work_dir=".", marker_name=None):
+    with _INDEX_LOCK:
+        _update_central_index(bucket_env, output_filename, zip_blob_path, filename, device or DEVICE_CODENAME, work_dir, marker_name)
+
+def _update_central_index(bucket_env, output_filename, zip_blob_path, filename, device, work_dir, marker_name):
+    log("update_build_index: Publishing index entry...")
+    backend = get_backend(bucket_env)
+    entry = build_index.make_entry(device, filename, output_filename, backend.public_url(zip_blob_path))
+    build_index.publish(backend, entry)
+    if marker_name:
+        build_index.write_marker(backend, marker_name, entry)
     log("✅ Central index updated.")
 
-def update_local_index(filename, output_filename):
-    date_str = datetime.now(timezone.utc).strftime('%Y%m%d')
+def update_local_index(filename, output_filename, device=None):
+    with _INDEX_LOCK:
+        _update_local_index(filename, output_filename, device or DEVICE_CODENAME)
+
+def _update_local_index(filename, output_filename, device):
     local_index_path = os.path.join(OUTPUT_DIR, "builds_index.json")
     local_index = []
     
@@ -288,63 +483,343 @@ def update_local_index(filename, output_filename):
                 local_index = json.load(f)
         except: pass
 
-    new_local_entry = {
-        "device": DEVICE_CODENAME,
-        "android_version": os.path.basename(filename).split('-')[2] if len(os.path.basename(filename).split('-')) > 2 else "unknown",
-        "build_date": date_str,
-        "filename": os.path.basename(output_filename),
-        "url": f"/builds/{os.path.basename(output_filename)}",
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
-    
-    local_index = [x for x in local_index if x.get("filename") != new_local_entry["filename"]]
-    local_index.append(new_local_entry)
-    local_index.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+    new_local_entry = build_index.make_entry(
+        device, filename, output_filename, f"/builds/{os.path.basename(output_filename)}"
+    )
+    local_index = build_index.merge_entry(local_index, new_local_entry)
     
     with open(local_index_path, "w") as f:
         json.dump(local_index, f, indent=4)
         
     log(f"✅ Local build index updated: {local_index_path}")
 
-def main():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--local-file', help='Local ZIP file')
     parser.add_argument('--local-key', help='Local Key')
+    parser.add_argument('--devices', help='Comma-separated device codenames to build in one batch run')
     parser.add_argument('--minimal', action='store_true', help='Create minimal ZIP (only modified files)')
-    parser.add_argument('--fast', action='store_true', help='Use fast compression (store mode)')
-    parser.add_argument('--raw-output', action='store_true', help='Skip ZIP, output raw init_boot.img only (fastest)')
+    parser.add_argument('--fast', action='store_true', help='Store the --minimal package uncompressed')
+    parser.add_argument('--raw-output', action='store_true', help='Publish only the patched init_boot.img (the OTA is still patched; saves packaging and upload)')
     parser.add_argument('--skip-hash-check', action='store_true', help='Skip local SHA256 calculation if file exists')
-    args = parser.parse_args()
+    parser.add_argument('--bucket', help='Release bucket: gs://name or file:///dir (default: BUCKET_NAME)')
+    parser.add_argument('--cache-bucket', help='Download cache bucket: gs://name or file:///dir (default: CACHE_BUCKET_NAME)')
+    parser.add_argument('--profile-startup', action='store_true', help='Report import and initialization time per module')
+    args = parser.parse_args(argv)
+    if args.fast and not args.minimal:
+        # The OTA ZIP is written by avbroot and its payload.bin is always stored.
+        parser.error("--fast only applies to --minimal packages")
+    return args
 
-    print_header("PIXEL AUTO-PATCHER START")
+class DiskBudgetExceeded(Exception):
+    pass
 
-    bucket_env = get_bucket_env()
-    verify_bucket_access(bucket_env)
-    
+class DiskBudget:
+    """
+    Byte accounting for intermediate files on the work filesystem, which is RAM on
+    Cloud Run. Files are tracked together with the stages that still read them and
+    deleted as soon as the last of those finishes. Stages reserve their expected
+    output before starting and are refused if that would exceed the limit.
+    One budget is shared by every build of a run.
+    """
 
-    
-    cache_bucket_env = os.environ.get('CACHE_BUCKET_NAME')
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.lock = threading.Lock()
+        self.files = {}
+        self.reserved = {}
+        self.peak_bytes = 0
+
+    def _in_use(self):
+        return sum(size for size, _ in self.files.values()) + sum(self.reserved.values())
+
+    def _update_peak(self):
+        self.peak_bytes = max(self.peak_bytes, self._in_use())
+
+    def reserve(self, name, nbytes):
+        with self.lock:
+            in_use = self._in_use()
+            if self.limit_bytes and in_use + nbytes > self.limit_bytes:
+                raise DiskBudgetExceeded(
+                    f"{name} needs {nbytes / 1024**3:.2f} GiB but only "
+                    f"{(self.limit_bytes - in_use) / 1024**3:.2f} GiB of the "
+                    f"{self.limit_bytes / 1024**3:.2f} GiB budget is left"
+                )
+            self.reserved[name] = self.reserved.get(name, 0) + nbytes
+            self._update_peak()
+
+    def unreserve(self, name):
+        with self.lock:
+            self.reserved.pop(name, None)
+
+    def track(self, path, consumers=()):
+        """Counts `path` against the budget; it is deleted once every consumer has called consumed()."""
+        size = timing.path_size(path)
+        with self.lock:
+            self.files[path] = (size, set(consumers))
+            self._update_peak()
+
+    def consumed(self, path, consumer):
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is None or consumer not in entry[1]:
+                return
+            entry[1].discard(consumer)
+            if entry[1]:
+                return
+            del self.files[path]
+        log(f"🧹 freeing space: removing {path} ({entry[0] / 1024**2:.0f} MiB)")
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def unreserve_prefix(self, prefix):
+        """Drops every reservation of one build, e.g. after it failed mid-stage."""
+        with self.lock:
+            for name in [name for name in self.reserved if name.startswith(prefix)]:
+                del self.reserved[name]
+
+    def forget(self, path):
+        """Stops tracking a file that left the work filesystem (published or uploaded)."""
+        with self.lock:
+            self.files.pop(path, None)
+
+    def summary(self):
+        with self.lock:
+            return {
+                "limit_bytes": self.limit_bytes,
+                "peak_bytes": self.peak_bytes,
+                "in_use_bytes": self._in_use(),
+            }
+
+def report_budget(budget, device=None):
+    summary = budget.summary()
+    log(f"💽 Peak intermediate storage: {summary['peak_bytes'] / 1024**3:.2f} GiB "
+        f"(budget {summary['limit_bytes'] / 1024**3:.1f} GiB)")
+    metrics.set_gauge("disk_peak_bytes", summary["peak_bytes"], {"device": device or DEVICE_CODENAME})
+
+def reserve_or_exit(budget, name, nbytes, device):
+    try:
+        budget.reserve(name, nbytes)
+    except DiskBudgetExceeded as e:
+        log_error(f"Refusing to start {name}: {e}")
+        report_failure_metric("disk_budget_exceeded", device)
+        sys.exit(1)
+
+def final_output_dir(work_dir, backend):
+    """
+    Where finished artifacts are written: straight into OUTPUT_DIR when they are kept
+    there, so publishing them is not a full copy from another filesystem; otherwise the
+    work dir, from which they are deleted once uploaded.
+    """
+    if os.path.isdir(OUTPUT_DIR) and (not backend or output_dir_is_persistent(work_dir)):
+        return OUTPUT_DIR
+    return work_dir
+
+def output_dir_is_persistent(work_dir):
+    """True when OUTPUT_DIR is a mounted volume rather than the (possibly RAM-backed) work filesystem."""
+    try:
+        return os.stat(OUTPUT_DIR).st_dev != os.stat(work_dir).st_dev
+    except OSError:
+        return False
+
+def patch_options(args):
+    """The options that change the patched output; part of the build cache key."""
+    return {"minimal": bool(args.minimal), "fast": bool(args.fast), "raw_output": bool(args.raw_output)}
+
+def lookup_build_cache(run, input_sha256, args):
+    """Returns (cache_key, entry); entry is None on a miss."""
+    key = build_cache.cache_key(input_sha256, run["key_hash"], patch_options(args))
+    try:
+        backend = get_backend(run["bucket_env"])
+        if backend:
+            entry = build_cache.lookup(backend, key)
+        else:
+            entry = build_cache.lookup_local(OUTPUT_DIR, key)
+    except Exception as e:
+        log(f"⚠️  Build cache lookup failed (ignoring): {e}")
+        entry = None
+    return key, entry
+
+def finish_from_build_cache(run, entry, device, timer):
+    output = entry["output"]
+    print_status("BUILD CACHE", "PASS", f"Output {output['filename']} already built. Skipping build.", Color.GREEN)
+    backend = get_backend(run["bucket_env"])
+    # Raw init_boot builds are not listed in the OTA index.
+    if backend and output["filename"].endswith(".zip"):
+        try:
+            if build_index.lookup(backend, output["filename"]) is None:
+                with _INDEX_LOCK:
+                    build_index.publish(backend, build_index.make_entry(device, output["filename"], output["filename"], output["url"]))
+        except Exception as e:
+            log_error(f"Failed to update central index: {e}")
+    report_stage_metrics(timer, device)
+    report_success_metric(device)
+    sys.exit(0)
+
+def prepare_run(args, devices=()):
+    """
+    Everything a run needs before its first download: bucket checks, key resolution,
+    public key upload and the OTA page scrape. These are independent network and
+    subprocess stages, so they run concurrently; the first failure cancels the rest.
+    """
+    timer = timing.StageTimer()
+    # --bucket / --cache-bucket override the environment, e.g. file:///srv/releases for an offline run.
+    bucket_env = args.bucket or get_bucket_env()
+    cache_bucket_env = args.cache_bucket or os.environ.get('CACHE_BUCKET_NAME')
+    backend = get_backend(bucket_env)
+    targets = list(devices) or [DEVICE_CODENAME]
+    # The page state records full OTA builds (their markers), so only those runs can stop early.
+    poll_page = OTA_PAGE_POLL and backend is not None and not (args.local_file or args.minimal or args.raw_output)
+    # The bucket checks overlap with the poll; only the public key upload waits for it
+    # and is skipped when it finds nothing to do.
+    skip_deps = ["up_to_date"] if poll_page else []
+
+    def page_poll(results):
+        with timer.stage("page_poll"):
+            try:
+                state = build_index.read_page_state(backend)
+            except Exception as e:
+                log(f"⚠️  Could not read the OTA page fingerprint: {e}")
+                state = {}
+            poll = downloader.poll_ota_page(targets, state)
+            if poll:
+                poll["state"] = state
+            return poll
+
+    def up_to_date(results):
+        return rows_up_to_date(results["page_poll"], targets, results["key_resolve"][1])
+
+    def bucket_checks(results):
+        with timer.stage("bucket_checks"):
+            verify_bucket_access(bucket_env)
+
+    def cache_bucket_check(results):
+        with timer.stage("cache_bucket_check"):
+            try:
+                verify_bucket_access(cache_bucket_env)
+                log(f"📦 Cache Bucket detected: {cache_bucket_env}")
+                return cache_bucket_env
+            except:
+                log_error(f"⚠️  Cache Bucket configured but inaccessible: {cache_bucket_env}")
+                return None
+
+    def key_resolve(results):
+        with timer.stage("key_resolve"):
+            key_path = resolve_key_path(args.local_key, bucket_env)
+            with open(key_path, 'r') as kf:
+                key_content = kf.read()
+            return key_path, verifier.calculate_string_sha256(key_content)
+
+    def public_key_upload(results):
+        if results.get("up_to_date"):
+            return
+        with timer.stage("public_key_upload"):
+            extract_and_upload_public_key(bucket_env, results["key_resolve"][0])
+
+    def scrape(results):
+        # Rows the poll already read are reused; only devices it could not find are scraped again.
+        rows = (results.get("page_poll") or {}).get("rows", {})
+        scraped = {device: (row["url"], row["filename"], row["sha256"]) for device, row in rows.items()}
+        missing = [device for device in targets if device not in scraped]
+        if missing:
+            with timer.stage("scrape"):
+                scraped.update(downloader.get_latest_factory_images(missing))
+        return scraped if devices else scraped[DEVICE_CODENAME]
+
+    stages = [
+        pipeline.Stage("bucket_checks", bucket_checks),
+        pipeline.Stage("key_resolve", key_resolve),
+    ]
+    if poll_page:
+        stages += [
+            pipeline.Stage("page_poll", page_poll),
+            pipeline.Stage("up_to_date", up_to_date, deps=["page_poll", "key_resolve"]),
+        ]
     if cache_bucket_env:
+        stages.append(pipeline.Stage("cache_bucket_check", cache_bucket_check))
+    if backend:
+        stages.append(pipeline.Stage("public_key_upload", public_key_upload,
+                                     deps=["key_resolve", "bucket_checks", *skip_deps]))
+    if not args.local_file:
+        stages.append(pipeline.Stage("scrape", scrape, deps=["page_poll"] if poll_page else []))
+    results = pipeline.run_async_stage_graph(stages)
+    key_path, key_hash = results["key_resolve"]
+    report_run_stage_metrics(timer)
+
+    if results.get("up_to_date"):
+        finish_up_to_date(backend, results["page_poll"], targets)
+
+    budget_bytes = int(BUILD_DISK_BUDGET_GB * 1024**3)
+    if not budget_bytes:
+        work_root = BATCH_WORK_DIR if get_batch_devices(args) else "."
+        os.makedirs(work_root, exist_ok=True)
+        budget_bytes = shutil.disk_usage(work_root).free
+    log(f"💽 Disk budget for intermediates: {budget_bytes / 1024**3:.1f} GiB")
+    if args.profile_startup:
+        startup_profile.report()
+
+    return {
+        "bucket_env": bucket_env,
+        "cache_bucket_env": results.get("cache_bucket_check"),
+        "key_path": key_path,
+        "key_hash": key_hash,
+        "scraped": results.get("scrape"),
+        "page_poll": results.get("page_poll"),
+        "timer": timer,
+        "budget": DiskBudget(budget_bytes),
+        "multi_device": len(devices) > 1,
+    }
+
+def finish_up_to_date(backend, poll, devices):
+    """Exits after a poll that found every device already built from its current row."""
+    if poll["page"] != poll["state"].get("page"):
+        # Other parts of the page changed; store its new fingerprint so the next poll can be conditional.
+        recorded = poll["state"]["devices"]
+        rows = {device: {field: recorded[device][field] for field in (*PAGE_ROW_FIELDS, "marker")} for device in devices}
         try:
-            verify_bucket_access(cache_bucket_env)
-            log(f"📦 Cache Bucket detected: {cache_bucket_env}")
-        except:
-            log_error(f"⚠️  Cache Bucket configured but inaccessible: {cache_bucket_env}")
-            cache_bucket_env = None
+            build_index.record_page_rows(backend, poll["page"], rows)
+        except Exception as e:
+            log(f"⚠️  Could not record the OTA page fingerprint: {e}")
+    log("🎉 OTA page unchanged for every device and all builds are up to date. Nothing to do.")
+    for device in devices:
+        report_success_metric(device)
+    sys.exit(0)
+
+def main(argv=None):
+    args = parse_args(argv)
+    devices = get_batch_devices(args)
+
+    if devices:
+        print_header(f"PIXEL AUTO-PATCHER BATCH START ({len(devices)} devices)")
+        run = prepare_run(args, devices)
+        sys.exit(run_batch(devices, args, run))
+
+    print_header("PIXEL AUTO-PATCHER START")
+    run = prepare_run(args)
+    build_device(DEVICE_CODENAME, args, run, run["scraped"])
+
+def build_device(device, args, run, scraped=None, work_dir="."):
+    """
+    Download, patch and publish one device. `scraped` is the (url, filename, sha256)
+    row when the OTA page was already read by a batch run; `work_dir` keeps the
+    intermediate files of concurrent builds apart.
+    """
+    bucket_env = run["bucket_env"]
+    cache_bucket_env = run["cache_bucket_env"]
+    key_path = run["key_path"]
+    key_hash = run["key_hash"]
+    timer = timing.StageTimer(run["timer"].summary())
+    budget = run["budget"]
+    os.makedirs(work_dir, exist_ok=True)
 
     filename = None
     sha256 = None
     used_cached_file = False
+    marker_name = None
+    build_cache_key = None
     
-    key_path = resolve_key_path(args.local_key)
-    
-    with open(key_path, 'r') as kf:
-        key_content = kf.read()
-    key_hash = verifier.calculate_string_sha256(key_content)
-    
-    if bucket_env and storage:
-        extract_and_upload_public_key(bucket_env, key_path)
-
     if args.local_file:
         log(f"🛠️  Local Mode: {args.local_file}")
         if not os.path.exists(args.local_file): 
@@ -353,26 +828,44 @@ def main():
         filename = args.local_file
     else:
         log("🌐 Online Mode...")
-        url, scraped_filename, scraped_sha256 = downloader.get_latest_factory_image_data_headless(DEVICE_CODENAME)
+        if scraped is None:
+            with timer.stage("scrape"):
+                scraped = downloader.get_latest_factory_image_data(device)
+        url, scraped_filename, scraped_sha256 = scraped
         
         if not url:
             log_error("CRITICAL: Could not fetch URL.")
-            report_failure_metric("url_fetch_failed")
+            report_failure_metric("url_fetch_failed", device)
             sys.exit(1)
 
-        filename = scraped_filename
+        filename = os.path.join(work_dir, scraped_filename)
+        # Markers are option-agnostic, so only full OTA builds write or trust them.
+        if scraped_sha256 and not (args.minimal or args.raw_output):
+            marker_name = build_index.marker_blob_name(scraped_filename, scraped_sha256, key_hash)
         
-        if not args.local_file and check_cloud_index(bucket_env, filename):
+        with timer.stage("index_check"):
+            already_built = check_cloud_index(bucket_env, expected_output_name(scraped_filename, args), device, marker_name)
+        if already_built:
+            record_page_row(run, device, marker_name)
             log("🎉 Nothing to do. Exiting.")
-            report_success_metric()
+            report_stage_metrics(timer, device)
+            report_success_metric(device)
             sys.exit(0)
 
+        if scraped_sha256:
+            with timer.stage("build_cache_check"):
+                build_cache_key, cached_build = lookup_build_cache(run, scraped_sha256, args)
+            if cached_build:
+                finish_from_build_cache(run, cached_build, device, timer)
+
         potential_cached_path = os.path.join(OUTPUT_DIR, scraped_filename)
         
         if os.path.exists(potential_cached_path):
             log(f"💾 Found in cache: {potential_cached_path}")
             if scraped_sha256 and not args.skip_hash_check:
-                calc_hash = verifier.verify_zip_sha256(potential_cached_path, scraped_sha256)
+                with timer.stage("hash") as st:
+                    calc_hash = verifier.verify_zip_sha256(potential_cached_path, scraped_sha256)
+                    st["bytes"] = os.path.getsize(potential_cached_path)
                 if calc_hash:
                     log("⚡ CACHE HIT!")
                     filename = potential_cached_path
@@ -386,26 +879,53 @@ def main():
                 used_cached_file = True
 
         if not used_cached_file:
-            cloud_cache_hit = manage_cache_download(cache_bucket_env, filename, scraped_sha256)
+            remote_size = downloader.get_remote_size(url)
+            if remote_size:
+                reserve_or_exit(budget, f"{device}:download", remote_size, device)
+            with timer.stage("cache_download") as st:
+                downloaded_sha256 = manage_cache_download(cache_bucket_env, scraped_filename, filename)
+                st["bytes"] = os.path.getsize(filename) if downloaded_sha256 else 0
+            cloud_cache_hit = downloaded_sha256 is not None
 
-            if not cloud_cache_hit:
-                downloader.download_file(url, filename)
-                if cache_bucket_env:
-                     log(f"📦 Populating Cloud Cache with {filename}...")
-                     upload_gcs_file(cache_bucket_env, filename, filename)
+            cache_tee = None
+            if not downloaded_sha256:
+                cache_tee = open_cache_upload_tee(cache_bucket_env, scraped_filename)
+                try:
+                    with timer.stage("download") as st:
+                        downloaded_sha256 = downloader.download_file(url, filename, sinks=[cache_tee] if cache_tee else None)
+                        st["bytes"] = os.path.getsize(filename)
+                except Exception:
+                    if cache_tee:
+                        cache_tee.abort()
+                    raise
+            budget.unreserve(f"{device}:download")
+            budget.track(filename, consumers={"patch"})
             
             if scraped_sha256:
-                calc_hash = verifier.verify_zip_sha256(filename, scraped_sha256)
+                calc_hash = verifier.verify_sha256_digest(filename, downloaded_sha256, scraped_sha256)
                 if not calc_hash: 
-                    report_failure_metric("shasum_mismatch")
+                    if cache_tee:
+                        cache_tee.abort()
+                    report_failure_metric("shasum_mismatch", device)
                     sys.exit(1)
-                sha256 = calc_hash
+            sha256 = downloaded_sha256
+
+            with timer.stage("cache_upload"):
+                if cache_tee:
+                    populated = cache_tee.commit()
+                else:
+                    populated = not cache_bucket_env or cloud_cache_hit
+                if not populated:
+                    log(f"📦 Populating Cloud Cache with {filename}...")
+                    upload_object(cache_bucket_env, filename, scraped_filename)
             
-            if os.path.exists(OUTPUT_DIR) and not os.path.exists(potential_cached_path):
+            # On a RAM-backed output directory a second name would pin the input in memory until exit.
+            if output_dir_is_persistent(work_dir) and not os.path.exists(potential_cached_path):
                 try:
-                    dest_path = os.path.join(OUTPUT_DIR, os.path.basename(filename))
-                    shutil.copy2(filename, dest_path)
-                except: pass
+                    # Linked or copied by the kernel; the work copy is deleted after patching.
+                    publisher.publish_file(filename, OUTPUT_DIR)
+                except Exception as e:
+                    log(f"⚠️  Could not keep input in {OUTPUT_DIR}: {e}")
 
     abs_filename = os.path.abspath(filename)
     if not sha256:
@@ -413,114 +933,519 @@ def main():
             log("⚠️ Skipping SHA256 calc (User requested skip).")
             sha256 = "TRUSTED_LOCAL_FILE"
         else:
-            sha256 = verifier.calculate_sha256(abs_filename)
+            with timer.stage("hash") as st:
+                sha256 = verifier.calculate_sha256(abs_filename)
+                st["bytes"] = os.path.getsize(abs_filename)
         
-    cached_output = verifier.check_smart_cache(sha256, key_hash)
-    if cached_output:
-        print_status("SMART SKIP", "PASS", f"Output {cached_output} already exists. Skipping build.", Color.GREEN)
-        report_success_metric()
-        sys.exit(0)
+    if build_cache_key is None and sha256 != "TRUSTED_LOCAL_FILE":
+        with timer.stage("build_cache_check"):
+            build_cache_key, cached_build = lookup_build_cache(run, sha256, args)
+        if cached_build:
+            finish_from_build_cache(run, cached_build, device, timer)
+
+    if ZIP_VERIFY != "off":
+        # A SHA256 that matched the published digest already proves every byte of the input.
+        input_mode = "structural" if not args.local_file and sha256 != "TRUSTED_LOCAL_FILE" else ZIP_VERIFY
+        with timer.stage("input_zip_check") as st:
+            intact = verifier.verify_zip_integrity(filename, input_mode)
+            st["bytes"] = os.path.getsize(filename) if input_mode == "full" else 0
+        if not intact:
+            report_failure_metric("input_zip_corrupt", device)
+            sys.exit(1)
 
-    output_filename = f"ksu_patched_{os.path.basename(filename)}"
+    # avbroot writes a patched OTA about as large as the input; raw mode writes it to a
+    # temporary file and also extracts init_boot.img next to it.
+    patch_bytes = os.path.getsize(filename)
+    if args.raw_output:
+        patch_bytes += EXTRACT_ESTIMATE_BYTES
+    reserve_or_exit(budget, f"{device}:patch", patch_bytes, device)
+
+    if args.raw_output:
+        output_image = os.path.join(work_dir, f"ksu_patched_{os.path.splitext(os.path.basename(filename))[0]}_init_boot.img")
+        try:
+            with timer.stage("patch") as st:
+                avb_patcher.patch_init_boot_only(filename, output_image, key_path, work_dir)
+                st["bytes"] = os.path.getsize(filename)
+        except Exception as e:
+            log_error(f"Patching failed: {e}")
+            report_failure_metric("avb_patch_failed", device)
+            sys.exit(1)
+        finally:
+            budget.unreserve(f"{device}:patch")
+        budget.consumed(filename, "patch")
+        run_raw_post_patch(device, run, output_image, work_dir, timer, build_cache_key)
+        report_budget(budget, device)
+        report_stage_metrics(timer, device)
+        return
+
+    # A minimal build only reads the patched OTA, so it stays in the work dir.
+    ota_dir = work_dir if args.minimal else final_output_dir(work_dir, get_backend(run["bucket_env"]))
+    output_filename = os.path.join(ota_dir, f"ksu_patched_{os.path.basename(filename)}")
     
     try:
-        avb_patcher.run_avbroot_patch(filename, output_filename, key_path)
+        with timer.stage("patch") as st:
+            avb_patcher.run_avbroot_patch(filename, output_filename, key_path)
+            st["bytes"] = os.path.getsize(output_filename)
     except Exception as e:
         log_error(f"Patching failed: {e}")
-        report_failure_metric("avb_patch_failed")
+        if os.path.exists(output_filename):
+            os.remove(output_filename)
+        report_failure_metric("avb_patch_failed", device)
         sys.exit(1)
+    finally:
+        budget.unreserve(f"{device}:patch")
+    # Only a downloaded input is tracked; local and cached inputs are left in place.
+    budget.consumed(filename, "patch")
 
-    try:
-        if os.path.exists(filename) and filename != output_filename:
-            log(f"🧹 freeing space: removing input file {filename}")
-            os.remove(filename)
-    except: pass
+    compression_level = 0 if args.fast else PACKAGE_COMPRESSION_LEVEL
+    run_post_patch(device, run, filename, output_filename, work_dir, timer, marker_name, build_cache_key,
+                   minimal=args.minimal, compression_level=compression_level)
+    report_budget(budget, device)
+    report_stage_metrics(timer, device)
 
-    extraction_subdir = os.path.join(OUTPUT_DIR, os.path.splitext(os.path.basename(output_filename))[0])
-    os.makedirs(extraction_subdir, exist_ok=True)
-    
-    avb_patcher.extract_patched_boot_images(output_filename, extraction_subdir)
-
-    avb_patcher.generate_custota_csig(output_filename, key_path)
-    
-    final_output_sha256 = verifier.calculate_sha256(output_filename)
-    print(f"Final Visual Hash: {get_visual_hash(final_output_sha256)}")
-    
-    custota_json_name = f"{DEVICE_CODENAME}.json"
-    csig_path = f"{output_filename}.csig"
-    avb_patcher.generate_custota_json(output_filename, csig_path, DEVICE_CODENAME, ".", custota_json_name)
-    
+def write_build_status(status_json, device, output_filename, output_sha256, csig_path, timer, mode="ota", package=None, disk=None,
+                       payload=None):
     build_info = {
         "build_meta": {
-             "device": DEVICE_CODENAME,
+             "device": device,
              "status": "success",
-             "timestamp": datetime.now(timezone.utc).isoformat()
+             "mode": mode,
+             "timestamp": datetime.now(timezone.utc).isoformat(),
+             "digest_cache": verifier.digest_cache_stats(),
+             "stages": timer.summary()
         },
         "output": {
-            "filename": output_filename,
-            "sha256": final_output_sha256,
-            "csig": csig_path
+            "filename": os.path.basename(output_filename),
+            "sha256": output_sha256,
+            "csig": os.path.basename(csig_path) if csig_path else None
         }
     }
-    
-    with open(OUTPUT_JSON, "w") as f:
-        json.dump(build_info, f, indent=4)
-        
-    print_status("DONE", "SUCCESS", f"Report saved to {OUTPUT_JSON} and {custota_json_name}", Color.GREEN)
+    if package:
+        build_info["build_meta"]["package"] = package
+    if disk:
+        build_info["build_meta"]["disk_budget"] = disk
+    if payload:
+        build_info["build_meta"]["payload"] = payload
+    write_json_file(status_json, build_info, indent=4)
+
+def publish_latest_json(run, device, work_dir, content):
+    """
+    Uploads the pointer to the device's newest image as latest/<device>.json. The
+    bucket-root latest.json is only written by single-device runs, since the devices
+    of a batch would overwrite each other's.
+    """
+    bucket_env = run["bucket_env"]
+    latest_json_path = os.path.join(work_dir, "latest.json")
+    write_json_file(latest_json_path, {**content, "device": device})
+    upload_object(bucket_env, latest_json_path, f"{LATEST_DEVICE_PREFIX}{device}.json", UPLOAD_RETRIES)
+    if not run["multi_device"]:
+        upload_object(bucket_env, latest_json_path, "latest.json", UPLOAD_RETRIES)
+
+def write_json_file(path, data, indent=None):
+    """Replaces `path` instead of rewriting it, so a hard-linked copy in a local bucket stays intact."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=indent)
+    os.replace(tmp_path, path)
+
+def _releasing(budget, stage, paths):
+    """Wraps a stage so that it counts as finished reading `paths` once it returns or fails."""
+    def run_stage(results):
+        try:
+            return stage.func(results)
+        finally:
+            for path in paths:
+                budget.consumed(path, stage.name)
+    return run_stage
+
+def run_post_patch(device, run, filename, output_filename, work_dir, timer, marker_name=None, build_cache_key=None,
+                   minimal=False, compression_level=PACKAGE_COMPRESSION_LEVEL):
+    """
+    Post-patch work as a dependency graph: extraction, csig, hashing and the
+    ZIP upload only read the finished ZIP, so they run side by side.
+    With `minimal` the published package is a ZIP of the changed partitions
+    built from the extracted images; the OTA and its Custota metadata are dropped.
+    """
+    bucket_env = run["bucket_env"]
+    backend = get_backend(bucket_env)
+    key_path = run["key_path"]
+    status_json = os.path.join(work_dir, OUTPUT_JSON)
+    custota_json_name = os.path.join(work_dir, f"{device}.json")
+    csig_path = None if minimal else f"{output_filename}.csig"
+    package_path = output_filename
+    if minimal:
+        package_path = os.path.join(final_output_dir(work_dir, backend),
+                                    f"{os.path.splitext(os.path.basename(output_filename))[0]}_minimal.zip")
+    package_stats = {}
+    budget = run["budget"]
+
+    extraction_subdir = os.path.join(OUTPUT_DIR, os.path.splitext(os.path.basename(output_filename))[0])
+    os.makedirs(extraction_subdir, exist_ok=True)
+
+    # Without a mounted output volume, local copies only matter until they are uploaded;
+    # each intermediate is deleted once the last stage reading it has finished.
+    output_on_volume = output_dir_is_persistent(work_dir)
+    keep_outputs = not backend or output_on_volume
+    check_zip = ZIP_VERIFY != "off"
+    check_payload = PAYLOAD_VERIFY != "off"
+    package_readers = {"sha256", "upload_zip"} | ({"zip_check"} if check_zip else set())
+    ota_readers = {"extract"} | ({"payload_check"} if check_payload else set())
+    if minimal:
+        budget.track(output_filename, consumers=ota_readers)
+    else:
+        budget.track(output_filename, consumers=set() if keep_outputs else ota_readers | {"csig"} | package_readers)
+
+    date_str = datetime.now(timezone.utc).strftime('%Y%m%d')
+    base_prefix = f"builds/{device}/{date_str}"
+    zip_blob_path = f"{base_prefix}/{os.path.basename(package_path)}"
+    extracted_prefix = f"{base_prefix}/{os.path.basename(extraction_subdir)}"
+
+    def extract(results):
+        reserve_or_exit(budget, f"{device}:extract", EXTRACT_ESTIMATE_BYTES, device)
+        try:
+            with timer.stage("extract") as st:
+                avb_patcher.extract_patched_boot_images(output_filename, extraction_subdir)
+                st["bytes"] = timing.path_size(extraction_subdir)
+        finally:
+            budget.unreserve(f"{device}:extract")
+        if not output_on_volume:
+            consumers = set() if keep_outputs else {"upload_extracted"}
+            if minimal:
+                consumers.add("package")
+            budget.track(extraction_subdir, consumers)
+
+    def package(results):
+        reserve_or_exit(budget, f"{device}:package", timing.path_size(extraction_subdir), device)
+        try:
+            with timer.stage("package") as st:
+                package_stats.update(
+                    avb_patcher.package_minimal(package_path, extraction_subdir, device, filename, compression_level)
+                )
+                st["bytes"] = package_stats["input_bytes"]
+        finally:
+            budget.unreserve(f"{device}:package")
+        budget.track(package_path, consumers=set() if keep_outputs else package_readers)
+
+    def zip_check(results):
+        with timer.stage("zip_check") as st:
+            intact = verifier.verify_zip_integrity(package_path, ZIP_VERIFY)
+            st["bytes"] = os.path.getsize(package_path) if ZIP_VERIFY == "full" else 0
+        if not intact:
+            log_error("Patched ZIP failed the integrity check. Aborting.")
+            report_failure_metric("output_zip_corrupt", device)
+            sys.exit(1)
 
-    if bucket_env and storage:
+    def payload_check(results):
+        with timer.stage("payload_check") as st:
+            report = payload_verifier.verify_payload(output_filename, PAYLOAD_VERIFY)
+            st["bytes"] = report.get("payload_bytes", 0)
+        if report["status"] != "ok":
+            log_error("payload.bin of the patched OTA failed verification. Aborting.")
+            report_failure_metric("payload_corrupt", device)
+            sys.exit(1)
+        return report
+
+    def csig(results):
+        with timer.stage("csig") as st:
+            avb_patcher.generate_custota_csig(output_filename, key_path)
+            st["bytes"] = os.path.getsize(output_filename)
+
+    def sha256(results):
+        with timer.stage("output_hash") as st:
+            final_output_sha256 = verifier.calculate_sha256(package_path)
+            st["bytes"] = os.path.getsize(package_path)
+        print(f"Final Visual Hash: {get_visual_hash(final_output_sha256)}")
+        return final_output_sha256
+
+    def custota_json(results):
+        with timer.stage("custota_json"):
+            avb_patcher.generate_custota_json(output_filename, csig_path, device, ".", custota_json_name)
+
+    def write_status(results):
+        write_build_status(status_json, device, package_path, results["sha256"], csig_path, timer, package=package_stats,
+                           payload=results.get("payload_check"))
+        print_status("DONE", "SUCCESS", f"Report saved to {status_json}", Color.GREEN)
+
+    def upload_zip(results):
         log("🚀 Starting Cloud Upload...")
-        date_str = datetime.now(timezone.utc).strftime('%Y%m%d')
-        base_prefix = f"builds/{DEVICE_CODENAME}/{date_str}"
-        zip_blob_path = f"{base_prefix}/{os.path.basename(output_filename)}"
-        
-        if not upload_gcs_file(bucket_env, output_filename, zip_blob_path):
+        with timer.stage("upload_zip") as st:
+            uploaded = upload_object(bucket_env, package_path, zip_blob_path, UPLOAD_RETRIES, results["sha256"])
+            st["bytes"] = os.path.getsize(package_path)
+        if not uploaded:
             log_error("Failed to upload ZIP file. Aborting.")
-            report_failure_metric("zip_upload_failed")
+            report_failure_metric("zip_upload_failed", device)
             sys.exit(1)
-        
-        csig_file = f"{output_filename}.csig"
-        if os.path.exists(csig_file):
-            upload_gcs_file(bucket_env, csig_file, f"{zip_blob_path}.csig")
-            
-        upload_gcs_file(bucket_env, OUTPUT_JSON, f"{base_prefix}/info.json")
 
-        if os.path.exists(extraction_subdir):
-            log(f"☁️  Uploading extracted images from {extraction_subdir}...")
-            extracted_prefix = f"{base_prefix}/{os.path.basename(extraction_subdir)}"
-            client = storage.Client()
-            bucket = client.bucket(bucket_env)
-            
-            for root, dirs, files in os.walk(extraction_subdir):
-                for file in files:
-                    local_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(local_path, extraction_subdir)
-                    blob_path = f"{extracted_prefix}/{rel_path}"
-                    bucket.blob(blob_path).upload_from_filename(local_path)
-                    print(f"   -> Uploaded: {rel_path}")
-            log("✅ Extracted images uploaded.")
-
-        public_img_url = f"https://storage.googleapis.com/{bucket_env}/{base_prefix}/{os.path.basename(extraction_subdir)}/init_boot.img"
+    def upload_extracted(results):
+        uploads = []
+        for root, dirs, files in os.walk(extraction_subdir):
+            for file in files:
+                local_path = os.path.join(root, file)
+                rel_path = os.path.relpath(local_path, extraction_subdir)
+                uploads.append((local_path, f"{extracted_prefix}/{rel_path}"))
+        with timer.stage("upload_extracted") as st:
+            st["bytes"] = sum(os.path.getsize(local_path) for local_path, _ in uploads)
+            return upload_files_parallel(bucket_env, uploads)
+
+    def upload_metadata(results):
+        uploads = [(status_json, f"{base_prefix}/info.json")]
+        if csig_path and os.path.exists(csig_path):
+            uploads.append((csig_path, f"{zip_blob_path}.csig"))
+        with timer.stage("upload_metadata") as st:
+            st["bytes"] = sum(os.path.getsize(local_path) for local_path, _ in uploads)
+            return upload_files_parallel(bucket_env, uploads)
+
+    def publish(results):
+        failed_uploads = results["upload_extracted"] + results["upload_metadata"]
+        if failed_uploads:
+            log_error(f"Failed to upload: {', '.join(failed_uploads)}")
+
+        public_img_url = backend.public_url(f"{extracted_prefix}/init_boot.img")
         latest_json_content = {
             "date": date_str,
-            "id": os.path.basename(output_filename),
+            "id": os.path.basename(package_path),
             "image_url": public_img_url
         }
         
-        with open("latest.json", "w") as f:
-            json.dump(latest_json_content, f)
-            
-        upload_gcs_file(bucket_env, "latest.json", "latest.json")
+        # latest.json points at init_boot.img, so it is published only once the image is up.
+        if f"{extracted_prefix}/init_boot.img" in failed_uploads:
+            log_error("init_boot.img upload failed. Not updating latest.json.")
+        else:
+            publish_latest_json(run, device, work_dir, latest_json_content)
         
         # Report success BEFORE index updates (which are less critical)
-        report_success_metric()
+        report_success_metric(device)
         
         try:
-            update_central_index(bucket_env, output_filename, zip_blob_path, filename)
+            with timer.stage("index_update"):
+                update_central_index(bucket_env, package_path, zip_blob_path, filename, device, work_dir, marker_name)
+            record_page_row(run, device, marker_name)
         except Exception as e:
             log_error(f"Failed to update central index: {e}")
 
-    update_local_index(filename, output_filename)
+        if build_cache_key:
+            try:
+                entry = build_cache.make_entry(
+                    device, package_path, results["sha256"], backend.public_url(zip_blob_path), zip_blob_path
+                )
+                build_cache.store(backend, build_cache_key, entry)
+            except Exception as e:
+                log_error(f"Failed to update build cache: {e}")
+
+    # The payload report goes into info.json, so the status waits for it as well as the upload.
+    status_deps = ["sha256", "payload_check"] if check_payload else ["sha256"]
+    if minimal:
+        stages = [
+            pipeline.Stage("extract", extract),
+            pipeline.Stage("package", package, deps=["extract"]),
+            pipeline.Stage("sha256", sha256, deps=["package"]),
+            pipeline.Stage("status_json", write_status, deps=status_deps),
+        ]
+        metadata_deps = ["status_json"]
+        publish_deps = ["upload_zip", "upload_extracted", "upload_metadata"]
+    else:
+        stages = [
+            pipeline.Stage("extract", extract),
+            pipeline.Stage("csig", csig),
+            pipeline.Stage("sha256", sha256),
+            pipeline.Stage("custota_json", custota_json, deps=["csig"]),
+            pipeline.Stage("status_json", write_status, deps=status_deps),
+        ]
+        metadata_deps = ["csig", "status_json"]
+        publish_deps = ["upload_zip", "upload_extracted", "upload_metadata", "custota_json"]
+    # Nothing is uploaded until the integrity checks have passed.
+    check_deps = []
+    if check_zip:
+        stages.append(pipeline.Stage("zip_check", zip_check, deps=["package"] if minimal else []))
+        check_deps.append("zip_check")
+    if check_payload:
+        stages.append(pipeline.Stage("payload_check", payload_check))
+        check_deps.append("payload_check")
+    if backend:
+        stages += [
+            pipeline.Stage("upload_zip", upload_zip, deps=["sha256", *check_deps]),
+            pipeline.Stage("upload_extracted", upload_extracted, deps=["extract", *check_deps]),
+            pipeline.Stage("upload_metadata", upload_metadata, deps=[*metadata_deps, *check_deps]),
+            pipeline.Stage("publish", publish, deps=publish_deps),
+        ]
+    tracked = (output_filename, extraction_subdir, package_path)
+    stages = [pipeline.Stage(stage.name, _releasing(budget, stage, tracked), stage.deps) for stage in stages]
+    results = pipeline.run_stage_graph(stages, max_workers=POST_PATCH_WORKERS)
+
+    with timer.stage("local_index_update"):
+        # Without kept outputs the package was deleted once uploaded; the bucket index lists it.
+        if keep_outputs:
+            update_local_index(filename, package_path, device)
+        if build_cache_key and not backend and os.path.exists(OUTPUT_DIR):
+            entry = build_cache.make_entry(
+                device, package_path, results["sha256"], f"/builds/{os.path.basename(package_path)}"
+            )
+            build_cache.store_local(OUTPUT_DIR, build_cache_key, entry)
+    # The uploaded info.json was written mid-graph; the local copy gets the complete timings.
+    write_build_status(status_json, device, package_path, results["sha256"], csig_path, timer,
+                       package=package_stats, disk=budget.summary(), payload=results.get("payload_check"))
+    publish_outputs(work_dir, [package_path, csig_path, custota_json_name, status_json], budget)
+
+def publish_outputs(work_dir, paths, budget=None):
+    """
+    Moves the finished artifacts into OUTPUT_DIR (rename, link or copy_file_range; see
+    publisher). On a mounted output volume they no longer count against `budget`.
+    """
+    if not os.path.isdir(OUTPUT_DIR):
+        return
+    if os.path.abspath(work_dir) != os.path.abspath("."):
+        # Batch builds share OUTPUT_DIR; their per-device build_status.json stays in the work dir.
+        paths = [path for path in paths if path and os.path.basename(path) != OUTPUT_JSON]
+    try:
+        publisher.publish_files(paths, OUTPUT_DIR, move=True)
+    except Exception as e:
+        log_error(f"Failed to publish artifacts to {OUTPUT_DIR}: {e}")
+        return
+    if budget and output_dir_is_persistent(work_dir):
+        for path in paths:
+            budget.forget(path)
+
+def run_raw_post_patch(device, run, output_image, work_dir, timer, build_cache_key=None):
+    """
+    --raw-output publishing: only the patched init_boot.img and its metadata are
+    uploaded, and latest.json is pointed at it. The OTA index is left alone since
+    it lists flashable ZIPs.
+    """
+    bucket_env = run["bucket_env"]
+    backend = get_backend(bucket_env)
+    status_json = os.path.join(work_dir, OUTPUT_JSON)
+    date_str = datetime.now(timezone.utc).strftime('%Y%m%d')
+    base_prefix = f"builds/{device}/{date_str}"
+    image_prefix = f"{base_prefix}/{os.path.splitext(os.path.basename(output_image))[0]}"
+    image_blob_path = f"{image_prefix}/init_boot.img"
+    public_img_url = backend.public_url(image_blob_path) if backend else None
+
+    def sha256(results):
+        with timer.stage("output_hash") as st:
+            image_sha256 = verifier.calculate_sha256(output_image)
+            st["bytes"] = os.path.getsize(output_image)
+        print(f"Final Visual Hash: {get_visual_hash(image_sha256)}")
+        return image_sha256
+
+    def write_status(results):
+        write_build_status(status_json, device, output_image, results["sha256"], None, timer, mode="raw")
+        print_status("DONE", "SUCCESS", f"Report saved to {status_json}", Color.GREEN)
+
+    def upload_image(results):
+        with timer.stage("upload_image") as st:
+            uploaded = upload_object(bucket_env, output_image, image_blob_path, UPLOAD_RETRIES, results["sha256"])
+            st["bytes"] = os.path.getsize(output_image)
+        if not uploaded:
+            log_error("Failed to upload init_boot.img. Aborting.")
+            report_failure_metric("image_upload_failed", device)
+            sys.exit(1)
+
+    def upload_metadata(results):
+        with timer.stage("upload_metadata"):
+            return upload_files_parallel(bucket_env, [(status_json, f"{image_prefix}/info.json")])
+
+    def publish(results):
+        if results["upload_metadata"]:
+            log_error(f"Failed to upload: {', '.join(results['upload_metadata'])}")
+
+        publish_latest_json(run, device, work_dir,
+                            {"date": date_str, "id": os.path.basename(output_image), "image_url": public_img_url})
+        report_success_metric(device)
+
+        if build_cache_key:
+            try:
+                entry = build_cache.make_entry(device, output_image, results["sha256"], public_img_url, image_blob_path)
+                build_cache.store(backend, build_cache_key, entry)
+            except Exception as e:
+                log_error(f"Failed to update build cache: {e}")
+
+    stages = [
+        pipeline.Stage("sha256", sha256),
+        pipeline.Stage("status_json", write_status, deps=["sha256"]),
+    ]
+    if backend:
+        stages += [
+            pipeline.Stage("upload_image", upload_image, deps=["sha256"]),
+            pipeline.Stage("upload_metadata", upload_metadata, deps=["status_json"]),
+            pipeline.Stage("publish", publish, deps=["upload_image", "upload_metadata"]),
+        ]
+    results = pipeline.run_stage_graph(stages, max_workers=POST_PATCH_WORKERS)
+
+    if build_cache_key and not backend and os.path.exists(OUTPUT_DIR):
+        entry = build_cache.make_entry(device, output_image, results["sha256"], f"/builds/{os.path.basename(output_image)}")
+        build_cache.store_local(OUTPUT_DIR, build_cache_key, entry)
+    write_build_status(status_json, device, output_image, results["sha256"], None, timer, mode="raw",
+                       disk=run["budget"].summary())
+    publish_outputs(work_dir, [output_image, status_json], run["budget"])
+
+def get_batch_devices(args):
+    """Codenames from --devices or _DEVICE_CODENAMES; an empty list means single-device mode."""
+    raw = args.devices or os.environ.get('_DEVICE_CODENAMES', '')
+    devices = list(dict.fromkeys(d.strip() for d in raw.split(',') if d.strip()))
+    if devices and args.local_file:
+        log_error("--local-file cannot be combined with a batch device list.")
+        sys.exit(1)
+    return devices
+
+def _available_memory_bytes():
+    try:
+        with open("/sys/fs/cgroup/memory.max", "r") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            return int(limit)
+    except Exception:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+def batch_worker_count(device_count, work_root):
+    """Sizes the build pool to the CPU, memory and disk available to the container."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    os.makedirs(work_root, exist_ok=True)
+    by_cpu = cpus // BATCH_CPUS_PER_BUILD
+    by_memory = int(_available_memory_bytes() // (BATCH_BUILD_MEMORY_GB * 1024**3))
+    by_disk = int(shutil.disk_usage(work_root).free // (BATCH_BUILD_DISK_GB * 1024**3))
+    workers = max(1, min(device_count, by_cpu, by_memory, by_disk))
+    log(f"🧮 Batch pool: {workers} worker(s) (cpu allows {by_cpu}, memory {by_memory}, disk {by_disk})")
+    return workers
+
+def _run_device_build(device, args, run, scraped, work_dir):
+    try:
+        build_device(device, args, run, scraped, work_dir)
+        return True
+    except SystemExit as e:
+        # build_device reports its own failure metric before exiting.
+        return e.code in (0, None)
+    except Exception as e:
+        import traceback
+        log_error(f"❌ [{device}] CRITICAL UNSUPPORTED EXCEPTION: {e}")
+        traceback.print_exc()
+        report_failure_metric("uncaught_exception", device)
+        return False
+    finally:
+        run["budget"].unreserve_prefix(f"{device}:")
+
+def run_batch(devices, args, run):
+    """Builds every device on a bounded worker pool from the single scrape done in prepare_run."""
+    log(f"🌐 Batch mode: {', '.join(devices)}")
+    scraped = run["scraped"]
+
+    results = {}
+    workers = batch_worker_count(len(devices), BATCH_WORK_DIR)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="build") as pool:
+        futures = {
+            pool.submit(_run_device_build, device, args, run, scraped[device], os.path.join(BATCH_WORK_DIR, device)): device
+            for device in devices
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    print_header("BATCH SUMMARY")
+    for device in devices:
+        if results[device]:
+            print_status(device, "SUCCESS", "build finished or already up to date", Color.GREEN)
+        else:
+            print_status(device, "FAIL", "see log above", Color.RED)
+    return 0 if all(results.values()) else 1
 
 if __name__ == "__main__":
     try:
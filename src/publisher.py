@@ -0,0 +1,84 @@
+import os
+import errno
+import fcntl
+import shutil
+from ui_utils import log
+
+# ioctl(FICLONE) from linux/fs.h: share the source extents (btrfs, XFS, overlayfs on top of them).
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 1024 * 1024 * 1024
+
+def _reflink(src, dst):
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+def _copy_file_range(src, dst):
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        remaining = os.fstat(s.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(s.fileno(), d.fileno(), min(remaining, COPY_CHUNK_SIZE))
+            if copied == 0:
+                # A short copy must not be published; _place falls back to a plain copy.
+                raise OSError(errno.EIO, f"copy_file_range stopped with {remaining} bytes left", src)
+            remaining -= copied
+
+def _place(src, tmp_path, move):
+    """Materialises src at tmp_path as cheaply as possible; returns the method used."""
+    if move:
+        try:
+            os.replace(src, tmp_path)
+            return "rename"
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    try:
+        os.link(src, tmp_path)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        _reflink(src, tmp_path)
+        return "reflink"
+    except OSError:
+        pass
+    try:
+        _copy_file_range(src, tmp_path)
+        return "copy_file_range"
+    except (OSError, AttributeError):
+        # Older kernels refuse copy_file_range across filesystems; shutil falls back to sendfile.
+        shutil.copyfile(src, tmp_path)
+        return "copy"
+
+def publish_file(src, dest_dir, move=False, name=None):
+    """
+    Puts src into dest_dir without duplicating its data where the filesystem allows it:
+    rename (move=True), hard link or reflink on the same filesystem, copy_file_range
+    across filesystems. The destination appears atomically. Returns the destination path.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    dest = os.path.join(dest_dir, name or os.path.basename(src))
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return dest
+
+    tmp_path = f"{dest}.{os.getpid()}.publishing"
+    expected_size = os.path.getsize(src)
+    try:
+        method = _place(src, tmp_path, move)
+        if method in ("reflink", "copy_file_range", "copy"):
+            shutil.copymode(src, tmp_path)
+        placed_size = os.path.getsize(tmp_path)
+        if placed_size != expected_size:
+            raise OSError(errno.EIO, f"{method} produced {placed_size} of {expected_size} bytes", tmp_path)
+        os.replace(tmp_path, dest)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if move and method != "rename":
+        os.remove(src)
+    log(f"📤 Published {os.path.basename(dest)} ({method})")
+    return dest
+
+def publish_files(paths, dest_dir, move=False):
+    """Publishes every existing path; returns the destination paths."""
+    return [publish_file(path, dest_dir, move) for path in paths if path and os.path.exists(path)]
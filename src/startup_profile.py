@@ -0,0 +1,112 @@
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from ui_utils import print_header, log
+
+# Set by install(); None means profiling is off and span() is a no-op.
+_profiler = None
+
+class _TimedLoader:
+    """Loader proxy that times exec_module, i.e. the module's own top-level code."""
+
+    def __init__(self, loader, name, profiler):
+        self._loader = loader
+        self._name = name
+        self._profiler = profiler
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self._profiler.timing(self._name):
+            self._loader.exec_module(module)
+
+class StartupProfiler:
+    """
+    Records import time per module (inclusive and self) through a meta path hook,
+    plus named initialization spans such as creating the storage client.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.imports = {}
+        self.spans = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def find_spec(self, name, path=None, target=None):
+        if getattr(self.local, "resolving", False):
+            return None
+        self.local.resolving = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(name, path, target)
+                if spec is not None:
+                    if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                        spec.loader = _TimedLoader(spec.loader, name, self)
+                    return spec
+            return None
+        finally:
+            self.local.resolving = False
+
+    @contextmanager
+    def timing(self, name):
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            inclusive = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += inclusive
+            with self.lock:
+                self.imports[name] = (inclusive, inclusive - children, len(stack))
+
+    def add_span(self, name, seconds):
+        with self.lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def report(self, limit=25):
+        elapsed = time.perf_counter() - self.started
+        with self.lock:
+            imports = dict(self.imports)
+            spans = dict(self.spans)
+        print_header("STARTUP PROFILE")
+        top_level = sum(inclusive for inclusive, _, depth in imports.values() if depth == 0)
+        log(f"Startup so far: {elapsed:.3f}s, of which imports {top_level:.3f}s ({len(imports)} modules)")
+        ranked = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        for name, (inclusive, own, depth) in ranked:
+            log(f"  import {name:<40} {inclusive * 1000:8.1f} ms  (self {own * 1000:.1f} ms)")
+        for name, seconds in sorted(spans.items(), key=lambda item: item[1], reverse=True):
+            log(f"  init   {name:<40} {seconds * 1000:8.1f} ms")
+
+def install():
+    """Starts profiling imports from here on; call before the heavy imports."""
+    global _profiler
+    if _profiler is None:
+        _profiler = StartupProfiler()
+        sys.meta_path.insert(0, _profiler)
+    return _profiler
+
+@contextmanager
+def span(name):
+    if _profiler is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _profiler.add_span(name, time.perf_counter() - start)
+
+def report():
+    if _profiler is not None:
+        _profiler.report()
@@ -0,0 +1,461 @@
+import os
+import json
+import time
+import uuid
+import base64
+import shutil
+import threading
+import importlib.util
+from contextlib import contextmanager
+from ui_utils import log
+import startup_profile
+import publisher
+
+# Object storage used for releases, the build index and the download cache. A bucket is
+# given as gs://name (or a bare bucket name) for GCS, or as file:///dir (or a path) for a
+# local directory that behaves like a bucket: same object names, metadata, generations
+# and conditional writes, but objects are published with renames and hard links.
+GCS_POOL_SIZE = int(os.environ.get('GCS_POOL_SIZE', 32))
+LOCAL_META_DIR = ".meta"
+LOCAL_UPLOAD_DIR = ".uploads"
+LOCAL_LOCK_FILE = ".lock"
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# Prefix of the public URLs of local-bucket objects, e.g. where a web server exposes the directory.
+LOCAL_BUCKET_URL = os.environ.get('LOCAL_BUCKET_URL')
+
+class StorageError(Exception):
+    pass
+
+class NotFound(StorageError):
+    pass
+
+class PreconditionFailed(StorageError):
+    """A conditional write or read found a different object generation."""
+
+def object_info(name, size, generation, metadata=None, crc32c=None):
+    """What stat() and writes return; generation 0 never exists, crc32c is an int or None."""
+    return {"name": name, "size": size, "generation": generation, "metadata": metadata or {}, "crc32c": crc32c}
+
+class StorageBackend:
+    """
+    put_bytes/put_file/compose write objects, get_bytes/get_file/read_into read them,
+    stat/exists/list/delete manage them and open_writer streams one in. Writes and
+    get_bytes accept if_generation_match (0 = the object must not exist) and raise
+    PreconditionFailed on a mismatch; reads of a missing object raise NotFound.
+    """
+    uri = None
+    # Whether large files should be uploaded as parallel parts joined with compose().
+    composite_uploads = False
+
+    def public_url(self, name):
+        raise NotImplementedError
+
+    def stat(self, name):
+        """object_info() of the object, or None when it does not exist."""
+        raise NotImplementedError
+
+    def exists(self, name):
+        return self.stat(name) is not None
+
+    def list(self, prefix="", max_results=None):
+        raise NotImplementedError
+
+    def get_bytes(self, name, if_generation_match=None):
+        raise NotImplementedError
+
+    def get_file(self, name, destination):
+        raise NotImplementedError
+
+    def read_into(self, name, fileobj):
+        raise NotImplementedError
+
+    def put_bytes(self, name, data, content_type="application/octet-stream", metadata=None, if_generation_match=None):
+        raise NotImplementedError
+
+    def put_file(self, name, path, metadata=None):
+        raise NotImplementedError
+
+    def compose(self, name, sources, metadata=None):
+        """Concatenates the `sources` objects into `name`; returns its object_info()."""
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+    def open_writer(self, name, chunk_size=COPY_CHUNK_SIZE):
+        """A writer with write(), close() (publishes the object) and abort() (discards it)."""
+        raise NotImplementedError
+
+    def __repr__(self):
+        return self.uri
+
+# --- GCS -----------------------------------------------------------------------------
+
+_gcs_client = None
+_gcs_client_lock = threading.Lock()
+_gcs_available = None
+
+def gcs_available():
+    """Whether google-cloud-storage is installed, checked without importing it."""
+    global _gcs_available
+    if _gcs_available is None:
+        try:
+            _gcs_available = importlib.util.find_spec("google.cloud.storage") is not None
+        except ModuleNotFoundError:
+            _gcs_available = False
+    return _gcs_available
+
+def gcs_client():
+    """One storage client (auth + connection pool) shared by every GCS call of the run."""
+    global _gcs_client
+    with _gcs_client_lock:
+        if _gcs_client is None:
+            with startup_profile.span("storage_client"):
+                # Imported here so that runs without a GCS bucket never load the GCS stack.
+                import requests
+                from google.cloud import storage
+                client = storage.Client()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=GCS_POOL_SIZE, pool_maxsize=GCS_POOL_SIZE)
+                client._http.mount("https://", adapter)
+            _gcs_client = client
+        return _gcs_client
+
+@contextmanager
+def _gcs_errors():
+    from google.api_core import exceptions
+    try:
+        yield
+    except exceptions.NotFound as e:
+        raise NotFound(str(e)) from e
+    except exceptions.PreconditionFailed as e:
+        raise PreconditionFailed(str(e)) from e
+
+def _blob_info(blob):
+    crc32c = int.from_bytes(base64.b64decode(blob.crc32c), "big") if blob.crc32c else None
+    return object_info(blob.name, blob.size, blob.generation, blob.metadata, crc32c)
+
+class _FileSlice:
+    """Read-only view of [offset, offset + length) of a file, positioned from 0 for the uploader."""
+
+    def __init__(self, path, offset, length):
+        self.file = open(path, 'rb')
+        self.offset = offset
+        self.length = length
+        self.position = 0
+        self.file.seek(offset)
+
+    def read(self, size=-1):
+        remaining = self.length - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self.file.read(size)
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self.position
+        elif whence == os.SEEK_END:
+            position += self.length
+        self.position = max(0, min(position, self.length))
+        self.file.seek(self.offset + self.position)
+        return self.position
+
+    def close(self):
+        self.file.close()
+
+class _GcsWriter:
+    """Resumable upload; the object only becomes visible on close()."""
+
+    def __init__(self, blob, chunk_size):
+        self.writer = blob.open("wb", chunk_size=chunk_size, ignore_flush=True)
+
+    def write(self, data):
+        self.writer.write(data)
+
+    def close(self):
+        with _gcs_errors():
+            self.writer.close()
+
+    def abort(self):
+        # BlobWriter does not expose its resumable session, so this leans on a private
+        # attribute. If a library upgrade drops it, say so instead of silently leaving
+        # the session to expire on its own (GCS keeps it for about a week).
+        if not hasattr(self.writer, "_upload_and_transport"):
+            log("⚠️  Cannot cancel the GCS upload session: BlobWriter no longer exposes it.")
+            return
+        upload, transport = self.writer._upload_and_transport or (None, None)
+        session_url = getattr(upload, "resumable_url", None)
+        if not session_url:
+            return  # Nothing was sent yet, so there is no session to cancel.
+        try:
+            transport.delete(session_url)
+        except Exception as e:
+            log(f"⚠️  Could not cancel the GCS upload session: {e}")
+
+class GcsBackend(StorageBackend):
+    composite_uploads = True
+
+    def __init__(self, bucket_name):
+        self.bucket_name = bucket_name
+        self.uri = f"gs://{bucket_name}"
+        self.bucket = gcs_client().bucket(bucket_name)
+
+    def public_url(self, name):
+        return f"https://storage.googleapis.com/{self.bucket_name}/{name}"
+
+    def stat(self, name):
+        blob = self.bucket.get_blob(name)
+        return _blob_info(blob) if blob else None
+
+    def exists(self, name):
+        return self.bucket.blob(name).exists()
+
+    def list(self, prefix="", max_results=None):
+        blobs = gcs_client().list_blobs(self.bucket_name, prefix=prefix or None, max_results=max_results)
+        return [blob.name for blob in blobs]
+
+    def get_bytes(self, name, if_generation_match=None):
+        with _gcs_errors():
+            return self.bucket.blob(name).download_as_bytes(if_generation_match=if_generation_match)
+
+    def get_file(self, name, destination):
+        with _gcs_errors():
+            self.bucket.blob(name).download_to_filename(destination)
+
+    def read_into(self, name, fileobj):
+        with _gcs_errors():
+            self.bucket.blob(name).download_to_file(fileobj)
+
+    def put_bytes(self, name, data, content_type="application/octet-stream", metadata=None, if_generation_match=None):
+        blob = self.bucket.blob(name)
+        if metadata:
+            blob.metadata = metadata
+        with _gcs_errors():
+            blob.upload_from_string(data, content_type=content_type, if_generation_match=if_generation_match)
+        return _blob_info(blob)
+
+    def put_file(self, name, path, metadata=None):
+        blob = self.bucket.blob(name)
+        if metadata:
+            blob.metadata = metadata
+        with _gcs_errors():
+            blob.upload_from_filename(path)
+        return _blob_info(blob)
+
+    def put_range(self, name, path, offset, length):
+        """Uploads one byte range of a file, verified against its CRC32C by the client."""
+        part = _FileSlice(path, offset, length)
+        try:
+            blob = self.bucket.blob(name)
+            blob.upload_from_file(part, size=length, checksum="crc32c")
+            return _blob_info(blob)
+        finally:
+            part.close()
+
+    def compose(self, name, sources, metadata=None):
+        destination = self.bucket.blob(name)
+        if metadata:
+            destination.metadata = metadata
+        with _gcs_errors():
+            destination.compose([self.bucket.blob(source) for source in sources])
+            destination.reload()
+        return _blob_info(destination)
+
+    def delete(self, name):
+        with _gcs_errors():
+            self.bucket.blob(name).delete()
+
+    def open_writer(self, name, chunk_size=COPY_CHUNK_SIZE):
+        return _GcsWriter(self.bucket.blob(name), chunk_size)
+
+# --- Local directory -------------------------------------------------------------------
+
+class _LocalWriter:
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+        self.tmp_path = backend._upload_path(name)
+        self.file = open(self.tmp_path, "wb")
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        self.backend._commit(self.tmp_path, self.name)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+class LocalBackend(StorageBackend):
+    """
+    A directory laid out like a bucket. Metadata and generations live in .meta/;
+    writes are staged in .uploads/ and published with os.replace under a file lock,
+    so conditional writes hold across processes sharing the directory.
+    """
+
+    def __init__(self, root, base_url=None):
+        self.root = os.path.abspath(root)
+        self.uri = f"file://{self.root}"
+        self.base_url = (base_url or LOCAL_BUCKET_URL or self.uri).rstrip("/")
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(self.root, LOCAL_UPLOAD_DIR), exist_ok=True)
+
+    def _path(self, name):
+        path = os.path.normpath(os.path.join(self.root, name))
+        relative = os.path.relpath(path, self.root)
+        if relative.startswith("..") or relative.split(os.sep)[0] in (LOCAL_META_DIR, LOCAL_UPLOAD_DIR, LOCAL_LOCK_FILE):
+            raise ValueError(f"Invalid object name: {name}")
+        return path
+
+    def _meta_path(self, name):
+        return os.path.join(self.root, LOCAL_META_DIR, f"{name}.json")
+
+    def _upload_path(self, name):
+        return os.path.join(self.root, LOCAL_UPLOAD_DIR, f"{os.path.basename(name)}.{uuid.uuid4().hex[:12]}")
+
+    @contextmanager
+    def _locked(self):
+        import fcntl
+
+        with self._lock, open(os.path.join(self.root, LOCAL_LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _commit(self, tmp_path, name, content_type=None, metadata=None, if_generation_match=None):
+        path = self._path(name)
+        with self._locked():
+            current = self.stat(name)
+            generation = current["generation"] if current else 0
+            if if_generation_match is not None and generation != if_generation_match:
+                os.remove(tmp_path)
+                raise PreconditionFailed(f"{name}: generation {generation}, expected {if_generation_match}")
+            generation = max(time.time_ns(), generation + 1)
+            meta = {"generation": generation, "content_type": content_type, "metadata": metadata or {}}
+            meta_path = self._meta_path(name)
+            os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+            with open(f"{meta_path}.tmp", "w") as f:
+                json.dump(meta, f)
+            os.replace(f"{meta_path}.tmp", meta_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return object_info(name, os.path.getsize(path), generation, metadata)
+
+    def public_url(self, name):
+        return f"{self.base_url}/{name}"
+
+    def stat(self, name):
+        path = self._path(name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        try:
+            with open(self._meta_path(name), "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            # Placed by hand: the modification time stands in for the generation.
+            meta = {"generation": st.st_mtime_ns}
+        return object_info(name, st.st_size, meta["generation"], meta.get("metadata"))
+
+    def list(self, prefix="", max_results=None):
+        names = []
+        for root, dirs, files in os.walk(self.root):
+            if root == self.root:
+                dirs[:] = [d for d in dirs if d not in (LOCAL_META_DIR, LOCAL_UPLOAD_DIR)]
+            for file in files:
+                name = os.path.relpath(os.path.join(root, file), self.root).replace(os.sep, "/")
+                if name != LOCAL_LOCK_FILE and name.startswith(prefix):
+                    names.append(name)
+        names.sort()
+        return names[:max_results] if max_results else names
+
+    def get_bytes(self, name, if_generation_match=None):
+        with self._locked():
+            current = self.stat(name)
+            if current is None:
+                raise NotFound(name)
+            if if_generation_match is not None and current["generation"] != if_generation_match:
+                raise PreconditionFailed(f"{name}: generation {current['generation']}, expected {if_generation_match}")
+            with open(self._path(name), "rb") as f:
+                return f.read()
+
+    def get_file(self, name, destination):
+        if not self.exists(name):
+            raise NotFound(name)
+        # Linked rather than copied when the destination is on the same filesystem.
+        publisher.publish_file(self._path(name), os.path.dirname(os.path.abspath(destination)),
+                               name=os.path.basename(destination))
+
+    def read_into(self, name, fileobj):
+        try:
+            with open(self._path(name), "rb") as f:
+                shutil.copyfileobj(f, fileobj, COPY_CHUNK_SIZE)
+        except FileNotFoundError:
+            raise NotFound(name)
+
+    def put_bytes(self, name, data, content_type="application/octet-stream", metadata=None, if_generation_match=None):
+        tmp_path = self._upload_path(name)
+        with open(tmp_path, "wb") as f:
+            f.write(data.encode() if isinstance(data, str) else data)
+        return self._commit(tmp_path, name, content_type, metadata, if_generation_match)
+
+    def put_file(self, name, path, metadata=None):
+        tmp_path = self._upload_path(name)
+        publisher.publish_file(path, os.path.dirname(tmp_path), name=os.path.basename(tmp_path))
+        return self._commit(tmp_path, name, metadata=metadata)
+
+    def compose(self, name, sources, metadata=None):
+        tmp_path = self._upload_path(name)
+        with open(tmp_path, "wb") as out:
+            for source in sources:
+                self.read_into(source, out)
+        return self._commit(tmp_path, name, metadata=metadata)
+
+    def delete(self, name):
+        with self._locked():
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                raise NotFound(name)
+            try:
+                os.remove(self._meta_path(name))
+            except FileNotFoundError:
+                pass
+
+    def open_writer(self, name, chunk_size=COPY_CHUNK_SIZE):
+        return _LocalWriter(self, name)
+
+# --- Selection -------------------------------------------------------------------------
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def open_backend(spec):
+    """gs://name or a bare bucket name -> GCS; file:///dir or a path -> local directory."""
+    if spec.startswith("file://"):
+        return LocalBackend(spec[len("file://"):])
+    if not spec.startswith("gs://") and (os.sep in spec or spec.startswith(".")):
+        return LocalBackend(spec)
+    if not gcs_available():
+        log(f"⚠️  google-cloud-storage is not installed; ignoring bucket {spec}.")
+        return None
+    return GcsBackend(spec[len("gs://"):].strip("/") if spec.startswith("gs://") else spec)
+
+def get_backend(spec):
+    """The shared backend for a bucket spec, or None when no bucket is configured (or usable)."""
+    if not spec:
+        return None
+    with _backends_lock:
+        if spec not in _backends:
+            _backends[spec] = open_backend(spec)
+        return _backends[spec]
@@ -0,0 +1,64 @@
+import os
+import time
+import resource
+import threading
+from contextlib import contextmanager
+from ui_utils import log
+
+def _peak_rss_mb(who):
+    # ru_maxrss is reported in KiB on Linux.
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+def path_size(path):
+    """Size of a file, or the total size of a directory tree (0 if missing)."""
+    if not path or not os.path.exists(path):
+        return 0
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+class StageTimer:
+    """
+    Records wall time, bytes processed, throughput and peak RSS per pipeline stage.
+    Peak RSS is the process high-water mark when the stage ended (ru_maxrss);
+    child peak covers subprocesses such as avbroot.
+    """
+
+    def __init__(self, inherited=None):
+        self.stages = dict(inherited or {})
+        # Stages copied from another timer (a batch run's shared prepare stages) until re-recorded here.
+        self.inherited = set(self.stages)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Usage: `with timer.stage("download") as st: ...; st["bytes"] = size`."""
+        record = {"bytes": 0}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.record(name, time.perf_counter() - start, record.get("bytes", 0))
+
+    def record(self, name, seconds, bytes_processed=0):
+        entry = {
+            "seconds": round(seconds, 3),
+            "bytes": int(bytes_processed or 0),
+            "mb_per_s": round(bytes_processed / 1024**2 / seconds, 1) if bytes_processed and seconds > 0 else None,
+            "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+            "peak_child_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        }
+        with self.lock:
+            self.stages[name] = entry
+            self.inherited.discard(name)
+        throughput = f", {entry['mb_per_s']} MB/s" if entry["mb_per_s"] else ""
+        log(f"⏱️  {name}: {entry['seconds']:.2f}s{throughput}")
+
+    def summary(self, include_inherited=True):
+        with self.lock:
+            return {name: dict(entry) for name, entry in self.stages.items()
+                    if include_inherited or name not in self.inherited}
@@ -1,22 +1,166 @@
 import os
 import hashlib
 import json
+import mmap
+import struct
+import threading
 import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from ui_utils import print_status, Color, log, log_error, get_visual_hash
 
-def calculate_sha256(filepath):
+DIGEST_CACHE_FILE = os.path.join(os.environ.get('OUTPUT_DIR', "/app/output"), "digest_cache.json")
+DIGEST_CACHE_MAX_ENTRIES = 256
+ZIP_VERIFY_WORKERS = int(os.environ.get('ZIP_VERIFY_WORKERS', os.cpu_count() or 4))
+ZIP_VERIFY_CHUNK_SIZE = 64 * 1024 * 1024
+# signature, version, flags, method, time, date, crc32, compressed size, size, name length, extra length
+_ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+_digest_cache = None
+_digest_cache_lock = threading.Lock()
+_digest_cache_stats = {"hits": 0, "misses": 0}
+
+def _digest_key(filepath):
+    st = os.stat(filepath)
+    return f"{os.path.abspath(filepath)}|{st.st_size}|{st.st_mtime_ns}|{st.st_ino}"
+
+def _load_digest_cache():
+    global _digest_cache
+    if _digest_cache is None:
+        _digest_cache = {}
+        if os.path.exists(DIGEST_CACHE_FILE):
+            try:
+                with open(DIGEST_CACHE_FILE, 'r') as f:
+                    _digest_cache = json.load(f)
+            except Exception:
+                _digest_cache = {}
+    return _digest_cache
+
+def _save_digest_cache():
+    cache_dir = os.path.dirname(DIGEST_CACHE_FILE)
+    if not os.path.isdir(cache_dir):
+        return
+    # Drop entries for files that are gone, then the oldest ones beyond the size cap.
+    for key in [k for k in _digest_cache if not os.path.exists(k.split("|", 1)[0])]:
+        del _digest_cache[key]
+    while len(_digest_cache) > DIGEST_CACHE_MAX_ENTRIES:
+        del _digest_cache[next(iter(_digest_cache))]
+    try:
+        tmp_path = f"{DIGEST_CACHE_FILE}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(_digest_cache, f, indent=4)
+        os.replace(tmp_path, DIGEST_CACHE_FILE)
+    except Exception as e:
+        log(f"⚠️  Could not persist digest cache: {e}")
+
+def record_file_sha256(filepath, digest):
+    """Stores a digest computed elsewhere (e.g. while downloading) for the file as it is now."""
+    with _digest_cache_lock:
+        _load_digest_cache()[_digest_key(filepath)] = digest
+        _save_digest_cache()
+
+def digest_cache_stats():
+    with _digest_cache_lock:
+        return dict(_digest_cache_stats)
+
+def _hash_file(filepath):
     sha256_hash = hashlib.sha256()
     with open(filepath, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
+        if os.fstat(f.fileno()).st_size == 0:
+            return sha256_hash.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            # A single update over the whole mapping; hashlib drops the GIL while hashing.
+            sha256_hash.update(mapped)
     return sha256_hash.hexdigest()
 
+def calculate_sha256(filepath):
+    """SHA256 of a file, served from the (path, size, mtime_ns, inode) digest cache when unchanged."""
+    key = _digest_key(filepath)
+    with _digest_cache_lock:
+        digest = _load_digest_cache().get(key)
+        if digest:
+            _digest_cache_stats["hits"] += 1
+            return digest
+        _digest_cache_stats["misses"] += 1
+
+    digest = _hash_file(filepath)
+    with _digest_cache_lock:
+        _load_digest_cache()[key] = digest
+        _save_digest_cache()
+    return digest
+
+CRC32_POLY = 0xEDB88320   # zlib / ZIP
+CRC32C_POLY = 0x82F63B78  # Castagnoli, used by GCS
+
+def _gf2_matrix_times(matrix, vector):
+    total = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return total
+
+def _gf2_matrix_square(matrix):
+    return [_gf2_matrix_times(matrix, matrix[n]) for n in range(32)]
+
+def crc_combine(crc1, crc2, len2, polynomial=CRC32C_POLY):
+    """
+    CRC of A+B from crc(A), crc(B) and len(B) (zlib's crc32_combine, for any reflected
+    32-bit polynomial). Lets independently checksummed parts be checked as one object.
+    """
+    if len2 <= 0:
+        return crc1
+    odd = [polynomial] + [1 << n for n in range(31)]
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+    while True:
+        even = _gf2_matrix_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+        odd = _gf2_matrix_square(even)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+    return crc1 ^ crc2
+
 def calculate_string_sha256(string_data):
     return hashlib.sha256(string_data.encode('utf-8')).hexdigest()
 
+class HashingWriter:
+    """File-like wrapper that hashes everything written through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
 def verify_zip_sha256(filepath, expected_sha256):
+    return verify_sha256_digest(filepath, calculate_sha256(filepath), expected_sha256)
+
+def verify_sha256_digest(filepath, calculated_sha256, expected_sha256):
+    """Compares a digest computed elsewhere (e.g. while downloading) with the expected one."""
     log(f"Verifying SHA256 for {os.path.basename(filepath)}...")
-    calculated_sha256 = calculate_sha256(filepath)
     print(f"Visual Hash: {get_visual_hash(calculated_sha256)}")
     
     if calculated_sha256.lower() == expected_sha256.lower():
@@ -26,58 +170,134 @@ def verify_zip_sha256(filepath, expected_sha256):
         log_error(f"SHA256 Mismatch! Expected: {expected_sha256}, Got: {calculated_sha256}")
         return None
 
-def verify_zip_integrity(filepath):
-    log(f"Verifying integrity of ZIP: {filepath}")
+def zip_data_offset(mapped, info):
+    """
+    Offset of a member's data in the mapped zip, read from its local header.
+    Raises zipfile.BadZipFile if the header is bad or the data is truncated.
+    """
+    file_size = len(mapped)
+    offset = info.header_offset
+    if offset + _ZIP_LOCAL_HEADER.size > file_size:
+        raise zipfile.BadZipFile(f"{info.filename}: local header is past the end of the file")
+    signature, *_, name_length, extra_length = _ZIP_LOCAL_HEADER.unpack_from(mapped, offset)
+    if signature != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"{info.filename}: bad local header signature")
+    name_start = offset + _ZIP_LOCAL_HEADER.size
+    name = mapped[name_start:name_start + name_length].decode("utf-8" if info.flag_bits & 0x800 else "cp437")
+    if name != info.orig_filename:
+        raise zipfile.BadZipFile(f"{info.filename}: local header names {name!r}")
+    data_offset = name_start + name_length + extra_length
+    if data_offset + info.compress_size > file_size:
+        raise zipfile.BadZipFile(f"{info.filename}: data is truncated")
+    if info.compress_type == zipfile.ZIP_STORED and info.compress_size != info.file_size:
+        raise zipfile.BadZipFile(f"{info.filename}: stored member with mismatched sizes")
+    return data_offset
+
+def _zip_member_layout(mapped, zf):
+    """
+    (ZipInfo, data offset) of every member in file order, cross-checked against the
+    local headers. Raises zipfile.BadZipFile on truncation, bad headers or overlaps.
+    """
+    members = [(info, zip_data_offset(mapped, info)) for info in zf.infolist()]
+
+    members.sort(key=lambda member: member[1])
+    for (info, data_offset), (following, _) in zip(members, members[1:]):
+        if data_offset + info.compress_size > following.header_offset:
+            raise zipfile.BadZipFile(f"{info.filename} overlaps {following.filename}")
+    return members
+
+def _crc32_range(mapped, start, length):
+    # Slices of a memoryview share the mapping, so the bytes are never copied;
+    # zlib releases the GIL while it checksums them.
+    with memoryview(mapped) as view, view[start:start + length] as data:
+        return zlib.crc32(data)
+
+def _crc32_deflated(mapped, start, length):
+    """(CRC32, size) of a raw-deflated member, inflated piece by piece."""
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    crc, size = 0, 0
+    with memoryview(mapped) as view:
+        for position in range(start, start + length, ZIP_VERIFY_CHUNK_SIZE):
+            with view[position:min(position + ZIP_VERIFY_CHUNK_SIZE, start + length)] as piece:
+                data = piece
+                while data:
+                    out = decompressor.decompress(data, ZIP_VERIFY_CHUNK_SIZE)
+                    crc = zlib.crc32(out, crc)
+                    size += len(out)
+                    data = decompressor.unconsumed_tail
+        out = decompressor.flush()
+    if not decompressor.eof:
+        raise zipfile.BadZipFile("deflate stream is truncated")
+    return zlib.crc32(out, crc), size + len(out)
+
+def _crc32_other(filepath, info):
+    """Other compression methods go through zipfile, which raises on a CRC mismatch."""
+    with zipfile.ZipFile(filepath) as zf, zf.open(info) as member:
+        while member.read(ZIP_VERIFY_CHUNK_SIZE):
+            pass
+    return info.CRC, info.file_size
+
+def _check_member_crcs(filepath, mapped, members, workers):
+    """Names of members whose CRC32 or size does not match the central directory."""
+    bad = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zipcheck") as pool:
+        jobs = []
+        for info, data_offset in members:
+            if info.flag_bits & 0x1:
+                log(f"⚠️  {info.filename} is encrypted; CRC not checked.")
+            elif info.compress_type == zipfile.ZIP_STORED:
+                # Large stored members (payload.bin) are split so every core checksums a part.
+                ranges = [(offset, min(ZIP_VERIFY_CHUNK_SIZE, data_offset + info.file_size - offset))
+                          for offset in range(data_offset, data_offset + info.file_size, ZIP_VERIFY_CHUNK_SIZE)]
+                futures = [pool.submit(_crc32_range, mapped, offset, length) for offset, length in ranges]
+                jobs.append((info, "stored", list(zip(futures, (length for _, length in ranges)))))
+            elif info.compress_type == zipfile.ZIP_DEFLATED:
+                jobs.append((info, "deflated", pool.submit(_crc32_deflated, mapped, data_offset, info.compress_size)))
+            else:
+                jobs.append((info, "other", pool.submit(_crc32_other, filepath, info)))
+
+        for info, kind, job in jobs:
+            try:
+                if kind == "stored":
+                    crc = 0
+                    for future, length in job:
+                        crc = crc_combine(crc, future.result(), length, CRC32_POLY)
+                    size = info.file_size
+                else:
+                    crc, size = job.result()
+            except (zipfile.BadZipFile, zlib.error) as e:
+                log_error(f"{info.filename}: {e}")
+                bad.append(info.filename)
+                continue
+            if crc != info.CRC or size != info.file_size:
+                log_error(f"{info.filename}: CRC32 {crc:08x} / {size} bytes, expected {info.CRC:08x} / {info.file_size}")
+                bad.append(info.filename)
+    return bad
+
+def verify_zip_integrity(filepath, mode="full", workers=None):
+    """
+    Checks a ZIP without extracting it. "structural" validates the central directory
+    against the local headers (offsets, names, sizes, overlaps); "full" also checks the
+    CRC32 of every member on a thread pool, reading stored members straight from an
+    mmap of the file. Returns True when the archive is intact.
+    """
+    log(f"Verifying integrity of ZIP ({mode}): {os.path.basename(filepath)}")
     if not zipfile.is_zipfile(filepath):
         log_error("File is not a valid ZIP.")
         return False
     try:
-        with zipfile.ZipFile(filepath, 'r') as zip_ref:
-            ret = zip_ref.testzip()
-            if ret is not None:
-                log_error(f"First bad file in zip: {ret}")
-                return False
+        with open(filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with zipfile.ZipFile(filepath) as zf:
+                members = _zip_member_layout(mapped, zf)
+            if mode == "full":
+                if hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_WILLNEED)
+                bad = _check_member_crcs(filepath, mapped, members, workers or ZIP_VERIFY_WORKERS)
+                if bad:
+                    log_error(f"First bad file in zip: {bad[0]} ({len(bad)} bad member(s))")
+                    return False
+        print_status("ZIP", "SUCCESS", f"{len(members)} member(s) intact ({mode})", Color.GREEN)
         return True
     except Exception as e:
         log_error(f"ZIP integrity check error: {e}")
         return False
-
-def check_smart_cache(input_file_sha, key_hash): 
-    # Use output directory to look for previous builds
-    mapping_file = "/app/output/input_map.json"
-    if not os.path.exists(mapping_file):
-        return None
-        
-    try:
-        with open(mapping_file, 'r') as f:
-            mapping = json.load(f)
-            
-        composite_key = f"{input_file_sha}_{key_hash}"
-        
-        if composite_key in mapping:
-            output_filename = mapping[composite_key]
-            full_path = os.path.join("/app/output", output_filename)
-            if os.path.exists(full_path):
-                return output_filename
-    except:
-        pass
-        
-    return None
-
-def update_smart_cache(input_file_sha, key_hash, output_filename):
-    mapping_file = "/app/output/input_map.json"
-    mapping = {}
-    
-    if os.path.exists(mapping_file):
-        try:
-            with open(mapping_file, 'r') as f:
-                mapping = json.load(f)
-        except: pass
-        
-    composite_key = f"{input_file_sha}_{key_hash}"
-    mapping[composite_key] = output_filename
-    
-    try:
-        with open(mapping_file, 'w') as f:
-            json.dump(mapping, f, indent=4)
-    except: pass
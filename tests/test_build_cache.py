@@ -0,0 +1,29 @@
+import json
+
+import build_cache
+from storage_backend import LocalBackend
+
+
+def _entry(blob):
+    return build_cache.make_entry("frankel", "ksu_patched_a.zip", "ab" * 32, f"/{blob}", blob)
+
+
+def test_store_keeps_a_live_entry(tmp_path):
+    backend = LocalBackend(tmp_path / "bucket")
+    backend.put_bytes("builds/first.zip", b"zip")
+    build_cache.store(backend, "k" * 64, _entry("builds/first.zip"))
+    build_cache.store(backend, "k" * 64, _entry("builds/second.zip"))
+
+    assert build_cache.lookup(backend, "k" * 64)["output"]["blob"] == "builds/first.zip"
+
+
+def test_store_repairs_an_entry_whose_output_is_gone(tmp_path):
+    backend = LocalBackend(tmp_path / "bucket")
+    build_cache.store(backend, "k" * 64, _entry("builds/deleted.zip"))
+    assert build_cache.lookup(backend, "k" * 64) is None
+
+    backend.put_bytes("builds/rebuilt.zip", b"zip")
+    build_cache.store(backend, "k" * 64, _entry("builds/rebuilt.zip"))
+
+    assert build_cache.lookup(backend, "k" * 64)["output"]["blob"] == "builds/rebuilt.zip"
+    assert json.loads(backend.get_bytes(f"{build_cache.BUILD_CACHE_PREFIX}{'k' * 64}.json"))["device"] == "frankel"
@@ -0,0 +1,48 @@
+import json
+
+import build_index
+from storage_backend import LocalBackend
+
+
+def _entry(device, filename, timestamp):
+    return {"device": device, "filename": filename, "url": f"/builds/{filename}", "timestamp": timestamp}
+
+
+def test_publish_keeps_builds_from_a_pre_sharded_rollup(tmp_path):
+    backend = LocalBackend(tmp_path / "bucket")
+    old = [_entry("frankel", f"ksu_patched_old{i}.zip", f"2025-01-0{i + 1}T00:00:00+00:00") for i in range(5)]
+    old.append(_entry("husky", "ksu_patched_h.zip", "2025-01-03T12:00:00+00:00"))
+    backend.put_bytes(build_index.ROLLUP_BLOB, json.dumps(old), content_type="application/json")
+
+    build_index.publish(backend, _entry("frankel", "ksu_patched_new.zip", "2025-02-01T00:00:00+00:00"))
+
+    rollup = json.loads(backend.get_bytes(build_index.ROLLUP_BLOB))
+    filenames = [x["filename"] for x in rollup]
+    assert filenames[0] == "ksu_patched_new.zip"
+    assert sorted(filenames) == sorted(["ksu_patched_new.zip", "ksu_patched_h.zip"]
+                                       + [f"ksu_patched_old{i}.zip" for i in range(5)])
+    shard = json.loads(backend.get_bytes(f"{build_index.DEVICE_SHARD_PREFIX}frankel.json"))
+    assert len(shard) == 6
+
+
+def test_publish_does_not_reseed_an_existing_shard(tmp_path):
+    backend = LocalBackend(tmp_path / "bucket")
+    build_index.publish(backend, _entry("frankel", "ksu_patched_a.zip", "2025-01-01T00:00:00+00:00"))
+    build_index.publish(backend, _entry("frankel", "ksu_patched_b.zip", "2025-01-02T00:00:00+00:00"))
+
+    rollup = json.loads(backend.get_bytes(build_index.ROLLUP_BLOB))
+    assert [x["filename"] for x in rollup] == ["ksu_patched_b.zip", "ksu_patched_a.zip"]
+
+
+def test_lookup_migrates_a_device_from_the_rollup_once(tmp_path, monkeypatch):
+    backend = LocalBackend(tmp_path / "bucket")
+    old = [_entry("frankel", "ksu_patched_old.zip", "2025-01-01T00:00:00+00:00")]
+    backend.put_bytes(build_index.ROLLUP_BLOB, json.dumps(old), content_type="application/json")
+
+    assert build_index.lookup(backend, "ksu_patched_old.zip", "frankel")["url"] == "/builds/ksu_patched_old.zip"
+
+    reads = []
+    real_get_bytes = backend.get_bytes
+    monkeypatch.setattr(backend, "get_bytes", lambda name, **kw: reads.append(name) or real_get_bytes(name, **kw))
+    assert build_index.lookup(backend, "ksu_patched_new.zip", "frankel") is None
+    assert build_index.ROLLUP_BLOB not in reads
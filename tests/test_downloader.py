@@ -0,0 +1,133 @@
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import downloader
+import verifier
+
+SIZE = 1024 * 1024
+
+
+class FlakyServer:
+    """Serves one blob with Range support; the first `drops` ranged responses stop halfway."""
+
+    def __init__(self, data, drops=0):
+        self.data = data
+        self.drops = drops
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+                start, end = (int(match[1]), int(match[2]) + 1) if match else (0, len(server.data))
+                body = server.data[start:end]
+                with server.lock:
+                    drop = end - start > 1 and server.drops > 0
+                    server.drops -= drop
+                self.send_response(206 if match else 200)
+                self.send_header("Content-Length", str(len(body)))
+                if match:
+                    self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(server.data)}")
+                self.end_headers()
+                if drop:
+                    body = body[:len(body) // 2]
+                    self.close_connection = True
+                self.wfile.write(body)
+                with server.lock:
+                    server.bytes_sent += len(body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/ota.zip"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def quick(tmp_path, monkeypatch):
+    """Small segments, no retry back-off and a digest cache inside tmp_path."""
+    monkeypatch.setattr(downloader, "DOWNLOAD_MIN_SEGMENT_SIZE", 64 * 1024)
+    monkeypatch.setattr(downloader.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(verifier, "DIGEST_CACHE_FILE", str(tmp_path / "digest_cache.json"))
+
+
+def test_segments_cut_off_midway_are_resumed(tmp_path, quick):
+    data = os.urandom(SIZE)
+    server = FlakyServer(data, drops=3)
+    try:
+        target = tmp_path / "ota.zip"
+        sha256 = downloader.download_file(server.url, str(target), segments=4, chunk_size=16 * 1024)
+    finally:
+        server.close()
+
+    assert sha256 == hashlib.sha256(data).hexdigest()
+    assert target.read_bytes() == data
+    assert not os.path.exists(f"{target}.part.json")
+
+
+def test_interrupted_download_resumes_from_its_sidecar(tmp_path, quick, monkeypatch):
+    data = os.urandom(SIZE)
+    target = tmp_path / "ota.zip"
+    monkeypatch.setattr(downloader, "DOWNLOAD_RETRIES", 0)
+    server = FlakyServer(data, drops=1)
+    try:
+        with pytest.raises((requests.RequestException, IOError)):
+            downloader.download_file(server.url, str(target), segments=4, chunk_size=16 * 1024)
+        assert os.path.exists(f"{target}.part") and os.path.exists(f"{target}.part.json")
+
+        first_run = server.bytes_sent
+        sha256 = downloader.download_file(server.url, str(target), segments=4, chunk_size=16 * 1024)
+    finally:
+        server.close()
+
+    assert sha256 == hashlib.sha256(data).hexdigest()
+    assert target.read_bytes() == data
+    # Only what the first run did not keep is fetched again (plus the one-byte probe).
+    assert server.bytes_sent - first_run < SIZE
+
+
+class _Collector:
+    def __init__(self):
+        self.data = bytearray()
+        self.aborted = False
+
+    def write(self, chunk):
+        self.data += chunk
+
+    def abort(self):
+        self.aborted = True
+
+
+def test_out_of_order_segments_hash_in_file_order(tmp_path):
+    data = os.urandom(SIZE)
+    chunk = 64 * 1024
+    fd = os.open(tmp_path / "ota.zip.part", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(fd, SIZE)
+        sink = _Collector()
+        # The first 64 KiB survived a previous run; the rest lands back to front.
+        os.pwrite(fd, data[:chunk], 0)
+        hasher = downloader._SequentialHasher(fd, SIZE, [(0, chunk)], [sink])
+        for pos in reversed(range(chunk, SIZE, chunk)):
+            os.pwrite(fd, data[pos:pos + chunk], pos)
+            hasher.feed(pos, data[pos:pos + chunk])
+        digest = hasher.hexdigest()
+    finally:
+        os.close(fd)
+
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert bytes(sink.data) == data and not sink.aborted
@@ -0,0 +1,11 @@
+import metrics
+
+
+def test_prometheus_label_values_are_escaped(tmp_path):
+    registry = metrics.MetricsRegistry()
+    registry.increment("stage_failures", {"error": 'bad "path" C:\\tmp\nnext line'})
+    path = tmp_path / "metrics.prom"
+    metrics.PrometheusTextExporter(str(path)).export(registry.drain())
+
+    line = next(l for l in path.read_text().splitlines() if l.startswith("pixel_automator_stage_failures_total"))
+    assert line == 'pixel_automator_stage_failures_total{error="bad \\"path\\" C:\\\\tmp\\nnext line"} 1'
@@ -0,0 +1,109 @@
+import hashlib
+import lzma
+import struct
+import zipfile
+
+import pytest
+
+import payload_verifier
+from payload_verifier import OP_REPLACE, OP_REPLACE_XZ, PayloadError
+
+BLOCK = 4096
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        out.append(byte | 0x80 if value else byte)
+        if not value:
+            return bytes(out)
+
+
+def _field(number, value):
+    if isinstance(value, int):
+        return _varint(number << 3) + _varint(value)
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def _extent(start, count):
+    return _field(1, start) + _field(2, count)
+
+
+def _partition(name, blocks, verity=False):
+    """A partition written by one REPLACE and one REPLACE_XZ operation; returns (message, data blobs)."""
+    first, second = b"\x11" * BLOCK, b"\x22" * (blocks - 1) * BLOCK
+    blobs = [first, lzma.compress(second)]
+    content = first + second
+    info = _field(1, len(content)) + _field(2, hashlib.sha256(content).digest())
+    message = _field(1, name.encode()) + _field(7, info)
+    for op_type, blob, extent in ((OP_REPLACE, blobs[0], _extent(0, 1)), (OP_REPLACE_XZ, blobs[1], _extent(1, blocks - 1))):
+        message += _field(8, _field(1, op_type) + _field(3, len(blob)) + _field(6, extent)
+                          + _field(8, hashlib.sha256(blob).digest()))
+    if verity:
+        message += _field(11, _extent(blocks, 1)) + _field(15, _extent(blocks + 1, 1))
+    return message, blobs
+
+
+def _manifest(partitions):
+    """Serializes partitions with data offsets assigned in order; returns (manifest, data)."""
+    manifest, data = _field(3, BLOCK), b""
+    for message, blobs in partitions:
+        rewritten = b""
+        for number, value in payload_verifier._fields(message):
+            if number == 8:
+                blob = blobs.pop(0)
+                value = _field(2, len(data)) + value
+                data += blob
+            rewritten += _field(number, value)
+        manifest += _field(13, rewritten)
+    return manifest, data
+
+
+def _ota(tmp_path, manifest, data):
+    payload = struct.pack(">4sQQL", b"CrAU", 2, len(manifest), 0) + manifest + data
+    path = tmp_path / "ota.zip"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr("payload.bin", payload)
+    return str(path)
+
+
+def test_parse_manifest_reads_partitions_and_operations():
+    manifest, _ = _manifest([_partition("init_boot", 3, verity=True)])
+    parsed = payload_verifier.parse_manifest(manifest)
+    partition, = parsed["partitions"]
+    assert parsed["block_size"] == BLOCK
+    assert partition["name"] == "init_boot" and partition["size"] == 3 * BLOCK
+    assert [op["type"] for op in partition["operations"]] == [OP_REPLACE, OP_REPLACE_XZ]
+    assert partition["operations"][1]["data_offset"] == BLOCK
+    assert partition["operations"][1]["dst_extents"] == [(1, 2)]
+    assert partition["hash_tree_extent"] == (3, 1) and partition["fec_extent"] == (4, 1)
+
+
+def test_truncated_manifest_is_rejected():
+    manifest, _ = _manifest([_partition("init_boot", 2)])
+    with pytest.raises(PayloadError):
+        payload_verifier.parse_manifest(manifest[:-5])
+
+
+@pytest.mark.parametrize("mode", ["operations", "full"])
+def test_valid_payload_passes(tmp_path, mode):
+    path = _ota(tmp_path, *_manifest([_partition("init_boot", 2), _partition("vendor_boot", 4)]))
+    report = payload_verifier.verify_payload(path, mode, workers=2)
+    assert report["status"] == "ok"
+    assert {entry["status"] for entry in report["partitions"].values()} == {"ok"}
+
+
+def test_corrupt_operation_data_fails(tmp_path):
+    manifest, data = _manifest([_partition("init_boot", 2)])
+    data = b"\x00" + data[1:]
+    report = payload_verifier.verify_payload(_ota(tmp_path, manifest, data), "operations", workers=2)
+    assert report["status"] == "failed"
+    assert report["partitions"]["init_boot"]["status"] == "corrupt"
+
+
+def test_full_mode_leaves_verity_partitions_unchecked(tmp_path):
+    path = _ota(tmp_path, *_manifest([_partition("system", 2, verity=True)]))
+    report = payload_verifier.verify_payload(path, "full", workers=2)
+    assert report["status"] == "ok"
+    assert report["partitions"]["system"]["status"] == "unchecked"
@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+import pipeline
+from pipeline import Stage
+
+
+def _graph(calls, fail=None):
+    def stage(name):
+        def func(results):
+            calls.append((name, sorted(results)))
+            if name == fail:
+                raise RuntimeError(f"{name} broke")
+            return name.upper()
+        return func
+    return [
+        Stage("download", stage("download")),
+        Stage("patch", stage("patch"), deps=["download"]),
+        Stage("hash", stage("hash"), deps=["patch"]),
+        Stage("extract", stage("extract"), deps=["patch"]),
+        Stage("upload", stage("upload"), deps=["hash", "extract"]),
+    ]
+
+
+@pytest.mark.parametrize("run", [pipeline.run_stage_graph, pipeline.run_async_stage_graph])
+def test_stages_see_the_results_of_their_dependencies(run):
+    calls = []
+    results = run(_graph(calls))
+
+    assert results == {name: name.upper() for name in ("download", "patch", "hash", "extract", "upload")}
+    seen = dict(calls)
+    assert seen["patch"] == ["download"]
+    assert {"hash", "extract"} <= set(seen["upload"])
+
+
+@pytest.mark.parametrize("run", [pipeline.run_stage_graph, pipeline.run_async_stage_graph])
+def test_a_failed_stage_stops_its_dependents(run):
+    calls = []
+    with pytest.raises(RuntimeError, match="patch broke"):
+        run(_graph(calls, fail="patch"))
+
+    assert [name for name, _ in calls] == ["download", "patch"]
+
+
+def test_async_failure_cancels_stages_still_waiting():
+    release = threading.Event()
+    started = []
+
+    def slow(results):
+        started.append("slow")
+        release.wait(5)
+
+    def fail(results):
+        raise SystemExit(1)
+
+    def after_slow(results):
+        started.append("after_slow")
+
+    stages = [Stage("slow", slow), Stage("fail", fail), Stage("after_slow", after_slow, deps=["slow"])]
+    try:
+        with pytest.raises(SystemExit):
+            pipeline.run_async_stage_graph(stages)
+    finally:
+        release.set()
+    assert "after_slow" not in started
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError, match="unknown"):
+        pipeline.run_stage_graph([Stage("upload", lambda results: None, deps=["hash"])])
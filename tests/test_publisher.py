@@ -0,0 +1,29 @@
+import os
+
+import publisher
+
+
+def _unsupported(*args):
+    raise OSError("not supported here")
+
+
+def test_short_copy_file_range_falls_back_to_a_full_copy(tmp_path, monkeypatch):
+    src = tmp_path / "src.bin"
+    src.write_bytes(os.urandom(3 * 1024 * 1024))
+    real_copy_file_range = os.copy_file_range
+    calls = []
+
+    def short_copy(src_fd, dst_fd, count):
+        # The first call copies part of the file, then the kernel reports end of data.
+        calls.append(count)
+        return real_copy_file_range(src_fd, dst_fd, 1024 * 1024) if len(calls) == 1 else 0
+
+    monkeypatch.setattr(publisher, "_reflink", _unsupported)
+    monkeypatch.setattr(os, "link", _unsupported)
+    monkeypatch.setattr(os, "copy_file_range", short_copy)
+
+    dest = publisher.publish_file(str(src), str(tmp_path / "out"))
+
+    assert len(calls) == 2
+    assert open(dest, "rb").read() == src.read_bytes()
+    assert not [name for name in os.listdir(tmp_path / "out") if name.endswith(".publishing")]
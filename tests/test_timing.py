@@ -0,0 +1,14 @@
+import timing
+
+
+def test_device_timer_leaves_inherited_stages_to_the_run():
+    run_timer = timing.StageTimer()
+    run_timer.record("page_poll", 0.5)
+    run_timer.record("scrape", 1.0)
+
+    device_timer = timing.StageTimer(run_timer.summary())
+    device_timer.record("download", 2.0)
+    device_timer.record("scrape", 0.25)
+
+    assert set(device_timer.summary()) == {"page_poll", "scrape", "download"}
+    assert set(device_timer.summary(include_inherited=False)) == {"scrape", "download"}
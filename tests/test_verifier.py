@@ -0,0 +1,71 @@
+import hashlib
+import os
+import zipfile
+
+import pytest
+
+import verifier
+
+
+def test_sha256_result_is_reported_once(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(verifier, "DIGEST_CACHE_FILE", str(tmp_path / "digest_cache.json"))
+    path = tmp_path / "ota.zip"
+    path.write_bytes(b"ota")
+    digest = hashlib.sha256(b"ota").hexdigest()
+
+    assert verifier.verify_zip_sha256(str(path), digest.upper()) == digest
+    assert verifier.verify_zip_sha256(str(path), "0" * 64) is None
+    output = capsys.readouterr().out
+    assert output.count("Verifying SHA256 for ota.zip") == 2
+    assert output.count("SHA256 Match") == 1
+    assert output.count("SHA256 Mismatch") == 1
+
+
+def _zip(path, members):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data, compression in members:
+            zf.writestr(zipfile.ZipInfo(name), data, compress_type=compression)
+    return str(path)
+
+
+def _flip_byte(path, data):
+    raw = bytearray(open(path, "rb").read())
+    raw[raw.index(data) + len(data) // 2] ^= 0xFF
+    open(path, "wb").write(bytes(raw))
+
+
+def test_zip_with_intact_members_passes(tmp_path):
+    path = _zip(tmp_path / "ota.zip", [("payload.bin", os.urandom(256 * 1024), zipfile.ZIP_STORED),
+                                       ("META-INF/com/android/metadata", b"ota-type=AB\n" * 100, zipfile.ZIP_DEFLATED)])
+    assert verifier.verify_zip_integrity(path, "full", workers=2)
+
+
+@pytest.mark.parametrize("mode, detected", [("full", True), ("structural", False)])
+def test_corrupted_stored_member_fails_its_crc(tmp_path, mode, detected):
+    payload = os.urandom(256 * 1024)
+    path = _zip(tmp_path / "ota.zip", [("payload.bin", payload, zipfile.ZIP_STORED)])
+    _flip_byte(path, payload)
+
+    assert verifier.verify_zip_integrity(path, mode, workers=2) is not detected
+
+
+def test_corrupted_deflated_member_fails(tmp_path):
+    path = _zip(tmp_path / "ota.zip", [("care_map.pb", bytes(range(256)) * 512, zipfile.ZIP_DEFLATED)])
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo("care_map.pb")
+    raw = bytearray(open(path, "rb").read())
+    raw[info.header_offset + 30 + len(info.filename) + info.compress_size // 2] ^= 0xFF
+    open(path, "wb").write(bytes(raw))
+
+    assert not verifier.verify_zip_integrity(path, "full", workers=2)
+
+
+def test_truncated_zip_fails_the_structural_check(tmp_path):
+    path = _zip(tmp_path / "ota.zip", [("payload.bin", os.urandom(64 * 1024), zipfile.ZIP_STORED)])
+    raw = open(path, "rb").read()
+    # Keep the central directory but drop the tail of the member data in front of it.
+    with zipfile.ZipFile(path) as zf:
+        cd_offset = zf.start_dir
+    open(path, "wb").write(raw[:cd_offset - 4096] + raw[cd_offset:])
+
+    assert not verifier.verify_zip_integrity(path, "structural")